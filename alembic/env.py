@@ -32,9 +32,11 @@ from cnaas_nms.db.linknet import Linknet
 from cnaas_nms.db.mgmtdomain import Mgmtdomain
 from cnaas_nms.db.interface import Interface
 from cnaas_nms.db.stackmember import Stackmember
-from cnaas_nms.db.joblock import Joblock
+from cnaas_nms.db.joblock import Joblock, DeviceLock
 from cnaas_nms.db.job import Job
 from cnaas_nms.db.reservedip import ReservedIP
+from cnaas_nms.db.config_artifact import ConfigArtifact
+from cnaas_nms.db.config_revision import DeviceConfigRevision
 
 
 target_metadata = Base.metadata
@@ -15,10 +15,13 @@ import cnaas_nms.confpush.underlay
 import cnaas_nms.confpush.get
 import cnaas_nms.confpush.update
 from cnaas_nms.confpush.nornir_helper import cnaas_init, inventory_selector
-from cnaas_nms.api.generic import build_filter, empty_result, pagination_headers
+from cnaas_nms.api.generic import build_filter, empty_result, pagination_headers, limit_results, \
+    get_projection, apply_projection, total_count_column, use_estimated_count, estimated_count, \
+    total_count_needed
 from cnaas_nms.db.device import Device, DeviceState, DeviceType
 from cnaas_nms.db.stackmember import Stackmember
 from cnaas_nms.db.job import Job, JobNotFoundError, InvalidJobError
+from cnaas_nms.db.config_revision import DeviceConfigRevision
 from cnaas_nms.db.session import sqla_session
 from cnaas_nms.db.settings import get_groups, get_device_primary_groups, \
     update_device_primary_groups, rebuild_settings_cache, \
@@ -149,11 +152,16 @@ delete_device_model = device_api.model('delete_devcie', {
 })
 
 
-def device_data_postprocess(device_list: List[Device]) -> List[dict]:
+def device_data_postprocess(device_list: List[Device],
+                            fields: Optional[List[str]] = None) -> List[dict]:
     device_primary_group = get_device_primary_groups()
     ret: List[dict] = []
     for device in device_list:
-        dev_dict = device.as_dict()
+        dev_dict = device.as_dict(fields)
+        # Don't lazy load hostname if it was not selected
+        if fields is not None and 'hostname' not in fields:
+            ret.append(dev_dict)
+            continue
         if device.hostname in device_primary_group.keys():
             dev_dict['primary_group'] = device_primary_group[device.hostname]
         ret.append(dev_dict)
@@ -313,21 +321,30 @@ class DevicesApi(Resource):
         """ Get all devices """
         device_list: List[Device] = []
         total_count = 0
+        last_id = None
         with sqla_session() as session:
-            query = session.query(Device, func.count(Device.id).over().label('total'))
+            query = session.query(Device, total_count_column(Device))
             try:
+                fields = get_projection(Device)
+                query = apply_projection(Device, query, fields)
                 query = build_filter(Device, query)
+                if use_estimated_count() and total_count_needed():
+                    total_count = estimated_count(query)
             except Exception as e:
                 return empty_result(status='error',
                                     data="Unable to filter devices: {}".format(e)), 400
             for instance in query:
                 device_list.append(instance.Device)
-                total_count = instance.total
-            data = {'devices': device_data_postprocess(device_list)}
+                if not use_estimated_count():
+                    total_count = instance.total
+                last_id = instance.Device.id
+            if len(device_list) < limit_results():
+                last_id = None
+            data = {'devices': device_data_postprocess(device_list, fields)}
 
         resp = make_response(json.dumps(empty_result(status='success', data=data)), 200)
         resp.headers['Content-Type'] = 'application/json'
-        resp.headers = {**resp.headers, **pagination_headers(total_count)}
+        resp.headers = {**resp.headers, **pagination_headers(total_count, last_id)}
         return resp
 
 
@@ -944,6 +961,40 @@ class DevicePreviousConfigApi(Resource):
         return res, 200
 
 
+class DeviceConfigHistoryApi(Resource):
+    @jwt_required
+    def get(self, hostname: str):
+        """ List config revisions from previous syncto jobs for device """
+        if not Device.valid_hostname(hostname):
+            return empty_result(
+                status='error',
+                data=f"Invalid hostname specified"
+            ), 400
+
+        data = {'revisions': []}
+        total_count = 0
+        with sqla_session() as session:
+            query = session.query(DeviceConfigRevision, func.count(DeviceConfigRevision.id).
+                                  over().label('total')).\
+                filter(DeviceConfigRevision.hostname == hostname)
+            # Newest revisions first unless other sort order is requested
+            if 'sort' not in request.args:
+                query = query.order_by(DeviceConfigRevision.job_id.desc())
+            try:
+                query = build_filter(DeviceConfigRevision, query)
+            except Exception as e:
+                return empty_result(status='error',
+                                    data="Unable to filter config revisions: {}".format(e)), 400
+            for instance in query:
+                data['revisions'].append(instance.DeviceConfigRevision.as_dict())
+                total_count = instance.total
+
+        resp = make_response(json.dumps(empty_result(status='success', data=data)), 200)
+        resp.headers['Content-Type'] = 'application/json'
+        resp.headers = {**resp.headers, **pagination_headers(total_count)}
+        return resp
+
+
 class DeviceApplyConfigApi(Resource):
     @jwt_required
     @device_api.expect(device_apply_config_model)
@@ -1118,6 +1169,7 @@ device_api.add_resource(DeviceByIdApi, '/<int:device_id>')
 device_api.add_resource(DeviceByHostnameApi, '/<string:hostname>')
 device_api.add_resource(DeviceConfigApi, '/<string:hostname>/generate_config')
 device_api.add_resource(DevicePreviousConfigApi, '/<string:hostname>/previous_config')
+device_api.add_resource(DeviceConfigHistoryApi, '/<string:hostname>/config_history')
 device_api.add_resource(DeviceApplyConfigApi, '/<string:hostname>/apply_config')
 device_api.add_resource(DeviceApi, '')
 devices_api.add_resource(DevicesApi, '')
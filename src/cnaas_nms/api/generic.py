@@ -1,10 +1,12 @@
 import re
+import json
 import urllib
 import math
-from typing import List
+from typing import List, Optional
 
 from flask import request
 import sqlalchemy
+from sqlalchemy.orm import load_only
 
 from cnaas_nms.db.settings import get_pydantic_error_value, get_pydantic_field_descr
 
@@ -58,7 +60,86 @@ def offset_results() -> int:
     return offset
 
 
-def pagination_headers(total_count) -> dict:
+def after_id_results() -> Optional[int]:
+    """Find id to continue listing results after for keyset pagination,
+    if requested by user."""
+    args = request.args
+    if 'after_id' not in args:
+        return None
+    try:
+        return int(args['after_id'])
+    except ValueError:
+        raise ValueError("after_id argument must be integer")
+
+
+def use_estimated_count() -> bool:
+    """Check if user requested an estimated total count instead of an exact
+    count."""
+    return request.args.get('count', '').lower() == 'estimated'
+
+
+def total_count_needed() -> bool:
+    """Check if total number of results should be calculated. It's not
+    calculated for keyset pagination, since that would need a full count
+    for every page."""
+    return 'after_id' not in request.args
+
+
+def total_count_column(f_class):
+    """Column for total number of results matching filter, counted by the
+    database unless an estimated count was requested or no count is needed."""
+    if use_estimated_count() or not total_count_needed():
+        return sqlalchemy.literal(0).label('total')
+    return sqlalchemy.func.count(f_class.id).over().label('total')
+
+
+def estimated_count(query: sqlalchemy.orm.query.Query) -> int:
+    """Get query planner estimate of the number of results matching query,
+    ignoring limit and offset."""
+    query = query.limit(None).offset(None)
+    session = query.session
+    compiled = query.statement.compile(dialect=session.bind.dialect)
+    res = session.connection().exec_driver_sql(
+        "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    if isinstance(res, str):
+        res = json.loads(res)
+    return int(res[0]['Plan']['Plan Rows'])
+
+
+def get_projection(f_class) -> Optional[List[str]]:
+    """Get names of columns to fetch and return based on fields and exclude
+    query string arguments, or None if all columns should be returned.
+    The id column is always included.
+
+    Raises:
+        ValueError
+    """
+    args = request.args
+    if 'fields' not in args and 'exclude' not in args:
+        return None
+    columns = list(f_class.__table__._columns.keys())
+    selected = {}
+    for arg in ['fields', 'exclude']:
+        selected[arg] = [x.strip() for x in args.get(arg, '').split(',') if x.strip()]
+        for column in selected[arg]:
+            if column not in columns:
+                raise ValueError("{} is not a valid attribute for {}".format(column, arg))
+    fields = selected['fields'] or columns
+    return [x for x in columns if x == 'id' or (x in fields and x not in selected['exclude'])]
+
+
+def apply_projection(f_class, query: sqlalchemy.orm.query.Query,
+                     fields: Optional[List[str]]) -> sqlalchemy.orm.query.Query:
+    """Only load the specified columns from database."""
+    if fields is None:
+        return query
+    return query.options(load_only(*[getattr(f_class, x) for x in fields]))
+
+
+def pagination_headers(total_count, last_id: Optional[int] = None) -> dict:
+    """Get pagination headers. When keyset pagination is used last_id
+    should be the id of the last result on a full page, and no total count
+    header is included."""
     per_page = DEFAULT_PER_PAGE
     page_arg = 1
     links = []
@@ -75,6 +156,15 @@ def pagination_headers(total_count) -> dict:
         except (AssertionError, ValueError):
             pass
 
+    if 'after_id' in args:
+        del headers["X-Total-Count"]
+        if last_id is not None:
+            query = {k: v for k, v in request.args.items() if k != 'page'}
+            headers["Link"] = '<{}>; rel="next"'.format(
+                request.base_url + "?" + urllib.parse.urlencode({**query, "after_id": last_id})
+            )
+        return headers
+
     last_page = math.ceil(total_count / per_page)
     if last_page == 1:
         return headers
@@ -164,6 +254,19 @@ def build_filter(f_class, query: sqlalchemy.orm.query.Query):
             order = sqlalchemy.asc
             f_class_order_by_field = getattr(f_class, 'id')
             query = query.order_by(order(f_class_order_by_field))
+
+    # Keyset pagination, continue after the last id from previous page
+    after_id = after_id_results()
+    if after_id is not None:
+        if 'id' not in f_class.__table__._columns.keys() or \
+                f_class_order_by_field is not getattr(f_class, 'id'):
+            raise ValueError("after_id can only be used when sorting by id")
+        if order == sqlalchemy.desc:
+            query = query.filter(getattr(f_class, 'id') < after_id)
+        else:
+            query = query.filter(getattr(f_class, 'id') > after_id)
+        return query.limit(limit_results())
+
     query = query.limit(limit_results())
     query = query.offset(offset_results())
     return query
@@ -5,7 +5,7 @@ from flask_restx import Namespace, Resource
 
 from cnaas_nms.db.device import Device, DeviceState
 from cnaas_nms.api.generic import empty_result
-from cnaas_nms.db.settings import get_groups, get_group_settings, get_group_regex
+from cnaas_nms.db.settings import get_groups, get_groups_bulk, get_group_settings, get_group_regex
 from cnaas_nms.db.session import sqla_session
 from cnaas_nms.tools.security import jwt_required
 from cnaas_nms.version import __api_version__
@@ -21,12 +21,12 @@ def groups_populate(group_name: Optional[str] = None) -> dict:
     else:
         tmpgroups: dict = {key: [] for key in get_groups()}
     with sqla_session() as session:
-        devices: List[Device] = session.query(Device).all()
-        for dev in devices:
-            groups = get_groups(dev.hostname)
-            for group in groups:
-                if group in tmpgroups:
-                    tmpgroups[group].append(dev.hostname)
+        hostnames: List[str] = [row.hostname for row in session.query(Device.hostname)]
+    device_groups = get_groups_bulk(hostnames)
+    for hostname in hostnames:
+        for group in device_groups[hostname]:
+            if group in tmpgroups:
+                tmpgroups[group].append(hostname)
     return tmpgroups
 
 
@@ -1,14 +1,22 @@
 import json
 import time
+from typing import List, Optional
 
 from flask import make_response, request
 from flask_restx import Namespace, Resource, fields
-from sqlalchemy import func
+from sqlalchemy import and_, case, cast, column, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, TEXT
+from sqlalchemy.orm import defer
 
-from cnaas_nms.api.generic import empty_result, build_filter, pagination_headers
+from cnaas_nms.api.generic import empty_result, build_filter, pagination_headers, \
+    limit_results, get_projection, apply_projection, total_count_column, use_estimated_count, \
+    estimated_count, total_count_needed
+from cnaas_nms.db.config_artifact import resolve_job_artifacts
 from cnaas_nms.db.job import Job, JobStatus
-from cnaas_nms.db.joblock import Joblock
+from cnaas_nms.db.joblock import Joblock, DeviceLock, get_lock_stats
 from cnaas_nms.db.session import sqla_session
+from cnaas_nms.scheduler.cancellation import get_cancellation_service
+from cnaas_nms.scheduler.executor_pools import get_published_pool_stats
 from cnaas_nms.scheduler.scheduler import Scheduler
 from cnaas_nms.tools.log import get_logger
 
@@ -24,12 +32,14 @@ jobs_api = Namespace('jobs', description='API for handling jobs',
 joblock_api = Namespace('joblocks', description='API for handling jobs',
                         prefix='/api/{}'.format(__api_version__))
 
-job_model = job_api.model('jobs', {'name': fields.String(required=True)})
+job_model = job_api.model('jobs', {'name': fields.String(required=False),
+                                   'job_id': fields.Integer(required=False)})
 
 
-def filter_job_dict(job_dict: dict, args: dict) -> dict:
-    """Filter out parts of job result dict based on query string arguments."""
-    logger = get_logger()
+def get_jobresult_filter(args: dict) -> List[int]:
+    """Get indexes of the Nornir tasks to filter out from sync_devices job
+    results based on the filter_jobresult query string argument, highest
+    index first."""
     # Define order of nornir tasks in known types of jobs
     filter_map = {
         "syncto": {
@@ -37,27 +47,73 @@ def filter_job_dict(job_dict: dict, args: dict) -> dict:
             "diff": 2
         }
     }
-    filter_items = []
-    if not isinstance(job_dict, dict) or "result" not in job_dict or \
-            not isinstance(job_dict["result"], dict) or "devices" not in job_dict["result"] or \
-            "function_name" not in job_dict or not isinstance(job_dict["function_name"], str):
-        return job_dict
+    value = args.get('filter_jobresult')
+    if not isinstance(value, str):
+        return []
+    filter_items = set()
+    for item in value.split(','):
+        if item in filter_map["syncto"].keys():
+            filter_items.add(filter_map["syncto"][item])
+    return sorted(filter_items, reverse=True)
 
-    if job_dict["function_name"].startswith("sync_devices"):
-        for arg, value in args.items():
-            if arg == 'filter_jobresult' and isinstance(value, str):
-                for item in value.split(','):
-                    if item in filter_map["syncto"].keys():
-                        filter_items.append(filter_map["syncto"][item])
-        # Remove items starting from the end of the list so indexes don't change
-        for filter_item in sorted(filter_items, reverse=True):
-            for hostname, value in job_dict["result"]["devices"].items():
-                try:
-                    del job_dict["result"]["devices"][hostname]["job_tasks"][filter_item]
-                except KeyError:
-                    pass
-                except Exception as e:
-                    logger.debug("job filter_response exception: {}".format(e))
+
+def filtered_result_column(filter_items: List[int]):
+    """Get SQL expression for the job result with the specified tasks of
+    each device removed from sync_devices job results, so the filtered out
+    parts of the result are never fetched from the database."""
+    devices = func.jsonb_each(Job.result['devices']).table_valued(
+        'key', column('value', JSONB)).alias('devices')
+    device_result = devices.c.value
+    # Remove items starting from the end of the list so indexes don't change
+    for filter_item in filter_items:
+        device_result = device_result.op('#-')(
+            literal(['job_tasks', str(filter_item)], ARRAY(TEXT)))
+    filtered_devices = select(func.jsonb_object_agg(devices.c.key, device_result)). \
+        scalar_subquery()
+    return case(
+        (and_(Job.function_name.like('sync_devices%'),
+              func.jsonb_typeof(Job.result['devices']) == 'object'),
+         Job.result.op('||')(func.jsonb_build_object(
+             'devices', func.coalesce(filtered_devices, cast('{}', JSONB))))),
+        else_=Job.result
+    ).label('filtered_result')
+
+
+def apply_jobresult_filter(query, args: dict, fields: Optional[List[str]]):
+    """Select the job result with parts removed according to
+    filter_jobresult instead of the full result column.
+
+    Returns:
+        Tuple with query and fields to get from the Job instance, fields
+        does not include result if the filtered result is selected
+    """
+    filter_items = get_jobresult_filter(args)
+    if not filter_items or (fields is not None and 'result' not in fields):
+        return query, fields
+    query = query.add_columns(filtered_result_column(filter_items)). \
+        options(defer(Job.result))
+    return query, [x for x in (fields or Job.__table__.columns.keys()) if x != 'result']
+
+
+def get_job_dict(row, fields: Optional[List[str]]) -> dict:
+    """Get job dict from a query row, using the filtered result if selected."""
+    if isinstance(row, Job):
+        return row.as_dict(fields)
+    job_dict = row.Job.as_dict(fields)
+    if hasattr(row, 'filtered_result'):
+        value = row.filtered_result
+        job_dict['result'] = json.loads(value) if isinstance(value, str) else value
+    return job_dict
+
+
+def resolve_job_dict(session, job_dict: dict, args: dict) -> dict:
+    """Replace config artifact references in job result with the stored
+    configs and diffs if resolve_artifacts query string argument is set."""
+    if str(args.get('resolve_artifacts', '')).lower() not in ('true', '1', 'yes'):
+        return job_dict
+    if isinstance(job_dict, dict) and isinstance(job_dict.get("result"), dict) and \
+            isinstance(job_dict["result"].get("devices"), dict):
+        resolve_job_artifacts(session, job_dict["result"]["devices"])
     return job_dict
 
 
@@ -67,23 +123,32 @@ class JobsApi(Resource):
         """ Get one or more jobs """
         data = {'jobs': []}
         total_count = 0
+        last_id = None
         args = request.args
         with sqla_session() as session:
-            query = session.query(Job, func.count(Job.id).over().label('total'))
+            query = session.query(Job, total_count_column(Job))
             try:
+                fields = get_projection(Job)
+                query = apply_projection(Job, query, fields)
+                query, fields = apply_jobresult_filter(query, args, fields)
                 query = build_filter(Job, query)
+                if use_estimated_count() and total_count_needed():
+                    total_count = estimated_count(query)
             except Exception as e:
                 return empty_result(status='error',
                                     data="Unable to filter jobs: {}".format(e)), 400
             for instance in query:
-                job_dict = instance.Job.as_dict()
-                filtered_job_dict = filter_job_dict(job_dict, args)
-                data['jobs'].append(filtered_job_dict)
-                total_count = instance.total
+                job_dict = get_job_dict(instance, fields)
+                data['jobs'].append(resolve_job_dict(session, job_dict, args))
+                if not use_estimated_count():
+                    total_count = instance.total
+                last_id = instance.Job.id
+            if len(data['jobs']) < limit_results():
+                last_id = None
 
         resp = make_response(json.dumps(empty_result(status='success', data=data)), 200)
         resp.headers['Content-Type'] = 'application/json'
-        resp.headers = {**resp.headers, **pagination_headers(total_count)}
+        resp.headers = {**resp.headers, **pagination_headers(total_count, last_id)}
         return resp
 
 
@@ -93,11 +158,13 @@ class JobByIdApi(Resource):
         """ Get job information by ID """
         args = request.args
         with sqla_session() as session:
-            job = session.query(Job).filter(Job.id == job_id).one_or_none()
-            if job:
-                job_dict = job.as_dict()
-                filtered_job_dict = filter_job_dict(job_dict, args)
-                return empty_result(data={'jobs': [filtered_job_dict]})
+            query, fields = apply_jobresult_filter(
+                session.query(Job).filter(Job.id == job_id), args, None)
+            row = query.one_or_none()
+            if row:
+                job_dict = get_job_dict(row, fields)
+                return empty_result(
+                    data={'jobs': [resolve_job_dict(session, job_dict, args)]})
             else:
                 return empty_result(status='error',
                                     data="No job with id {} found".format(job_id)), 400
@@ -138,6 +205,11 @@ class JobByIdApi(Resource):
                 with sqla_session() as session:
                     job = session.query(Job).filter(Job.id == job_id).one_or_none()
                     job.status = JobStatus.ABORTING
+                try:
+                    get_cancellation_service().request_abort(job_id, abort_reason)
+                except Exception as e:
+                    get_logger().error("Unable to send abort request for job {}: {}".format(
+                        job_id, e))
 
             with sqla_session() as session:
                 job = session.query(Job).filter(Job.id == job_id).one_or_none()
@@ -149,18 +221,33 @@ class JobByIdApi(Resource):
 class JobLockApi(Resource):
     @jwt_required
     def get(self):
-        """ Get job locks """
+        """ Get job locks, device locks and lock wait stats """
         locks = []
+        device_locks = []
         with sqla_session() as session:
             for lock in session.query(Joblock).all():
                 locks.append(lock.as_dict())
-        return empty_result('success', data={'locks': locks})
+            for device_lock in session.query(DeviceLock).order_by(DeviceLock.hostname):
+                device_locks.append(device_lock.as_dict())
+        try:
+            stats = get_lock_stats()
+        except Exception as e:
+            get_logger().debug("Could not get job lock stats: {}".format(e))
+            stats = None
+        return empty_result('success', data={'locks': locks, 'device_locks': device_locks,
+                                             'stats': stats})
 
     @jwt_required
     @job_api.expect(job_model)
     def delete(self):
         """ Remove job locks """
         json_data = request.get_json()
+        if 'job_id' in json_data and isinstance(json_data['job_id'], int):
+            with sqla_session() as session:
+                if not DeviceLock.release_locks(session, json_data['job_id']):
+                    return empty_result('error', "No device locks found for job"), 404
+            return empty_result('success', data={'job_id': json_data['job_id'],
+                                                 'status': 'deleted'})
         if 'name' not in json_data or not json_data['name']:
             return empty_result('error', "No lock name specified"), 400
 
@@ -174,6 +261,14 @@ class JobLockApi(Resource):
         return empty_result('success', data={'name': json_data['name'], 'status': 'deleted'})
 
 
+class JobPoolsApi(Resource):
+    @jwt_required
+    def get(self):
+        """ Get queue depth and wait times for scheduler executor pools """
+        return empty_result('success', data={'pools': get_published_pool_stats()})
+
+
 jobs_api.add_resource(JobsApi, '')
+jobs_api.add_resource(JobPoolsApi, '/pools')
 job_api.add_resource(JobByIdApi, '/<int:job_id>')
 joblock_api.add_resource(JobLockApi, '')
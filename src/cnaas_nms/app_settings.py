@@ -1,5 +1,5 @@
 import yaml
-from typing import Optional
+from typing import Dict, Optional
 
 from pydantic import BaseSettings, PostgresDsn
 from pathlib import Path
@@ -46,6 +46,14 @@ class ApiSettings(BaseSettings):
     PLUGIN_FILE: Path = "/etc/cnaas-nms/plugins.yml"
     GLOBAL_UNIQUE_VLANS: bool = True
     INIT_MGMT_TIMEOUT: int = 30
+    SCHEDULER_POOLS: Dict[str, int] = {
+        'default': 10,
+        'interactive': 5,
+        'bulk_sync': 2,
+        'firmware': 4,
+        'ztp': 10,
+    }
+    SCHEDULER_QUEUE: str = "mule"
 
 
 def construct_api_settings() -> ApiSettings:
@@ -72,6 +80,8 @@ def construct_api_settings() -> ApiSettings:
             FIRMWARE_URL=firmware_url,
             GLOBAL_UNIQUE_VLANS=config.get("global_unique_vlans", True),
             INIT_MGMT_TIMEOUT=config.get("init_mgmt_timeout", 30),
+            SCHEDULER_POOLS={**ApiSettings().SCHEDULER_POOLS, **config.get("scheduler_pools", {})},
+            SCHEDULER_QUEUE=config.get("scheduler_queue", "mule"),
         )
     else:
         return ApiSettings()
@@ -0,0 +1,232 @@
+import atexit
+import json
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import sha256
+from typing import Dict, List, Optional, Tuple
+
+from cnaas_nms.scheduler.scheduler import SingletonType
+from cnaas_nms.tools.log import get_logger
+
+
+CONNECTION_NAME = "napalm"
+
+
+class ConnectionPoolError(Exception):
+    pass
+
+
+class NapalmConnectionPool(object, metaclass=SingletonType):
+    """Keep authenticated NAPALM connections open between Nornir tasks and
+    jobs in this process.
+
+    Connections are keyed on host and the full set of connection parameters,
+    so a device that changes credentials or address gets a new connection.
+    Idle connections are closed after idle_timeout seconds by a reaper thread
+    that runs every reap_interval seconds while there are idle connections,
+    and checked with is_alive before they are handed out again. At most max_per_host
+    connections per key are in use at the same time, other borrowers wait
+    for up to wait_timeout seconds.
+    """
+    def __init__(self, idle_timeout: int = 300, max_per_host: int = 2, wait_timeout: int = 120,
+                 reap_interval: Optional[float] = None):
+        self.idle_timeout = idle_timeout
+        self.max_per_host = max_per_host
+        self.wait_timeout = wait_timeout
+        self.reap_interval = reap_interval if reap_interval is not None else idle_timeout / 2
+        self._cond = threading.Condition()
+        self._idle: Dict[tuple, List[Tuple[object, float]]] = {}
+        self._in_use: Dict[tuple, int] = {}
+        self._reaper: Optional[threading.Thread] = None
+        self.stats = {'opened': 0, 'reused': 0, 'closed': 0, 'unhealthy': 0, 'waited': 0}
+
+    @staticmethod
+    def connection_key(host) -> tuple:
+        params = host.get_connection_parameters(CONNECTION_NAME)
+        return (
+            host.name,
+            params.hostname,
+            params.port,
+            params.platform,
+            params.username,
+            sha256((params.password or '').encode()).hexdigest(),
+            json.dumps(params.extras, sort_keys=True, default=str)
+        )
+
+    @staticmethod
+    def _is_alive(conn) -> bool:
+        try:
+            return bool(conn.connection.is_alive().get('is_alive', False))
+        except Exception:
+            return False
+
+    def _close(self, conns: list):
+        logger = get_logger()
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.debug("Error while closing pooled connection: {}".format(e))
+        with self._cond:
+            self.stats['closed'] += len(conns)
+
+    def _pop_expired(self) -> list:
+        """Remove expired idle connections, must be called with lock held."""
+        expired = []
+        now = time.monotonic()
+        for key in list(self._idle.keys()):
+            keep = []
+            for conn, last_used in self._idle[key]:
+                if now - last_used > self.idle_timeout:
+                    expired.append(conn)
+                else:
+                    keep.append((conn, last_used))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        return expired
+
+    def reap_expired(self) -> int:
+        """Close idle connections to all hosts that have expired.
+
+        Returns:
+            Number of closed connections
+        """
+        with self._cond:
+            expired = self._pop_expired()
+        if expired:
+            self._close(expired)
+        return len(expired)
+
+    def _reaper_loop(self):
+        while True:
+            time.sleep(self.reap_interval)
+            self.reap_expired()
+            with self._cond:
+                if not self._idle:
+                    self._reaper = None
+                    return
+
+    def _start_reaper(self):
+        """Start reaper thread unless it's running, must be called with lock held."""
+        if self._reaper is not None:
+            return
+        self._reaper = threading.Thread(target=self._reaper_loop,
+                                        name='napalm_connection_reaper', daemon=True)
+        self._reaper.start()
+
+    def borrow(self, host, configuration) -> tuple:
+        """Attach a pooled or newly opened connection to the Nornir host.
+
+        Returns:
+            Connection key, to be passed to release
+        """
+        key = self.connection_key(host)
+        deadline = time.monotonic() + self.wait_timeout
+        conn = None
+        with self._cond:
+            expired = self._pop_expired()
+            waited = False
+            while True:
+                if self._idle.get(key):
+                    conn, _ = self._idle[key].pop()
+                    if not self._idle[key]:
+                        del self._idle[key]
+                    break
+                if self._in_use.get(key, 0) < self.max_per_host:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ConnectionPoolError(
+                        "Timed out waiting for free connection to {}".format(host.name))
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use[key] = self._in_use.get(key, 0) + 1
+            if waited:
+                self.stats['waited'] += 1
+        if expired:
+            self._close(expired)
+
+        try:
+            if conn is not None and not self._is_alive(conn):
+                with self._cond:
+                    self.stats['unhealthy'] += 1
+                self._close([conn])
+                conn = None
+            if CONNECTION_NAME in host.connections:
+                host.close_connection(CONNECTION_NAME)
+            if conn is None:
+                host.open_connection(CONNECTION_NAME, configuration=configuration)
+                with self._cond:
+                    self.stats['opened'] += 1
+            else:
+                host.connections[CONNECTION_NAME] = conn
+                with self._cond:
+                    self.stats['reused'] += 1
+        except Exception:
+            with self._cond:
+                self._release_key(key)
+            raise
+        return key
+
+    def _release_key(self, key: tuple):
+        """Must be called with lock held."""
+        self._in_use[key] -= 1
+        if self._in_use[key] <= 0:
+            del self._in_use[key]
+        self._cond.notify_all()
+
+    def release(self, host, key: tuple, discard: bool = False):
+        """Detach the connection from the Nornir host and return it to the
+        pool, or close it if discard is set."""
+        conn = host.connections.pop(CONNECTION_NAME, None)
+        with self._cond:
+            self._release_key(key)
+            expired = self._pop_expired()
+            if conn is not None and not discard:
+                self._idle.setdefault(key, []).append((conn, time.monotonic()))
+                conn = None
+            if self._idle:
+                self._start_reaper()
+        if conn is not None:
+            expired.append(conn)
+        if expired:
+            self._close(expired)
+
+    def close_all(self):
+        """Close all idle connections."""
+        with self._cond:
+            conns = [conn for idle in self._idle.values() for conn, _ in idle]
+            self._idle = {}
+        self._close(conns)
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {
+                **self.stats,
+                'idle': sum([len(x) for x in self._idle.values()]),
+                'in_use': sum(self._in_use.values())
+            }
+
+
+@contextmanager
+def napalm_connection(task):
+    """Borrow a NAPALM connection from the pool for a Nornir task. Tasks run
+    inside the context use the pooled connection through the normal Nornir
+    connection lookup. Connections used by a task that raised an exception
+    are closed instead of returned to the pool."""
+    pool = NapalmConnectionPool()
+    key = pool.borrow(task.host, task.nornir.config)
+    discard = False
+    try:
+        yield task.host.connections[CONNECTION_NAME]
+    except Exception:
+        discard = True
+        raise
+    finally:
+        pool.release(task.host, key, discard=discard)
+
+
+atexit.register(lambda: NapalmConnectionPool().close_all())
@@ -1,4 +1,3 @@
-import time
 import datetime
 from typing import Optional
 
@@ -13,7 +12,7 @@ from cnaas_nms.scheduler.wrapper import job_wrapper
 from cnaas_nms.confpush.nornir_helper import NornirJobResult
 from cnaas_nms.db.session import sqla_session, redis_session
 from cnaas_nms.db.device import DeviceType, Device
-from cnaas_nms.db.job import Job
+from cnaas_nms.scheduler.cancellation import is_job_aborted, wait_for_abort
 from cnaas_nms.scheduler.thread_data import set_thread_data
 
 
@@ -34,9 +33,8 @@ def arista_pre_flight_check(task, job_id: Optional[str] = None) -> str:
     """
     set_thread_data(job_id)
     logger = get_logger()
-    with sqla_session() as session:
-        if Job.check_job_abort_status(session, job_id):
-            return "Pre-flight aborted"
+    if is_job_aborted(job_id):
+        return "Pre-flight aborted"
 
     flash_diskspace = 'bash timeout 5 df /mnt/flash | awk \'{print $4}\''
     flash_cleanup = 'bash timeout 30 ls -t /mnt/flash/*.swi | tail -n +2 | grep -v `cut -d"/" -f2 /mnt/flash/boot-config` | xargs rm -f'
@@ -71,11 +69,9 @@ def arista_post_flight_check(task, post_waittime: int, job_id: Optional[str] = N
     """
     set_thread_data(job_id)
     logger = get_logger()
-    time.sleep(int(post_waittime))
+    if wait_for_abort(job_id, int(post_waittime)):
+        return "Post-flight aborted"
     logger.info('Post-flight check wait ({}s) complete, starting check for {}'.format(post_waittime, task.host.name))
-    with sqla_session() as session:
-        if Job.check_job_abort_status(session, job_id):
-            return "Post-flight aborted"
 
     try:
         res = task.run(napalm_get, getters=["facts"])
@@ -116,9 +112,8 @@ def arista_firmware_download(task, filename: str, httpd_url: str,
     """
     set_thread_data(job_id)
     logger = get_logger()
-    with sqla_session() as session:
-        if Job.check_job_abort_status(session, job_id):
-            return "Firmware download aborted"
+    if is_job_aborted(job_id):
+        return "Firmware download aborted"
 
     url = httpd_url + '/' + filename
     # Make sure netmiko doesn't use fast_cli because it will change delay_factor
@@ -182,9 +177,8 @@ def arista_firmware_activate(task, filename: str, job_id: Optional[str] = None)
     """
     set_thread_data(job_id)
     logger = get_logger()
-    with sqla_session() as session:
-        if Job.check_job_abort_status(session, job_id):
-            return "Firmware activate aborted"
+    if is_job_aborted(job_id):
+        return "Firmware activate aborted"
 
     try:
         boot_file_cmd = 'boot system flash:{}'.format(filename)
@@ -236,9 +230,8 @@ def arista_device_reboot(task, job_id: Optional[str] = None) -> str:
     """
     set_thread_data(job_id)
     logger = get_logger()
-    with sqla_session() as session:
-        if Job.check_job_abort_status(session, job_id):
-            return "Reboot aborted"
+    if is_job_aborted(job_id):
+        return "Reboot aborted"
 
     try:
         res = task.run(netmiko_send_command, command_string='enable',
@@ -355,7 +348,7 @@ def device_upgrade_task(task, job_id: str,
 
     if job_id:
         with redis_session() as db:
-            db.lpush('finished_devices_' + str(job_id), task.host.name)
+            db.rpush('finished_devices_' + str(job_id), task.host.name)
 
 
 @job_wrapper
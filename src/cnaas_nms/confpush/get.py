@@ -21,7 +21,7 @@ def get_inventory():
 
 
 def get_running_config(hostname):
-    nr = cnaas_nms.confpush.nornir_helper.cnaas_init()
+    nr = cnaas_nms.confpush.nornir_helper.cnaas_init([hostname] if hostname else None)
     if hostname:
         nr_filtered = nr.filter(name=hostname).filter(managed=True)
     else:
@@ -158,7 +158,7 @@ def get_interfaces(hostname: str) -> AggregatedResult:
     """Get a NAPALM/Nornir aggregated result of the current interfaces
     on the specified device.
     """
-    nr = cnaas_nms.confpush.nornir_helper.cnaas_init()
+    nr = cnaas_nms.confpush.nornir_helper.cnaas_init([hostname])
     nr_filtered = nr.filter(name=hostname)
     if len(nr_filtered.inventory) != 1:
         raise ValueError(f"Hostname {hostname} not found in inventory")
@@ -15,7 +15,7 @@ from cnaas_nms.tools.log import get_logger
 def get_interface_states(hostname) -> dict:
     logger = get_logger()
 
-    nr = cnaas_init()
+    nr = cnaas_init([hostname])
     nr_filtered = nr.filter(name=hostname).filter(managed=True)
     if len(nr_filtered.inventory) != 1:
         raise ValueError(f"Hostname {hostname} not found in inventory")
@@ -99,7 +99,7 @@ def bounce_interfaces(hostname: str, interfaces: List[str]) -> bool:
     Returns false if config did not change, and raises Exception if an
     error was encountered."""
     pre_bounce_check(hostname, interfaces)
-    nr = cnaas_init()
+    nr = cnaas_init([hostname])
     nr_filtered = nr.filter(name=hostname).filter(managed=True)
     if len(nr_filtered.inventory) != 1:
         raise ValueError(f"Hostname {hostname} not found in inventory")
@@ -2,24 +2,35 @@ from dataclasses import dataclass
 from typing import Optional, Tuple, List, Union
 from functools import lru_cache
 import os
+import shutil
+import tempfile
 
 from nornir import InitNornir
 from nornir.core import Nornir
 from nornir.core.task import AggregatedResult, MultiResult
 from nornir.core.filter import F
 from nornir.core.plugins.inventory import InventoryPluginRegister
-from jinja2 import Environment as JinjaEnvironment, FileSystemLoader
+from jinja2 import Environment as JinjaEnvironment, FileSystemLoader, FileSystemBytecodeCache
+from git import Repo
+from git import InvalidGitRepositoryError
+from git.exc import NoSuchPathError
 from netutils.utils import jinja2_convenience_function
 
+from cnaas_nms.app_settings import app_settings
 from cnaas_nms.confpush.nornir_plugins.cnaas_inventory import CnaasInventory
 from cnaas_nms.scheduler.jobresult import JobResult
 from cnaas_nms.tools import jinja_filters
 
 
+JINJA_BYTECODE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'cnaas-jinja-bytecode')
+JINJA_TEMPLATE_CACHE_SIZE = 400
+
+
 @dataclass
 class NornirJobResult(JobResult):
     nrresult: Optional[MultiResult] = None
     change_score: Optional[float] = None
+    timing: Optional[dict] = None
 
 
 class RelativeJinjaEnvironment(JinjaEnvironment):
@@ -28,21 +39,58 @@ class RelativeJinjaEnvironment(JinjaEnvironment):
         return os.path.join(os.path.dirname(parent), template)
 
 
-@lru_cache(maxsize=8)
+def get_templates_commit() -> Optional[str]:
+    """Return the commit hexsha currently checked out in the local templates
+    repository, or None if it's not a git repository."""
+    try:
+        return Repo(app_settings.TEMPLATES_LOCAL).head.commit.hexsha
+    except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+        return None
+
+
 def get_jinja_env(path):
+    """Get Jinja environment for a template directory. Compiled templates
+    are cached in memory and as bytecode on disk, separately for each
+    commit of the templates repository so that the cache is shared
+    between jobs and worker processes but never outlives a repo refresh."""
+    return _get_jinja_env(path, get_templates_commit())
+
+
+@lru_cache(maxsize=8)
+def _get_jinja_env(path, commit: Optional[str]):
+    cache_dir = os.path.join(JINJA_BYTECODE_CACHE_DIR, commit or 'worktree')
+    os.makedirs(cache_dir, exist_ok=True)
     jinja_env = RelativeJinjaEnvironment(
         trim_blocks=True,
         lstrip_blocks=True,
         keep_trailing_newline=True,
         loader=FileSystemLoader(path),
-        cache_size=0,
+        cache_size=JINJA_TEMPLATE_CACHE_SIZE,
+        bytecode_cache=FileSystemBytecodeCache(cache_dir),
     )
     jinja_env.filters.update(jinja_filters.FILTERS)
     jinja_env.filters.update(jinja2_convenience_function())
     return jinja_env
 
 
-def cnaas_init() -> Nornir:
+def clear_jinja_cache(keep_commit: Optional[str] = None):
+    """Clear compiled templates from memory and remove bytecode caches
+    for all commits of the templates repository except keep_commit."""
+    _get_jinja_env.cache_clear()
+    if not os.path.isdir(JINJA_BYTECODE_CACHE_DIR):
+        return
+    for entry in os.listdir(JINJA_BYTECODE_CACHE_DIR):
+        if entry != keep_commit:
+            shutil.rmtree(os.path.join(JINJA_BYTECODE_CACHE_DIR, entry), ignore_errors=True)
+
+
+def cnaas_init(hostnames: Optional[List[str]] = None) -> Nornir:
+    """Initialize Nornir with CNaaS inventory.
+
+    Args:
+        hostnames: Only load these devices into the inventory, defaults to
+                   all devices
+    """
     InventoryPluginRegister.register("CnaasInventory", CnaasInventory)
     nr = InitNornir(
         runner={
@@ -52,7 +100,10 @@ def cnaas_init() -> Nornir:
             }
         },
         inventory={
-            "plugin": "CnaasInventory"
+            "plugin": "CnaasInventory",
+            "options": {
+                "hostnames": hostnames
+            }
         },
         logging={"log_file": "/tmp/nornir-pid{}.log".format(os.getpid()), "level": "DEBUG"}
     )
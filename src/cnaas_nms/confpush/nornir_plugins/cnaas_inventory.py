@@ -1,4 +1,6 @@
 import ipaddress
+import threading
+from typing import Dict, List, Optional
 
 from nornir.core.inventory import (
     Inventory,
@@ -11,14 +13,29 @@ from nornir.core.inventory import (
     ParentGroups,
 )
 
-from cnaas_nms.db.device import Device, DeviceType, DeviceState
-from cnaas_nms.db.settings import get_groups
+from cnaas_nms.db.device import Device, DeviceType, DeviceState, \
+    get_device_inventory_generation
+from cnaas_nms.db.settings import get_groups, get_groups_bulk
 from cnaas_nms.tools.pki import ssl_context
 import cnaas_nms.db.session
 from cnaas_nms.app_settings import app_settings
 
 
 class CnaasInventory:
+    # Host records for all devices shared by all inventories in this process,
+    # reloaded when the device inventory generation in redis changes
+    _cache_lock = threading.Lock()
+    _cache_generation: Optional[int] = None
+    _cache_records: Dict[str, dict] = {}
+
+    def __init__(self, hostnames: Optional[List[str]] = None):
+        """
+        Args:
+            hostnames: Only load these devices into the inventory, defaults
+                       to all devices
+        """
+        self.hostnames = hostnames
+
     @staticmethod
     def _get_credentials(devicestate):
         if devicestate == 'UNKNOWN':
@@ -58,12 +75,6 @@ class CnaasInventory:
                 "netmiko": ConnectionOptions(extras={})
             }
         )
-        insecure_device_states = [
-            DeviceState.INIT,
-            DeviceState.DHCP_BOOT,
-            DeviceState.PRE_CONFIGURED,
-            DeviceState.DISCOVERED
-        ]
         insecure_connection_options = {
             "napalm": ConnectionOptions(extras={
                 "optional_args": {"enforce_verification": False}
@@ -84,11 +95,68 @@ class CnaasInventory:
             groups[group_name] = Group(name=group_name, defaults=defaults)
 
         hosts = Hosts()
+        for name, record in self.get_host_records(self.hostnames).items():
+            if record['insecure']:
+                host_connection_options = insecure_connection_options
+            else:
+                host_connection_options = None
+            hosts[name] = Host(
+                name=name,
+                hostname=record['hostname'],
+                platform=record['platform'],
+                groups=ParentGroups(groups[g] for g in record['groups'] if g in groups),
+                port=record['port'],
+                data={
+                    'synchronized': record['synchronized'],
+                    'managed': record['managed']
+                },
+                connection_options=host_connection_options,
+                defaults=defaults
+            )
+
+        return Inventory(hosts=hosts, groups=groups, defaults=defaults)
+
+    @classmethod
+    def get_host_records(cls, hostnames: Optional[List[str]] = None) -> Dict[str, dict]:
+        """Return host records, from the process cache if the device inventory
+        has not changed since it was loaded. If hostnames is specified and the
+        cache is not valid only those devices are loaded from the database."""
+        generation = get_device_inventory_generation()
+        with cls._cache_lock:
+            if generation is not None and generation == cls._cache_generation:
+                if hostnames is None:
+                    return dict(cls._cache_records)
+                return {h: cls._cache_records[h] for h in hostnames if h in cls._cache_records}
+        records = cls._query_host_records(hostnames)
+        if hostnames is None and generation is not None:
+            with cls._cache_lock:
+                cls._cache_generation = generation
+                cls._cache_records = records
+        return dict(records)
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._cache_lock:
+            cls._cache_generation = None
+            cls._cache_records = {}
+
+    @classmethod
+    def _query_host_records(cls, hostnames: Optional[List[str]] = None) -> Dict[str, dict]:
+        insecure_device_states = [
+            DeviceState.INIT,
+            DeviceState.DHCP_BOOT,
+            DeviceState.PRE_CONFIGURED,
+            DeviceState.DISCOVERED
+        ]
+        records = {}
         with cnaas_nms.db.session.sqla_session() as session:
+            query = session.query(Device)
+            if hostnames is not None:
+                query = query.filter(Device.hostname.in_(hostnames))
+            devices: List[Device] = query.all()
+            device_groups = get_groups_bulk([instance.hostname for instance in devices])
             instance: Device
-            for instance in session.query(Device):
-                hostname = self._get_management_ip(instance.management_ip,
-                                                   instance.dhcp_ip)
+            for instance in devices:
                 port = None
                 if instance.port and isinstance(instance.port, int):
                     port = instance.port
@@ -96,25 +164,15 @@ class CnaasInventory:
                     'T_' + instance.device_type.name,
                     'S_' + instance.state.name
                 ]
-                for member_group in get_groups(instance.hostname):
-                    host_groups.append(member_group)
-
-                if instance.state in insecure_device_states:
-                    host_connection_options = insecure_connection_options
-                else:
-                    host_connection_options = None
-                hosts[instance.hostname] = Host(
-                    name=instance.hostname,
-                    hostname=hostname,
-                    platform=instance.platform,
-                    groups=ParentGroups(groups[g] for g in host_groups),
-                    port=port,
-                    data={
-                        'synchronized': instance.synchronized,
-                        'managed': (True if instance.state == DeviceState.MANAGED else False)
-                    },
-                    connection_options=host_connection_options,
-                    defaults=defaults
-                )
-
-        return Inventory(hosts=hosts, groups=groups, defaults=defaults)
+                host_groups += device_groups[instance.hostname]
+                records[instance.hostname] = {
+                    'hostname': cls._get_management_ip(instance.management_ip,
+                                                       instance.dhcp_ip),
+                    'platform': instance.platform,
+                    'port': port,
+                    'groups': host_groups,
+                    'synchronized': instance.synchronized,
+                    'managed': (True if instance.state == DeviceState.MANAGED else False),
+                    'insecure': instance.state in insecure_device_states
+                }
+        return records
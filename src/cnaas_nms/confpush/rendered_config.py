@@ -0,0 +1,104 @@
+import json
+from hashlib import sha256
+from typing import Optional, List, Dict
+
+from cnaas_nms.db.session import redis_session
+from cnaas_nms.tools.log import get_logger
+
+
+RENDERED_CONFIG_KEY = 'rendered_config:{}'
+# Nornir host attributes that change with sync state or are set by sync
+# tasks, these are not template inputs
+VOLATILE_HOST_VARS = frozenset([
+    'synchronized', 'managed', 'config', 'template_vars', 'change_score',
+    'config_hash', 'hash_check_failed'
+])
+
+
+def template_vars_digest(commit: Optional[str], platform: str, template: str,
+                         template_vars: dict, host_vars: dict) -> Optional[str]:
+    """Calculate a stable digest of everything that is used as input when
+    rendering the config for a device.
+
+    Args:
+        commit: Templates repository commit
+        platform: Device platform
+        template: Entrypoint template name
+        template_vars: Variables from populate_device_vars
+        host_vars: Nornir host attributes available as "host" in templates,
+                   attributes in VOLATILE_HOST_VARS are ignored
+
+    Returns:
+        Hex digest, or None if the templates commit is unknown and the
+        rendered config can't be reused
+    """
+    if not commit:
+        return None
+    host_vars = {k: v for k, v in host_vars.items() if k not in VOLATILE_HOST_VARS}
+    data = json.dumps([commit, platform, template, template_vars, host_vars],
+                      sort_keys=True, default=str)
+    return sha256(data.encode()).hexdigest()
+
+
+def get_rendered_configs(hostnames: List[str]) -> Dict[str, dict]:
+    """Get the last rendered config for a list of devices.
+
+    Returns:
+        Dict with hostname as key and a dict with digest, config and
+        optionally synced_confhash as value, devices without a stored
+        config are not included
+    """
+    logger = get_logger()
+    ret = {}
+    try:
+        with redis_session() as redis:
+            pipe = redis.pipeline(transaction=False)
+            for hostname in hostnames:
+                pipe.hgetall(RENDERED_CONFIG_KEY.format(hostname))
+            for hostname, stored in zip(hostnames, pipe.execute()):
+                if stored and 'digest' in stored and 'config' in stored:
+                    ret[hostname] = stored
+    except Exception as e:
+        logger.warning("Could not get stored rendered configs: {}".format(e))
+    return ret
+
+
+def save_rendered_configs(rendered: Dict[str, tuple]):
+    """Store rendered configs.
+
+    Args:
+        rendered: Dict with hostname as key and a tuple of (digest, config)
+    """
+    logger = get_logger()
+    try:
+        with redis_session() as redis:
+            pipe = redis.pipeline(transaction=False)
+            for hostname, (digest, config) in rendered.items():
+                key = RENDERED_CONFIG_KEY.format(hostname)
+                pipe.delete(key)
+                pipe.hset(key, mapping={'digest': digest, 'config': config})
+            pipe.execute()
+    except Exception as e:
+        logger.warning("Could not store rendered configs: {}".format(e))
+
+
+def set_rendered_configs_synced(confhashes: Dict[str, str]):
+    """Record that the running config of devices matched their last
+    rendered config when the device had the specified config hash.
+
+    Args:
+        confhashes: Dict with hostname as key and config hash as value
+    """
+    logger = get_logger()
+    try:
+        with redis_session() as redis:
+            pipe = redis.pipeline(transaction=False)
+            for hostname in confhashes.keys():
+                pipe.exists(RENDERED_CONFIG_KEY.format(hostname))
+            exists = pipe.execute()
+            for (hostname, confhash), key_exists in zip(confhashes.items(), exists):
+                if key_exists and confhash:
+                    pipe.hset(RENDERED_CONFIG_KEY.format(hostname), 'synced_confhash', confhash)
+            pipe.execute()
+    except Exception as e:
+        logger.warning("Could not update synchronized config hashes: {}".format(e))
@@ -1,27 +1,37 @@
 import os
+import sys
+import time
 import yaml
 import datetime
-from typing import Optional, List
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Optional, List, Dict
 from ipaddress import IPv4Interface, IPv4Address
 from hashlib import sha256
 
-from nornir.core.task import MultiResult
+from nornir.core.task import MultiResult, Result
 from nornir_napalm.plugins.tasks import napalm_configure, napalm_get
-from nornir_jinja2.plugins.tasks import template_file
 from nornir_utils.plugins.functions import print_result
 
-import cnaas_nms.db.helper
 from cnaas_nms.app_settings import app_settings
-from cnaas_nms.confpush.nornir_helper import cnaas_init, inventory_selector, get_jinja_env
+from cnaas_nms.confpush.nornir_helper import cnaas_init, inventory_selector, get_jinja_env, \
+    get_templates_commit
+from cnaas_nms.confpush.rendered_config import template_vars_digest, get_rendered_configs, \
+    save_rendered_configs, set_rendered_configs_synced, VOLATILE_HOST_VARS
 from cnaas_nms.db.session import sqla_session, redis_session
 from cnaas_nms.confpush.get import calc_config_hash
 from cnaas_nms.confpush.changescore import calculate_score
+from cnaas_nms.confpush.connection_pool import napalm_connection, NapalmConnectionPool
 from cnaas_nms.tools.jinja_helpers import get_environment_secrets
 from cnaas_nms.tools.log import get_logger
 from cnaas_nms.db.settings import get_settings
 from cnaas_nms.db.device import Device, DeviceState, DeviceType
 from cnaas_nms.db.interface import Interface
-from cnaas_nms.db.joblock import Joblock, JoblockError
+from cnaas_nms.db.joblock import DeviceLock, acquire_device_locks
+from cnaas_nms.db.topology import SessionTopology, TopologySnapshot
 from cnaas_nms.db.git import RepoStructureException
 from cnaas_nms.confpush.nornir_helper import NornirJobResult
 from cnaas_nms.scheduler.wrapper import job_wrapper
@@ -32,6 +42,10 @@ from cnaas_nms.scheduler.scheduler import Scheduler
 
 AUTOPUSH_MAX_SCORE = 10
 PRIVATE_ASN_START = 4200000000
+CONFIG_RENDER_PROCESSES = min(8, os.cpu_count() or 1)
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = threading.Lock()
 
 
 def generate_asn(ipv4_address: IPv4Address) -> Optional[int]:
@@ -40,7 +54,8 @@ def generate_asn(ipv4_address: IPv4Address) -> Optional[int]:
     return PRIVATE_ASN_START + (ipv4_address.packed[2]*256 + ipv4_address.packed[3])
 
 
-def get_evpn_peers(session, settings: dict):
+def get_evpn_peers(session, settings: dict,
+                   topology: Optional[TopologySnapshot] = None):
     logger = get_logger()
     device_hostnames = []
     for entry in settings['evpn_peers']:
@@ -48,14 +63,16 @@ def get_evpn_peers(session, settings: dict):
             device_hostnames.append(entry['hostname'])
         else:
             logger.error("Invalid entry specified in settings->evpn_peers, ignoring: {}".format(entry))
+    if not topology:
+        topology = SessionTopology(session)
     ret = []
     for hostname in device_hostnames:
-        dev = session.query(Device).filter(Device.hostname == hostname).one_or_none()
+        dev = topology.get_device(hostname)
         if dev:
             ret.append(dev)
     # If no evpn_peers were specified return a list of all CORE devices instead
     if not ret:
-        core_devs = session.query(Device).filter(Device.device_type == DeviceType.CORE).all()
+        core_devs = topology.get_devices_by_type(DeviceType.CORE)
         for dev in core_devs:
             ret.append(dev)
     return ret
@@ -87,13 +104,17 @@ def resolve_vlanid_list(vlan_name_list: List[str], vxlans: dict) -> List[int]:
     return ret
 
 
-def get_mlag_vars(session, dev: Device) -> dict:
+def get_mlag_vars(session, dev: Device,
+                  topology: Optional[TopologySnapshot] = None) -> dict:
     ret = {
         'mlag_peer': False,
         'mlag_peer_hostname': None,
         'mlag_peer_low': None
     }
-    mlag_peer: Device = dev.get_mlag_peer(session)
+    if topology:
+        mlag_peer: Device = topology.get_mlag_peer(dev)
+    else:
+        mlag_peer: Device = dev.get_mlag_peer(session)
     if not mlag_peer:
         return ret
     ret['mlag_peer'] = True
@@ -107,8 +128,25 @@ def get_mlag_vars(session, dev: Device) -> dict:
 
 def populate_device_vars(session, dev: Device,
                          ztp_hostname: Optional[str] = None,
-                         ztp_devtype: Optional[DeviceType] = None):
+                         ztp_devtype: Optional[DeviceType] = None,
+                         topology: Optional[TopologySnapshot] = None):
+    """Populate the template variables for a device.
+
+    Args:
+        session: sqla session
+        dev: Device object
+        ztp_hostname: Hostname to use instead of dev.hostname during init
+        ztp_devtype: Device type to use instead of dev.device_type during init
+        topology: Optional TopologySnapshot to look up neighbors, linknets,
+                  interfaces and mgmtdomains from instead of querying the
+                  database for each device
+
+    Returns:
+        dict with template variables
+    """
     logger = get_logger()
+    if not topology:
+        topology = SessionTopology(session)
     device_variables = {
         'device_model': dev.model,
         'device_os_version': dev.os_version,
@@ -160,7 +198,7 @@ def populate_device_vars(session, dev: Device,
                 'interfaces': []
             }
         else:
-            mgmtdomain = cnaas_nms.db.helper.find_mgmtdomain_by_ip(session, dev.management_ip)
+            mgmtdomain = topology.find_mgmtdomain_by_ip(dev.management_ip)
             if not mgmtdomain:
                 raise Exception(
                     "Could not find appropriate management domain for management_ip: {}".
@@ -178,9 +216,9 @@ def populate_device_vars(session, dev: Device,
             }
 
         # Check peer names for populating description on ACCESS_DOWNLINK ports
-        ifname_peer_map = dev.get_linknet_localif_mapping(session)
+        ifname_peer_map = topology.get_linknet_localif_mapping(dev)
 
-        intfs = session.query(Interface).filter(Interface.device == dev).all()
+        intfs = topology.get_interfaces(dev)
         intf: Interface
         for intf in intfs:
             untagged_vlan = None
@@ -209,7 +247,7 @@ def populate_device_vars(session, dev: Device,
                 'data': intfdata,
                 'indexnum': ifindexnum
             })
-        mlag_vars = get_mlag_vars(session, dev)
+        mlag_vars = get_mlag_vars(session, dev, topology)
         device_variables = {**device_variables,
                             **access_device_variables,
                             **mlag_vars}
@@ -233,9 +271,9 @@ def populate_device_vars(session, dev: Device,
             fabric_device_variables = {**fabric_device_variables, **mgmt_device_variables}
         # find fabric neighbors
         fabric_interfaces = {}
-        for neighbor_d in dev.get_neighbors(session):
+        for neighbor_d in topology.get_neighbors(dev):
             if neighbor_d.device_type == DeviceType.DIST or neighbor_d.device_type == DeviceType.CORE:
-                for linknet in dev.get_links_to(session, neighbor_d):
+                for linknet in topology.get_links_to(dev, neighbor_d):
                     local_if = linknet.get_port(dev.id)
                     local_ipif = linknet.get_ipif(dev.id)
                     neighbor_ip = linknet.get_ip(neighbor_d.id)
@@ -255,7 +293,7 @@ def populate_device_vars(session, dev: Device,
                             'peer_ip': str(neighbor_ip),
                             'peer_asn': generate_asn(neighbor_d.infra_ip)
                         })
-        ifname_peer_map = dev.get_linknet_localif_mapping(session)
+        ifname_peer_map = topology.get_linknet_localif_mapping(dev)
         if 'interfaces' in settings and settings['interfaces']:
             for intf in settings['interfaces']:
                 try:
@@ -310,17 +348,17 @@ def populate_device_vars(session, dev: Device,
                         "configured as linknet because of wrong ifclass")
 
         if not ztp_hostname:
-            for mgmtdom in cnaas_nms.db.helper.get_all_mgmtdomains(session, hostname):
+            for mgmtdom in topology.get_all_mgmtdomains(hostname):
                 fabric_device_variables['mgmtdomains'].append({
                     'id': mgmtdom.id,
                     'ipv4_gw': mgmtdom.ipv4_gw,
                     'vlan': mgmtdom.vlan,
                     'description': mgmtdom.description,
                     'esi_mac': mgmtdom.esi_mac,
-                    'ipv4_ip': str(mgmtdom.device_a_ip) if hostname == mgmtdom.device_a.hostname else str(mgmtdom.device_b_ip)
+                    'ipv4_ip': str(mgmtdom.device_a_ip) if dev.id == mgmtdom.device_a_id else str(mgmtdom.device_b_ip)
                 })
         # populate evpn peers data
-        for neighbor_d in get_evpn_peers(session, settings):
+        for neighbor_d in get_evpn_peers(session, settings, topology):
             if neighbor_d.hostname == dev.hostname:
                 continue
             fabric_device_variables['bgp_evpn_peers'].append({
@@ -345,9 +383,251 @@ def populate_device_vars(session, dev: Device,
     return device_variables
 
 
+@lru_cache(maxsize=16)
+def read_template_mapping(mapfile: str, mtime: float) -> dict:
+    """Read mapping.yml from templates repository, cached until the file
+    modification time changes."""
+    with open(mapfile, 'r') as f:
+        return yaml.safe_load(f)
+
+
+def get_template_entrypoint(platform: str, devtype: DeviceType) -> str:
+    """Get the entrypoint template name for a platform and device type from
+    mapping.yml in the templates repository.
+
+    Raises:
+        RepoStructureException: mapping.yml not found
+    """
+    mapfile = os.path.join(app_settings.TEMPLATES_LOCAL, platform, 'mapping.yml')
+    if not os.path.isfile(mapfile):
+        raise RepoStructureException("File {} not found in template repo".format(mapfile))
+    mapping = read_template_mapping(mapfile, os.path.getmtime(mapfile))
+    return mapping[devtype.name]['entrypoint']
+
+
+def render_device_config(platform: str, template: str, template_vars: dict,
+                         host_vars) -> str:
+    """Render device configuration from template. Runs in config render
+    worker processes, so all arguments must be picklable.
+
+    Args:
+        platform: Device platform, selects subdirectory of templates repo
+        template: Entrypoint template name
+        template_vars: Variables from populate_device_vars
+        host_vars: Dict of host attributes from get_host_vars, available
+                   as "host" in templates
+    """
+    path = f"{app_settings.TEMPLATES_LOCAL}/{platform}"
+    jinja_env = get_jinja_env(path)
+    return jinja_env.get_template(template).render(host=host_vars, **template_vars)
+
+
+def init_render_worker(templates_local: str):
+    """Set up config render worker process."""
+    app_settings.TEMPLATES_LOCAL = templates_local
+
+
+def get_python_executable() -> str:
+    """Get the Python interpreter used to start config render workers.
+    When running inside uwsgi sys.executable is the uwsgi binary, so look
+    for the interpreter of the (virtual) environment instead."""
+    if os.path.basename(sys.executable).startswith('python'):
+        return sys.executable
+    for name in ('python3', 'python'):
+        path = os.path.join(sys.exec_prefix, 'bin', name)
+        if os.access(path, os.X_OK):
+            return path
+    return getattr(sys, '_base_executable', None) or sys.executable
+
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """Get the pool of config render worker processes. Workers are started
+    with spawn instead of fork since the scheduler process is threaded, and
+    forking while another thread holds a lock (logging, database or redis
+    connection pools) could deadlock the worker. The pool is kept between
+    jobs so the cost of starting workers is only paid once."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            ctx = multiprocessing.get_context('spawn')
+            ctx.set_executable(get_python_executable())
+            _render_pool = ProcessPoolExecutor(
+                max_workers=CONFIG_RENDER_PROCESSES,
+                mp_context=ctx,
+                initializer=init_render_worker,
+                initargs=(app_settings.TEMPLATES_LOCAL,)
+            )
+        return _render_pool
+
+
+def reset_render_pool(pool: ProcessPoolExecutor):
+    """Shut down a broken render pool, a new one is created on next use."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool.shutdown(wait=False)
+            _render_pool = None
+
+
+def get_host_vars(host) -> dict:
+    """Get Nornir host attributes as a picklable dict that can be used as
+    the "host" variable in templates. Sync state attributes are left out
+    since they are not template inputs."""
+    return {
+        **{k: v for k, v in host.items() if k not in VOLATILE_HOST_VARS},
+        'name': host.name,
+        'hostname': host.hostname,
+        'platform': host.platform,
+        'port': host.port,
+        'groups': [group.name for group in host.groups]
+    }
+
+
+def generate_configs(nr_filtered, topology: TopologySnapshot,
+                     skip_unchanged: bool = False) -> Dict[str, dict]:
+    """Generate configuration for all hosts in a Nornir inventory.
+
+    Template variables are populated from the topology snapshot in this
+    process. If the digest of all template inputs matches the last
+    rendered config for a host that config is reused, the remaining
+    templates are rendered in parallel by a pool of worker processes.
+
+    Args:
+        nr_filtered: Nornir inventory with hosts to generate config for
+        topology: TopologySnapshot containing the hosts
+        skip_unchanged: Mark hosts as unchanged if the rendered config was
+                        reused and the device config hash has not changed
+                        since the device was last found in sync with it
+
+    Returns:
+        Dict with hostname as key and a dict with either config,
+        template_vars and confhash, or exception if generation failed. Reused configs
+        are marked with cached, and unchanged hosts with unchanged.
+    """
+    logger = get_logger()
+    ret: Dict[str, dict] = {}
+    render_args = {}
+    digests = {}
+    commit = get_templates_commit()
+    stored_configs = get_rendered_configs(list(nr_filtered.inventory.hosts.keys()))
+    for hostname, host in nr_filtered.inventory.hosts.items():
+        try:
+            dev: Device = topology.get_device(hostname)
+            if not dev:
+                raise ValueError("Hostname {} not found in database".format(hostname))
+            template_vars = populate_device_vars(None, dev, topology=topology)
+            template = get_template_entrypoint(dev.platform, dev.device_type)
+        except Exception as e:
+            ret[hostname] = {'exception': e}
+            continue
+        host_vars = get_host_vars(host)
+        ret[hostname] = {'template_vars': template_vars, 'confhash': dev.confhash}
+        digest = template_vars_digest(commit, dev.platform, template, template_vars, host_vars)
+        stored = stored_configs.get(hostname)
+        if digest and stored and stored['digest'] == digest:
+            ret[hostname]['config'] = stored['config']
+            ret[hostname]['cached'] = True
+            if skip_unchanged and dev.confhash and stored.get('synced_confhash') == dev.confhash:
+                ret[hostname]['unchanged'] = True
+            continue
+        if digest:
+            digests[hostname] = digest
+        render_args[hostname] = (dev.platform, template, template_vars, host_vars)
+
+    serial_args = render_args
+    if len(render_args) > 1 and CONFIG_RENDER_PROCESSES > 1:
+        executor = get_render_pool()
+        futures = {}
+        broken = False
+        try:
+            for hostname, args in render_args.items():
+                futures[hostname] = executor.submit(render_device_config, *args)
+        except BrokenProcessPool:
+            broken = True
+        for hostname, future in futures.items():
+            try:
+                ret[hostname]['config'] = future.result()
+            except BrokenProcessPool:
+                broken = True
+            except Exception as e:
+                ret[hostname]['exception'] = e
+        if broken:
+            # Worker died or could not be started, start new workers for
+            # the next job and render the remaining configs in this process
+            logger.warning("Config render worker pool is broken, rendering remaining "
+                           "configs in scheduler process")
+            reset_render_pool(executor)
+        serial_args = {hostname: args for hostname, args in render_args.items()
+                       if 'config' not in ret[hostname] and 'exception' not in ret[hostname]}
+    for hostname, args in serial_args.items():
+        try:
+            ret[hostname]['config'] = render_device_config(*args)
+        except Exception as e:
+            ret[hostname]['exception'] = e
+
+    save_rendered_configs({hostname: (digest, ret[hostname]['config'])
+                           for hostname, digest in digests.items()
+                           if 'config' in ret[hostname]})
+
+    logger.debug("Rendered config for {} device(s), reused config for {} device(s)".format(
+        len(render_args), len([x for x in ret.values() if 'cached' in x])))
+    failed = [hostname for hostname, data in ret.items() if 'exception' in data]
+    if failed:
+        logger.error("Failed to generate config for device(s): {}".format(", ".join(failed)))
+    return ret
+
+
+def render_config(task, template: str, template_vars: dict) -> Result:
+    """Nornir task to render device config. Unlike nornir_jinja2 template_file
+    this keeps the loader of the cached Jinja environment, so compiled
+    templates are reused between hosts. The last rendered config is reused
+    if none of the template inputs have changed."""
+    hostname = task.host.name
+    platform = task.host.platform
+    host_vars = get_host_vars(task.host)
+    digest = template_vars_digest(get_templates_commit(), platform, template, template_vars,
+                                  host_vars)
+    stored = get_rendered_configs([hostname]).get(hostname) if digest else None
+    if stored and stored['digest'] == digest:
+        config = stored['config']
+    else:
+        config = render_device_config(platform, template, template_vars, host_vars)
+        if digest:
+            save_rendered_configs({hostname: (digest, config)})
+    return Result(host=task.host, result=config)
+
+
+def pre_rendered_config(task, rendered: dict) -> Result:
+    """Nornir task that returns config generated by generate_configs."""
+    if 'exception' in rendered:
+        raise rendered['exception']
+    return Result(host=task.host, result=rendered['config'])
+
+
+def unchanged_config(task) -> Result:
+    """Nornir task used instead of napalm_configure compare when neither
+    the generated config nor the device config has changed since the device
+    was last found in sync."""
+    return Result(host=task.host, changed=False, diff="",
+                  result="Config unchanged since last synchronization, compare skipped")
+
+
+def get_running_config_hash(task) -> str:
+    """Get the config hash of the running config, using the NAPALM
+    connection already opened for the task."""
+    napalm_device = task.host.get_connection("napalm", task.nornir.config)
+    running_config = napalm_device.get_config(retrieve="running")['running']
+    if not running_config:
+        raise Exception('Failed to get running configuration')
+    return calc_config_hash(task.host.name, running_config)
+
+
 def push_sync_device(task, dry_run: bool = True, generate_only: bool = False,
                      job_id: Optional[str] = None,
-                     scheduled_by: Optional[str] = None):
+                     scheduled_by: Optional[str] = None,
+                     rendered_configs: Optional[Dict[str, dict]] = None,
+                     verify_hash: bool = False,
+                     update_hash: bool = False):
     """
     Nornir task to generate config and push to device
 
@@ -356,6 +636,14 @@ def push_sync_device(task, dry_run: bool = True, generate_only: bool = False,
         dry_run: Don't commit config to device, just do compare/diff
         generate_only: Only generate text config, don't try to commit or
                        even do dry_run compare to running config
+        rendered_configs: Configs already generated by generate_configs,
+                          if the host is not included config is generated
+                          in this task instead
+        verify_hash: Verify that the running config hash matches the stored
+                     config hash before compare, using the same connection
+        update_hash: Get the new config hash after a commit, or after a
+                     dry run with empty diff, using the same connection.
+                     The hash is saved in host variable config_hash.
 
     Returns:
 
@@ -363,28 +651,25 @@ def push_sync_device(task, dry_run: bool = True, generate_only: bool = False,
     set_thread_data(job_id)
     logger = get_logger()
     hostname = task.host.name
-    with sqla_session() as session:
-        dev: Device = session.query(Device).filter(Device.hostname == hostname).one()
-        template_vars = populate_device_vars(session, dev)
-        platform = dev.platform
-        devtype = dev.device_type
-
-    local_repo_path = app_settings.TEMPLATES_LOCAL
+    if rendered_configs and hostname in rendered_configs:
+        r = task.run(task=pre_rendered_config,
+                     name="Generate device config",
+                     rendered=rendered_configs[hostname])
+        template_vars = rendered_configs[hostname]['template_vars']
+    else:
+        with sqla_session() as session:
+            dev: Device = session.query(Device).filter(Device.hostname == hostname).one()
+            template_vars = populate_device_vars(session, dev)
+            platform = dev.platform
+            devtype = dev.device_type
 
-    mapfile = os.path.join(local_repo_path, platform, 'mapping.yml')
-    if not os.path.isfile(mapfile):
-        raise RepoStructureException("File {} not found in template repo".format(mapfile))
-    with open(mapfile, 'r') as f:
-        mapping = yaml.safe_load(f)
-        template = mapping[devtype.name]['entrypoint']
+        template = get_template_entrypoint(platform, devtype)
 
-    logger.debug("Generate config for host: {}".format(task.host.name))
-    r = task.run(task=template_file,
-                 name="Generate device config",
-                 template=template,
-                 jinja_env=get_jinja_env(f"{local_repo_path}/{task.host.platform}"),
-                 path=f"{local_repo_path}/{task.host.platform}",
-                 **template_vars)
+        logger.debug("Generate config for host: {}".format(task.host.name))
+        r = task.run(task=render_config,
+                     name="Generate device config",
+                     template=template,
+                     template_vars=template_vars)
 
     # TODO: Handle template not found, variables not defined
     # jinja2.exceptions.UndefinedError
@@ -392,20 +677,43 @@ def push_sync_device(task, dry_run: bool = True, generate_only: bool = False,
     task.host["config"] = r.result
     task.host["template_vars"] = template_vars
 
+    unchanged = dry_run and rendered_configs and rendered_configs[hostname].get('unchanged')
     if generate_only:
         task.host["change_score"] = 0
     else:
         logger.debug("Synchronize device config for host: {} ({}:{})".format(
             task.host.name, task.host.hostname, task.host.port))
 
-        task.host.open_connection("napalm", configuration=task.nornir.config)
-        task.run(task=napalm_configure,
-                 name="Sync device config",
-                 replace=True,
-                 configuration=task.host["config"],
-                 dry_run=dry_run
-                 )
-        task.host.close_connection("napalm")
+        with napalm_connection(task):
+            if verify_hash:
+                if rendered_configs and hostname in rendered_configs:
+                    stored_hash = rendered_configs[hostname]['confhash']
+                else:
+                    with sqla_session() as session:
+                        stored_hash = Device.get_config_hash(session, hostname)
+                if stored_hash and stored_hash != get_running_config_hash(task):
+                    task.host["hash_check_failed"] = True
+                    raise Exception('Device {} configuration is altered outside of CNaaS!'.format(
+                        task.host.name))
+            if unchanged:
+                logger.debug("Config for host {} unchanged since last sync, skipping compare".
+                             format(task.host.name))
+                task.run(task=unchanged_config, name="Sync device config")
+            else:
+                task.run(task=napalm_configure,
+                         name="Sync device config",
+                         replace=True,
+                         configuration=task.host["config"],
+                         dry_run=dry_run
+                         )
+            # New config hash after commit, or after empty diff since local changes
+            # can reorder CLI commands so the hash changes without any diff
+            if update_hash and bool(task.results[1].diff) != dry_run:
+                try:
+                    task.host["config_hash"] = get_running_config_hash(task)
+                except Exception as e:
+                    logger.exception("Unable to get config hash for {}: {}".format(
+                        task.host.name, str(e)))
 
         if task.results[1].diff:
             config = task.results[1].host["config"]
@@ -415,7 +723,7 @@ def push_sync_device(task, dry_run: bool = True, generate_only: bool = False,
             task.host["change_score"] = 0
     if job_id:
         with redis_session() as db:
-            db.lpush('finished_devices_' + str(job_id), task.host.name)
+            db.rpush('finished_devices_' + str(job_id), task.host.name)
 
 
 def generate_only(hostname: str) -> (str, dict):
@@ -429,7 +737,7 @@ def generate_only(hostname: str) -> (str, dict):
         (string with config, dict with available template variables)
     """
     logger = get_logger()
-    nr = cnaas_init()
+    nr = cnaas_init([hostname])
     nr_filtered, _, _ = inventory_selector(nr, hostname=hostname)
     template_vars = {}
     if len(nr_filtered.inventory.hosts) != 1:
@@ -455,6 +763,12 @@ def generate_only(hostname: str) -> (str, dict):
             return str(e), template_vars
 
 
+def mark_unsynchronized(hostnames: List[str]):
+    with sqla_session() as session:
+        session.query(Device).filter(Device.hostname.in_(hostnames)).\
+            update({Device.synchronized: False}, synchronize_session=False)
+
+
 def sync_check_hash(task, force=False, job_id=None):
     """
     Start the task which will compare device configuration hashes.
@@ -472,9 +786,8 @@ def sync_check_hash(task, force=False, job_id=None):
     if stored_hash is None:
         return
 
-    task.host.open_connection("napalm", configuration=task.nornir.config)
-    res = task.run(task=napalm_get, getters=["config"])
-    task.host.close_connection("napalm")
+    with napalm_connection(task):
+        res = task.run(task=napalm_get, getters=["config"])
 
     running_config = dict(res.result)['config']['running'].encode()
     if running_config is None:
@@ -488,7 +801,8 @@ def sync_check_hash(task, force=False, job_id=None):
 def update_config_hash(task):
     logger = get_logger()
     try:
-        res = task.run(task=napalm_get, getters=["config"])
+        with napalm_connection(task):
+            res = task.run(task=napalm_get, getters=["config"])
         if not isinstance(res, MultiResult) or len(res) != 1 or not isinstance(res[0].result, dict) \
                 or 'config' not in res[0].result:
             raise Exception("Unable to get config from device")
@@ -505,7 +819,7 @@ def update_config_hash(task):
 
 
 def confcheck_devices(hostnames: List[str], job_id=None):
-    nr = cnaas_init()
+    nr = cnaas_init(hostnames)
     nr_filtered, dev_count, skipped_hostnames = \
         inventory_selector(nr, hostname=hostnames)
 
@@ -546,7 +860,7 @@ def sync_devices(hostnames: Optional[List[str]] = None, device_type: Optional[st
         NornirJobResult
     """
     logger = get_logger()
-    nr = cnaas_init()
+    nr = cnaas_init(hostnames)
     dev_count = 0
     skipped_hostnames = []
     if hostnames:
@@ -574,43 +888,69 @@ def sync_devices(hostnames: Optional[List[str]] = None, device_type: Optional[st
         dev_count, ", ".join(device_list)
     ))
 
-    try:
-        nrresult = nr_filtered.run(task=sync_check_hash,
-                                   force=force,
-                                   job_id=job_id)
-    except Exception as e:
-        logger.exception("Exception while checking config hash: {}".format(str(e)))
-        raise e
-    else:
-        if nrresult.failed:
-            # Mark devices as unsynchronized if config hash check failed
-            with sqla_session() as session:
-                session.query(Device).filter(Device.hostname.in_(nrresult.failed_hosts.keys())).\
-                    update({Device.synchronized: False}, synchronize_session=False)
-            raise Exception('Configuration hash check failed for {}'.format(
-                ' '.join(nrresult.failed_hosts.keys())))
+    # Time spent in each stage of the job, in seconds
+    timing = {}
+    # Dry runs check the config hash in the same device session as the
+    # compare. Live runs must check all devices before changing any of them.
+    fused_hash_check = dry_run and not force
+    if not fused_hash_check:
+        stage_start = time.monotonic()
+        try:
+            nrresult = nr_filtered.run(task=sync_check_hash,
+                                       force=force,
+                                       job_id=job_id)
+        except Exception as e:
+            logger.exception("Exception while checking config hash: {}".format(str(e)))
+            raise e
+        else:
+            if nrresult.failed:
+                # Mark devices as unsynchronized if config hash check failed
+                mark_unsynchronized(list(nrresult.failed_hosts.keys()))
+                raise Exception('Configuration hash check failed for {}'.format(
+                    ' '.join(nrresult.failed_hosts.keys())))
+        timing['hash_check'] = round(time.monotonic() - stage_start, 3)
+
+    # Stage one: generate config for all devices before connecting to any of them
+    stage_start = time.monotonic()
+    topology = TopologySnapshot.load(device_list)
+    timing['topology'] = round(time.monotonic() - stage_start, 3)
+    stage_start = time.monotonic()
+    rendered_configs = generate_configs(nr_filtered, topology, skip_unchanged=dry_run and not force)
+    timing['generate'] = round(time.monotonic() - stage_start, 3)
 
     if not dry_run:
-        with sqla_session() as session:
-            logger.info("Trying to acquire lock for devices to run syncto job: {}".format(job_id))
-            if not Joblock.acquire_lock(session, name='devices', job_id=job_id):
-                raise JoblockError("Unable to acquire lock for configuring devices")
+        logger.info("Trying to acquire lock for devices to run syncto job: {}".format(job_id))
+        stage_start = time.monotonic()
+        acquire_device_locks(device_list, job_id)
+        timing['lock_wait'] = round(time.monotonic() - stage_start, 3)
 
+    # Stage two: only device I/O in the Nornir worker threads
+    stage_start = time.monotonic()
     try:
         nrresult = nr_filtered.run(task=push_sync_device, dry_run=dry_run,
-                                   job_id=job_id)
+                                   job_id=job_id, rendered_configs=rendered_configs,
+                                   verify_hash=fused_hash_check,
+                                   update_hash=not dry_run or force)
     except Exception as e:
         logger.exception("Exception while synchronizing devices: {}".format(str(e)))
         try:
             if not dry_run:
                 with sqla_session() as session:
                     logger.info("Releasing lock for devices from syncto job: {}".format(job_id))
-                    Joblock.release_lock(session, job_id=job_id)
+                    DeviceLock.release_locks(session, job_id=job_id)
         except Exception:
             logger.error("Unable to release devices lock after syncto job")
-        return NornirJobResult(nrresult=nrresult)
+        raise e
+    timing['push'] = round(time.monotonic() - stage_start, 3)
 
     failed_hosts = list(nrresult.failed_hosts.keys())
+    if fused_hash_check:
+        hash_failed_hosts = [x for x in failed_hosts
+                             if nr_filtered.inventory.hosts[x].get('hash_check_failed')]
+        if hash_failed_hosts:
+            mark_unsynchronized(hash_failed_hosts)
+            raise Exception('Configuration hash check failed for {}'.format(
+                ' '.join(hash_failed_hosts)))
     for hostname in failed_hosts:
         logger.error("Synchronization of device '{}' failed".format(hostname))
 
@@ -637,35 +977,35 @@ def sync_devices(hostnames: Optional[List[str]] = None, device_type: Optional[st
             logger.debug("Empty diff for host {}, 0 change score".format(
                 host))
 
-    nr_confighash = None
-    if dry_run and force:
-        # update config hash for devices that had an empty diff because local
-        # changes on a device can cause reordering of CLI commands that results
-        # in config hash mismatch even if the calculated diff was empty
-        def include_filter(host, include_list=unchanged_hosts):
-            if host.name in include_list:
-                return True
-            else:
-                return False
-        nr_confighash = nr_filtered.filter(filter_func=include_filter)
-    elif not dry_run:
-        # set new config hash for devices that was successfully updated
-        def exclude_filter(host, exclude_list=failed_hosts+unchanged_hosts):
-            if host.name in exclude_list:
-                return False
-            else:
-                return True
-        nr_confighash = nr_filtered.filter(filter_func=exclude_filter)
-
-    if nr_confighash:
-        try:
-            nrresult_confighash = nr_confighash.run(task=update_config_hash)
-        except Exception as e:
-            logger.exception("Exception while updating config hashes: {}".format(str(e)))
-        else:
-            if nrresult_confighash.failed:
-                logger.error("Unable to update some config hashes: {}".format(
-                    list(nrresult_confighash.failed_hosts.keys())))
+    # New config hashes fetched after commit, or after an empty diff in a
+    # forced dry run, by push_sync_device
+    if not dry_run:
+        confighash_hosts = [x for x in changed_hosts if x not in failed_hosts]
+    elif force:
+        confighash_hosts = unchanged_hosts
+    else:
+        confighash_hosts = []
+    config_hashes = {}
+    for hostname in confighash_hosts:
+        config_hash = nr_filtered.inventory.hosts[hostname].get('config_hash')
+        if config_hash:
+            config_hashes[hostname] = config_hash
+    if len(config_hashes) != len(confighash_hosts):
+        logger.error("Unable to update some config hashes: {}".format(
+            [x for x in confighash_hosts if x not in config_hashes]))
+    if config_hashes:
+        with sqla_session() as session:
+            for dev in session.query(Device).filter(Device.hostname.in_(config_hashes.keys())):
+                dev.confhash = config_hashes[dev.hostname]
+                logger.debug("Config hash for {} updated to {}".format(
+                    dev.hostname, dev.confhash))
+
+    # Devices with an empty diff and a verified config hash, these can skip
+    # compare in later dry runs as long as the generated config is unchanged
+    if force:
+        synced_hosts = [x for x in unchanged_hosts if x in config_hashes] if dry_run else []
+    else:
+        synced_hosts = list(unchanged_hosts)
 
     # set devices as synchronized if needed
     with sqla_session() as session:
@@ -684,7 +1024,13 @@ def sync_devices(hostnames: Optional[List[str]] = None, device_type: Optional[st
             dev.last_seen = datetime.datetime.utcnow()
         if not dry_run:
             logger.info("Releasing lock for devices from syncto job: {}".format(job_id))
-            Joblock.release_lock(session, job_id=job_id)
+            DeviceLock.release_locks(session, job_id=job_id)
+
+    if synced_hosts:
+        with sqla_session() as session:
+            confhashes = dict(session.query(Device.hostname, Device.confhash).
+                              filter(Device.hostname.in_(synced_hosts)).all())
+        set_rendered_configs_synced(confhashes)
 
     if len(device_list) == 0:
         total_change_score = 0
@@ -715,7 +1061,12 @@ def sync_devices(hostnames: Optional[List[str]] = None, device_type: Optional[st
                 f"{total_change_score} is higher than auto-push limit {AUTOPUSH_MAX_SCORE}"
             )
 
-    return NornirJobResult(nrresult=nrresult, next_job_id=next_job_id, change_score=total_change_score)
+    logger.info("Synchronization stage timing (seconds): {}".format(
+        ", ".join(["{}: {}".format(stage, seconds) for stage, seconds in timing.items()])))
+    logger.debug("NAPALM connection pool: {}".format(NapalmConnectionPool().get_stats()))
+
+    return NornirJobResult(nrresult=nrresult, next_job_id=next_job_id, change_score=total_change_score,
+                           timing=timing)
 
 
 def push_static_config(task, config: str, dry_run: bool = True,
@@ -770,7 +1121,7 @@ def apply_config(hostname: str, config: str, dry_run: bool,
         elif not (dev.state == DeviceState.MANAGED or dev.state == DeviceState.UNMANAGED):
             raise Exception("Device {} is in invalid state: {}".format(hostname, dev.state))
 
-    nr = cnaas_init()
+    nr = cnaas_init([hostname])
     nr_filtered, _, _ = inventory_selector(nr, hostname=hostname)
 
     try:
@@ -0,0 +1,173 @@
+import os
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import yaml
+from jinja2 import Environment as JinjaEnvironment, meta
+from jinja2.exceptions import TemplateSyntaxError
+
+from cnaas_nms.app_settings import app_settings
+from cnaas_nms.confpush.nornir_helper import get_templates_commit
+from cnaas_nms.db.device import DeviceType
+from cnaas_nms.db.exceptions import RepoStructureException
+from cnaas_nms.tools.log import get_logger
+
+
+def get_mapping_dependencies(mapping: dict, devtype: DeviceType) -> List[str]:
+    """Get entrypoint and manually listed dependencies for a device type
+    from a parsed mapping.yml.
+
+    Raises:
+        KeyError: Entrypoint is not defined for the device type
+    """
+    dependencies = list([mapping[devtype.name]['entrypoint']])
+    if 'dependencies' in mapping[devtype.name] and \
+            isinstance(mapping[devtype.name]['dependencies'], list):
+        dependencies.extend(mapping[devtype.name]['dependencies'])
+    return dependencies
+
+
+class TemplateGraph(object):
+    """Graph of include, import, extends and from-import references between
+    all templates in the templates repository.
+
+    Template names are paths relative to the repository root, for example
+    "eos/access-base.j2". Templates referring to other templates using a
+    non-constant expression, and templates that can not be parsed, are
+    assumed to depend on all templates of the same platform.
+    """
+    def __init__(self, repo_path: str):
+        logger = get_logger()
+        self.repo_path = repo_path
+        self.mappings: Dict[str, dict] = {}
+        self.references: Dict[str, Set[str]] = {}
+        self.referenced_by: Dict[str, Set[str]] = {}
+        env = JinjaEnvironment()
+
+        for platform in sorted(os.listdir(repo_path)):
+            path = os.path.join(repo_path, platform)
+            if not os.path.isdir(path) or platform.startswith('.'):
+                continue
+            self.mappings[platform] = self.read_mapping(path)
+            platform_templates: List[str] = []
+            dynamic_templates: List[str] = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                for filename in filenames:
+                    if filename.startswith('.'):
+                        continue
+                    name = os.path.relpath(os.path.join(dirpath, filename), path)
+                    template = os.path.join(platform, name)
+                    platform_templates.append(template)
+                    self.references.setdefault(template, set())
+                    if name == 'mapping.yml':
+                        continue
+                    try:
+                        with open(os.path.join(path, name), 'r') as f:
+                            ast = env.parse(f.read())
+                    except (TemplateSyntaxError, UnicodeDecodeError) as e:
+                        logger.warning(
+                            "Could not parse template {}, assuming it depends on all "
+                            "templates for platform {}: {}".format(template, platform, e))
+                        dynamic_templates.append(template)
+                        continue
+                    for ref in meta.find_referenced_templates(ast):
+                        if ref is None:
+                            dynamic_templates.append(template)
+                            continue
+                        # Same as RelativeJinjaEnvironment.join_path
+                        ref_name = os.path.normpath(os.path.join(os.path.dirname(name), ref))
+                        self.references[template].add(os.path.join(platform, ref_name))
+            for template in dynamic_templates:
+                self.references[template].update(platform_templates)
+
+        for template, refs in self.references.items():
+            for ref in refs:
+                self.referenced_by.setdefault(ref, set()).add(template)
+
+    @staticmethod
+    def read_mapping(path: str) -> dict:
+        logger = get_logger()
+        mapfile = os.path.join(path, 'mapping.yml')
+        if not os.path.isfile(mapfile):
+            raise RepoStructureException(
+                "File mapping.yml not found in template repo {}".format(path))
+        try:
+            with open(mapfile, 'r') as f:
+                return yaml.safe_load(f)
+        except Exception as e:
+            logger.exception(
+                "Could not parse {}/mapping.yml in template repo: {}".format(path, str(e)))
+            raise RepoStructureException(
+                "Could not parse {}/mapping.yml in template repo: {}".format(path, str(e)))
+
+    @staticmethod
+    def _closure(start: Iterable[str], edges: Dict[str, Set[str]]) -> Set[str]:
+        ret: Set[str] = set()
+        stack = list(start)
+        while stack:
+            template = stack.pop()
+            if template in ret:
+                continue
+            ret.add(template)
+            stack.extend(edges.get(template, ()))
+        return ret
+
+    def get_entrypoints(self, platform: str, devtype: DeviceType) -> List[str]:
+        """Get entrypoint and manually listed dependencies of a device type.
+
+        Raises:
+            RepoStructureException: Entrypoint is not defined for device type
+        """
+        logger = get_logger()
+        try:
+            return [os.path.join(platform, x) for x in
+                    get_mapping_dependencies(self.mappings[platform], devtype)]
+        except KeyError as e:
+            logger.exception(
+                "Could not parse mapping.yml in template repo for {}, value not found: {}".
+                format(devtype.name, str(e)))
+            raise RepoStructureException(
+                "Could not parse mapping.yml in template repo for {}, value not found: {}".
+                format(devtype.name, str(e)))
+
+    def get_devtypes(self) -> List[Tuple[DeviceType, str]]:
+        """Get all (device type, platform) pairs defined in mapping.yml files."""
+        return [(devtype, platform) for platform, mapping in self.mappings.items()
+                for devtype in DeviceType if mapping and devtype.name in mapping]
+
+    def get_dependencies(self, platform: str, devtype: DeviceType) -> Set[str]:
+        """Get all templates used when rendering config for a device type,
+        including mapping.yml of the platform."""
+        return self._closure(self.get_entrypoints(platform, devtype), self.references) | \
+            {os.path.join(platform, 'mapping.yml')}
+
+    def get_affected_templates(self, changed_files: Iterable[str]) -> Set[str]:
+        """Get all templates that directly or indirectly reference any of
+        the changed files, including the changed files."""
+        return self._closure(changed_files, self.referenced_by)
+
+    def get_affected_devtypes(self, changed_files: Iterable[str]) -> Set[Tuple[DeviceType, str]]:
+        """Get (device type, platform) pairs that use any of the changed files."""
+        affected = self.get_affected_templates(changed_files)
+        ret = set()
+        for devtype, platform in self.get_devtypes():
+            if os.path.join(platform, 'mapping.yml') in affected or \
+                    affected.intersection(self.get_entrypoints(platform, devtype)):
+                ret.add((devtype, platform))
+        return ret
+
+
+@lru_cache(maxsize=2)
+def _get_template_graph(repo_path: str, commit: Optional[str]) -> TemplateGraph:
+    return TemplateGraph(repo_path)
+
+
+def get_template_graph() -> TemplateGraph:
+    """Get the template graph for the templates repository, parsed once per
+    commit. If the templates directory is not a git repository it's parsed
+    on every call."""
+    commit = get_templates_commit()
+    if commit is None:
+        return TemplateGraph(app_settings.TEMPLATES_LOCAL)
+    return _get_template_graph(app_settings.TEMPLATES_LOCAL, commit)
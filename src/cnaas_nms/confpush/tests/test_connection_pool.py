@@ -0,0 +1,116 @@
+import time
+import unittest
+from types import SimpleNamespace
+
+from cnaas_nms.confpush.connection_pool import NapalmConnectionPool, ConnectionPoolError, \
+    napalm_connection
+from cnaas_nms.scheduler.scheduler import SingletonType
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.connection = self
+
+    def is_alive(self):
+        return {'is_alive': self.alive}
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHost(object):
+    def __init__(self, name, password='abc123'):
+        self.name = name
+        self.password = password
+        self.connections = {}
+        self.opened = 0
+
+    def get_connection_parameters(self, connection):
+        return SimpleNamespace(hostname=self.name, port=443, platform='eos',
+                               username='admin', password=self.password, extras={})
+
+    def open_connection(self, connection, configuration):
+        self.opened += 1
+        self.connections[connection] = FakeConnection()
+
+    def close_connection(self, connection):
+        self.connections.pop(connection).close()
+
+
+class ConnectionPoolTests(unittest.TestCase):
+    def setUp(self):
+        SingletonType._instances.pop(NapalmConnectionPool, None)
+        self.pool = NapalmConnectionPool(idle_timeout=300, max_per_host=1, wait_timeout=0)
+
+    def tearDown(self):
+        self.pool.close_all()
+        SingletonType._instances.pop(NapalmConnectionPool, None)
+
+    def test_reuse(self):
+        host = FakeHost('eosaccess')
+        key = self.pool.borrow(host, None)
+        conn = host.connections['napalm']
+        self.assertRaises(ConnectionPoolError, self.pool.borrow, FakeHost('eosaccess'), None)
+        self.pool.release(host, key)
+        self.assertEqual(host.connections, {})
+
+        host = FakeHost('eosaccess')
+        key = self.pool.borrow(host, None)
+        self.assertIs(host.connections['napalm'], conn)
+        self.assertEqual(host.opened, 0)
+        self.pool.release(host, key)
+
+        # Changed credentials should not reuse connection
+        host = FakeHost('eosaccess', password='changed')
+        key = self.pool.borrow(host, None)
+        self.assertIsNot(host.connections['napalm'], conn)
+        self.pool.release(host, key)
+        stats = self.pool.get_stats()
+        self.assertEqual((stats['opened'], stats['reused'], stats['idle']), (2, 1, 2))
+
+    def test_unhealthy_and_discard(self):
+        host = FakeHost('eosaccess')
+        key = self.pool.borrow(host, None)
+        conn = host.connections['napalm']
+        self.pool.release(host, key)
+        conn.alive = False
+        key = self.pool.borrow(host, None)
+        self.assertTrue(conn.closed)
+        self.assertIsNot(host.connections['napalm'], conn)
+
+        conn = host.connections['napalm']
+        self.pool.release(host, key, discard=True)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.pool.get_stats()['idle'], 0)
+
+    def test_reap_idle(self):
+        self.pool.idle_timeout = 0
+        self.pool.reap_interval = 0.01
+        host = FakeHost('eosaccess')
+        key = self.pool.borrow(host, None)
+        conn = host.connections['napalm']
+        self.pool.release(host, key)
+        # Closed without any further use of the pool
+        for _ in range(100):
+            if conn.closed:
+                break
+            time.sleep(0.01)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.pool.get_stats()['idle'], 0)
+
+    def test_context_manager(self):
+        task = SimpleNamespace(host=FakeHost('eosaccess'), nornir=SimpleNamespace(config=None))
+        with self.assertRaises(ValueError):
+            with napalm_connection(task) as conn:
+                raise ValueError()
+        self.assertTrue(conn.closed)
+        with napalm_connection(task) as conn:
+            pass
+        self.assertFalse(conn.closed)
+        self.assertEqual(self.pool.get_stats()['idle'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import tempfile
+import os
+from unittest import mock
+
+import cnaas_nms.confpush.nornir_helper
+from cnaas_nms.confpush.nornir_helper import get_jinja_env, clear_jinja_cache
+
+
+class JinjaCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.template_dir = os.path.join(self.tmpdir.name, 'templates')
+        os.mkdir(self.template_dir)
+        with open(os.path.join(self.template_dir, 'test.j2'), 'w') as f:
+            f.write("hostname {{ hostname }}\n")
+        self.cache_dir = os.path.join(self.tmpdir.name, 'cache')
+        patcher = mock.patch.object(cnaas_nms.confpush.nornir_helper,
+                                    'JINJA_BYTECODE_CACHE_DIR', self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmpdir.cleanup)
+        self.addCleanup(clear_jinja_cache)
+
+    def test_jinja_env_per_commit(self):
+        with mock.patch.object(cnaas_nms.confpush.nornir_helper, 'get_templates_commit',
+                               return_value='a' * 40):
+            env_a = get_jinja_env(self.template_dir)
+            self.assertIs(env_a, get_jinja_env(self.template_dir))
+            self.assertEqual(env_a.get_template('test.j2').render(hostname='eosdist1'),
+                             "hostname eosdist1\n")
+        self.assertTrue(os.listdir(os.path.join(self.cache_dir, 'a' * 40)))
+
+        with mock.patch.object(cnaas_nms.confpush.nornir_helper, 'get_templates_commit',
+                               return_value='b' * 40):
+            env_b = get_jinja_env(self.template_dir)
+            self.assertIsNot(env_a, env_b)
+            env_b.get_template('test.j2').render(hostname='eosdist1')
+
+        clear_jinja_cache(keep_commit='b' * 40)
+        self.assertEqual(os.listdir(self.cache_dir), ['b' * 40])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+
+from cnaas_nms.confpush.rendered_config import template_vars_digest
+
+
+class RenderedConfigTests(unittest.TestCase):
+    def test_template_vars_digest(self):
+        template_vars = {'hostname': 'eosaccess', 'vxlans': {'a': 1, 'b': 2}}
+        reordered_vars = {'vxlans': {'b': 2, 'a': 1}, 'hostname': 'eosaccess'}
+        host_vars = {'name': 'eosaccess', 'platform': 'eos'}
+        digest = template_vars_digest('c1', 'eos', 'access.j2', template_vars, host_vars)
+        self.assertEqual(
+            digest, template_vars_digest('c1', 'eos', 'access.j2', reordered_vars, host_vars))
+        self.assertNotEqual(
+            digest, template_vars_digest('c2', 'eos', 'access.j2', template_vars, host_vars))
+        self.assertNotEqual(
+            digest, template_vars_digest('c1', 'eos', 'access.j2', {**template_vars, 'x': 1},
+                                         host_vars))
+        self.assertIsNone(template_vars_digest(None, 'eos', 'access.j2', template_vars, host_vars))
+        # Sync state changes between runs
+        self.assertEqual(
+            digest, template_vars_digest('c1', 'eos', 'access.j2', template_vars,
+                                         {**host_vars, 'synchronized': False, 'managed': True}))
+
+
+if __name__ == '__main__':
+    unittest.main()
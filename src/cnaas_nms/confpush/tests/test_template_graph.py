@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from cnaas_nms.confpush.template_graph import TemplateGraph
+from cnaas_nms.db.device import DeviceType
+
+
+class TemplateGraphTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        templates = {
+            'mapping.yml': "ACCESS:\n  entrypoint: access.j2\n"
+                           "DIST:\n  entrypoint: dist.j2\n  dependencies:\n    - extra.j2\n",
+            'access.j2': '{% include "sub/a.j2" %}{% import "macros.j2" as m %}',
+            'sub/a.j2': '{% include "b.j2" %}',
+            'sub/b.j2': 'b',
+            'macros.j2': '{% macro x() %}{% endmacro %}',
+            'dist.j2': '{% extends "base.j2" %}',
+            'base.j2': '{% include "macros.j2" %}',
+            'extra.j2': 'extra',
+        }
+        for name, content in templates.items():
+            filename = os.path.join(self.tmpdir.name, 'eos', name)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename, 'w') as f:
+                f.write(content)
+        self.graph = TemplateGraph(self.tmpdir.name)
+
+    def test_affected_devtypes(self):
+        self.assertEqual(self.graph.get_affected_devtypes({'eos/sub/b.j2'}),
+                         {(DeviceType.ACCESS, 'eos')})
+        self.assertEqual(self.graph.get_affected_devtypes({'eos/macros.j2'}),
+                         {(DeviceType.ACCESS, 'eos'), (DeviceType.DIST, 'eos')})
+        self.assertEqual(self.graph.get_affected_devtypes({'eos/extra.j2'}),
+                         {(DeviceType.DIST, 'eos')})
+        self.assertEqual(self.graph.get_affected_devtypes({'README.md'}), set())
+
+    def test_parse_error(self):
+        filename = os.path.join(self.tmpdir.name, 'eos', 'sub', 'a.j2')
+        with open(filename, 'w') as f:
+            f.write('{% include "b.j2" %}{% if %}')
+        graph = TemplateGraph(self.tmpdir.name)
+        self.assertEqual(graph.get_affected_devtypes({'eos/extra.j2'}),
+                         {(DeviceType.ACCESS, 'eos'), (DeviceType.DIST, 'eos')})
+        self.assertIn('eos/sub/b.j2', graph.get_dependencies('eos', DeviceType.ACCESS))
+
+    def test_dependencies(self):
+        self.assertEqual(self.graph.get_dependencies('eos', DeviceType.ACCESS), {
+            'eos/mapping.yml', 'eos/access.j2', 'eos/sub/a.j2', 'eos/sub/b.j2', 'eos/macros.j2'
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
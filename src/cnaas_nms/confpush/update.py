@@ -10,7 +10,7 @@ from cnaas_nms.db.device import Device, DeviceType, DeviceState
 from cnaas_nms.db.interface import Interface, InterfaceConfigType
 from cnaas_nms.confpush.get import get_interfaces_names, get_uplinks, \
     filter_interfaces, get_mlag_ifs, get_neighbors, verify_peer_iftype
-from cnaas_nms.db.settings import get_settings
+from cnaas_nms.db.settings import get_settings, invalidate_downstream_vxlans
 from cnaas_nms.tools.log import get_logger
 from cnaas_nms.scheduler.wrapper import job_wrapper
 from cnaas_nms.confpush.nornir_helper import NornirJobResult
@@ -175,7 +175,7 @@ def update_facts(hostname: str,
             ))
         hostname = dev.hostname
 
-    nr = cnaas_nms.confpush.nornir_helper.cnaas_init()
+    nr = cnaas_nms.confpush.nornir_helper.cnaas_init([hostname])
     nr_filtered = nr.filter(name=hostname)
 
     nrresult = nr_filtered.run(task=napalm_get, getters=["facts"])
@@ -230,6 +230,8 @@ def update_linknets(session, hostname: str, devtype: DeviceType,
         settings_hostname = hostname
 
     ret = []
+    # Devices with added or removed linknets
+    changed_hostnames = set()
 
     local_device_inst: Device = session.query(Device).filter(Device.hostname == hostname).one()
     logger.debug("Updating linknets for device id {} ({}) of type {}...".format(
@@ -332,6 +334,8 @@ def update_linknets(session, hostname: str, devtype: DeviceType,
             else:
                 # TODO: update instead of delete+new insert?
                 if not dry_run:
+                    changed_hostnames.update({check_linknet.device_a.hostname,
+                                              check_linknet.device_b.hostname})
                     session.delete(check_linknet)
                     session.commit()
 
@@ -352,6 +356,7 @@ def update_linknets(session, hostname: str, devtype: DeviceType,
         if not dry_run:
             session.add(new_link)
             session.commit()
+            changed_hostnames.update({local_device_inst.hostname, remote_device_inst.hostname})
         else:
             # Make sure linknet object is not added to session because of foreign key load
             session.expunge(new_link)
@@ -366,4 +371,7 @@ def update_linknets(session, hostname: str, devtype: DeviceType,
         }
         del ret_dict['id']
         ret.append({k: ret_dict[k] for k in sorted(ret_dict)})
+    if changed_hostnames:
+        # DIST settings include VXLANs from downstream ACCESS devices
+        invalidate_downstream_vxlans(changed_hostnames)
     return ret
@@ -0,0 +1,157 @@
+import datetime
+import hashlib
+import zlib
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import Column, String, DateTime, Integer, LargeBinary
+from sqlalchemy.dialects.postgresql import insert
+
+import cnaas_nms.db.base
+
+
+# Strings shorter than this are kept inline in job results
+ARTIFACT_MIN_SIZE = 256
+ARTIFACT_KEY = 'artifact'
+
+
+class ArtifactNotFoundError(Exception):
+    pass
+
+
+def is_artifact_ref(value) -> bool:
+    return isinstance(value, dict) and set(value.keys()) == {ARTIFACT_KEY}
+
+
+class ConfigArtifact(cnaas_nms.db.base.Base):
+    """Rendered configurations and diffs stored once per unique content,
+    compressed and keyed by SHA-256 of the content. Job results refer to
+    artifacts as {"artifact": <sha256>} instead of including the text."""
+    __tablename__ = 'config_artifact'
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created = Column(DateTime, default=datetime.datetime.utcnow)
+
+    @staticmethod
+    def get_digest(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def store_many(cls, session, texts: Iterable[str]) -> Dict[str, dict]:
+        """Store texts that are not already stored.
+
+        Args:
+            session: sqla_session
+            texts: Configurations or diffs to store
+
+        Returns:
+            Dict with text as key and artifact reference as value
+        """
+        refs: Dict[str, str] = {}
+        rows = []
+        for text in texts:
+            if text in refs:
+                continue
+            digest = cls.get_digest(text)
+            refs[text] = digest
+            data = text.encode('utf-8')
+            rows.append({
+                'sha256': digest,
+                'size': len(data),
+                'data': zlib.compress(data),
+                'created': datetime.datetime.utcnow()
+            })
+        for i in range(0, len(rows), 500):
+            session.execute(
+                insert(cls.__table__).values(rows[i:i + 500]).
+                on_conflict_do_nothing(index_elements=['sha256'])
+            )
+        return {text: {ARTIFACT_KEY: digest} for text, digest in refs.items()}
+
+    @classmethod
+    def load_many(cls, session, digests: Iterable[str]) -> Dict[str, str]:
+        """Get text of stored artifacts.
+
+        Returns:
+            Dict with SHA-256 as key and text as value, artifacts not found
+            are not included
+        """
+        digests = set(digests)
+        if not digests:
+            return {}
+        ret = {}
+        for artifact in session.query(cls).filter(cls.sha256.in_(digests)):
+            ret[artifact.sha256] = zlib.decompress(artifact.data).decode('utf-8')
+        return ret
+
+    @classmethod
+    def resolve(cls, session, value: Optional[object]):
+        """Get text for an artifact reference, other values are returned
+        unchanged.
+
+        Raises:
+            ArtifactNotFoundError: Referenced artifact is not stored
+        """
+        if not is_artifact_ref(value):
+            return value
+        digest = value[ARTIFACT_KEY]
+        res = cls.load_many(session, [digest])
+        if digest not in res:
+            raise ArtifactNotFoundError("Config artifact {} not found".format(digest))
+        return res[digest]
+
+
+def store_job_artifacts(session, devices: dict) -> int:
+    """Move large task results and diffs of a serialized nornir job result
+    to the artifact store, replacing them with artifact references.
+
+    Args:
+        session: sqla_session
+        devices: Job result devices dict as returned by nr_result_serialize
+
+    Returns:
+        Number of replaced values
+    """
+    texts = []
+    for host_result in devices.values():
+        for task in host_result.get('job_tasks', []):
+            for key in ['result', 'diff']:
+                value = task.get(key)
+                if isinstance(value, str) and len(value) >= ARTIFACT_MIN_SIZE:
+                    texts.append(value)
+    if not texts:
+        return 0
+    refs = ConfigArtifact.store_many(session, texts)
+    for host_result in devices.values():
+        for task in host_result.get('job_tasks', []):
+            for key in ['result', 'diff']:
+                value = task.get(key)
+                if isinstance(value, str) and value in refs:
+                    task[key] = refs[value]
+    return len(texts)
+
+
+def resolve_job_artifacts(session, devices: dict, task_indexes: Optional[Iterable[int]] = None):
+    """Replace artifact references in a job result devices dict with the
+    stored text, using a single query for all references.
+
+    Args:
+        session: sqla_session
+        devices: Job result devices dict
+        task_indexes: Only resolve references in tasks with these indexes
+    """
+    if task_indexes is not None:
+        task_indexes = set(task_indexes)
+    refs = []
+    for host_result in devices.values():
+        for i, task in enumerate(host_result.get('job_tasks', [])):
+            if task_indexes is not None and i not in task_indexes:
+                continue
+            for key in ['result', 'diff']:
+                if is_artifact_ref(task.get(key)):
+                    refs.append((task, key))
+    texts = ConfigArtifact.load_many(session, [task[key][ARTIFACT_KEY] for task, key in refs])
+    for task, key in refs:
+        digest = task[key][ARTIFACT_KEY]
+        if digest in texts:
+            task[key] = texts[digest]
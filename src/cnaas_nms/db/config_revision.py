@@ -0,0 +1,74 @@
+import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index
+
+import cnaas_nms.db.base
+from cnaas_nms.db.config_artifact import ARTIFACT_KEY, is_artifact_ref
+
+
+class DeviceConfigRevision(cnaas_nms.db.base.Base):
+    """Generated configuration of a device for each finished syncto job,
+    both live and dry runs, so previous configurations can be found without
+    searching job results."""
+    __tablename__ = 'device_config_revision'
+    __table_args__ = (
+        # Unique index used for lookups by job_id and ordering by job_id per device
+        Index('ix_device_config_revision_hostname_job_id', 'hostname', 'job_id', unique=True),
+        Index('ix_device_config_revision_hostname_finish_time', 'hostname', 'finish_time'),
+    )
+    id = Column(Integer, autoincrement=True, primary_key=True)
+    hostname = Column(String(64), nullable=False)
+    job_id = Column(Integer, ForeignKey('job.id'), nullable=False, index=True)
+    finish_time = Column(DateTime, default=datetime.datetime.utcnow)
+    failed = Column(Boolean, default=False)
+    # Reference to generated config in the config_artifact table, null for
+    # revisions recorded before configs were stored as artifacts
+    config_artifact = Column(String(64), ForeignKey('config_artifact.sha256'))
+    # Hash of running config on device after the job finished
+    config_hash = Column(String(64))
+
+    def as_dict(self) -> dict:
+        """Return JSON serializable dict."""
+        return {
+            'id': self.id,
+            'hostname': self.hostname,
+            'job_id': self.job_id,
+            'finish_time': self.finish_time.isoformat(timespec='seconds')
+            if self.finish_time else None,
+            'failed': self.failed,
+            'config_artifact': self.config_artifact,
+            'config_hash': self.config_hash,
+        }
+
+    @classmethod
+    def add_job_revisions(cls, session, job_id: int, finish_time: datetime.datetime,
+                          devices: dict, config_hashes: Dict[str, str]) -> List['DeviceConfigRevision']:
+        """Record generated configs from a syncto job result.
+
+        Args:
+            session: sqla_session
+            job_id: Job id
+            finish_time: Time the job finished
+            devices: Job result devices dict as returned by nr_result_serialize,
+                     with configs replaced by artifact references
+            config_hashes: Running config hash for devices with hostname as key
+        """
+        revisions = []
+        for hostname, host_result in devices.items():
+            config_artifact: Optional[str] = None
+            for task in host_result.get('job_tasks', []):
+                if task.get('task_name') == 'Generate device config' and \
+                        is_artifact_ref(task.get('result')):
+                    config_artifact = task['result'][ARTIFACT_KEY]
+            revision = cls(
+                hostname=hostname,
+                job_id=job_id,
+                finish_time=finish_time,
+                failed=bool(host_result.get('failed')),
+                config_artifact=config_artifact,
+                config_hash=config_hashes.get(hostname),
+            )
+            session.add(revision)
+            revisions.append(revision)
+        return revisions
@@ -11,7 +11,7 @@ from sqlalchemy import Column, Integer, Unicode, String, UniqueConstraint
 from sqlalchemy import Enum, DateTime, Boolean
 from sqlalchemy import ForeignKey
 from sqlalchemy import event
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, object_session, Session
 from sqlalchemy_utils import IPAddressType
 
 import cnaas_nms.db.base
@@ -20,9 +20,13 @@ import cnaas_nms.db.linknet
 
 from cnaas_nms.db.interface import Interface, InterfaceConfigType
 from cnaas_nms.db.stackmember import Stackmember
+from cnaas_nms.db.session import redis_session
 from cnaas_nms.tools.event import add_event
 
 
+INVENTORY_GENERATION_KEY = 'device_inventory_generation'
+
+
 class DeviceError(Exception):
     pass
 
@@ -103,10 +107,16 @@ class Device(cnaas_nms.db.base.Base):
         back_populates="device"
     )
 
-    def as_dict(self) -> dict:
-        """Return JSON serializable dict."""
+    def as_dict(self, fields: Optional[List[str]] = None) -> dict:
+        """Return JSON serializable dict.
+
+        Args:
+            fields: Only include these columns, defaults to all columns
+        """
         d = {}
         for col in self.__table__.columns:
+            if fields is not None and col.name not in fields:
+                continue
             value = getattr(self, col.name)
             if issubclass(value.__class__, enum.Enum):
                 value = value.name
@@ -505,3 +515,48 @@ def after_update_device(mapper, connection, target: Device):
     }
     json_data = json.dumps(update_data)
     add_event(json_data=json_data, event_type="update", update_type="device")
+    mark_device_inventory_changed(object_session(target))
+
+
+@event.listens_for(Device, 'after_insert')
+@event.listens_for(Device, 'after_delete')
+def after_insert_delete_device(mapper, connection, target: Device):
+    mark_device_inventory_changed(object_session(target))
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def device_bulk_execute(orm_execute_state):
+    """Catch query(Device).update() and delete() that don't trigger mapper events"""
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and \
+            orm_execute_state.bind_mapper is Device.__mapper__:
+        mark_device_inventory_changed(orm_execute_state.session)
+
+
+@event.listens_for(Session, 'after_commit')
+def device_inventory_commit(session):
+    if session.info.pop('device_inventory_changed', False):
+        invalidate_device_inventory()
+
+
+def mark_device_inventory_changed(session):
+    """Mark session so cached device inventories are invalidated on commit"""
+    if session is not None:
+        session.info['device_inventory_changed'] = True
+
+
+def invalidate_device_inventory():
+    """Signal cached Nornir inventories in all processes to reload devices"""
+    try:
+        with redis_session() as redis:
+            redis.incr(INVENTORY_GENERATION_KEY)
+    except Exception as e:
+        print("Error in invalidate_device_inventory: {}".format(e))
+
+
+def get_device_inventory_generation() -> Optional[int]:
+    """Return current device inventory generation, or None if unavailable"""
+    try:
+        with redis_session() as redis:
+            return int(redis.incrby(INVENTORY_GENERATION_KEY, 0))
+    except Exception:
+        return None
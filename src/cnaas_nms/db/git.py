@@ -1,27 +1,33 @@
 import enum
 import os
+import json
 import datetime
 import shutil
-from typing import Set, Tuple, Optional
+from hashlib import sha256
+from typing import Set, Tuple, Optional, Dict, List
 from urllib.parse import urldefrag
 
 from git import Repo
 from git import InvalidGitRepositoryError
 from git.exc import NoSuchPathError, GitCommandError
-import yaml
 
 from cnaas_nms.app_settings import app_settings
+from cnaas_nms.confpush.nornir_helper import clear_jinja_cache
+from cnaas_nms.confpush.template_graph import get_template_graph
 from cnaas_nms.db.exceptions import ConfigException, RepoStructureException
 from cnaas_nms.tools.log import get_logger
 from cnaas_nms.db.settings import SettingsSyntaxError, DIR_STRUCTURE, \
-    VlanConflictError, rebuild_settings_cache
-from cnaas_nms.db.device import Device, DeviceType
+    VlanConflictError, rebuild_settings_cache, get_settings
+from cnaas_nms.db.device import Device, DeviceType, DeviceState, invalidate_device_inventory
 from cnaas_nms.db.session import sqla_session, redis_session
 from cnaas_nms.db.job import Job, JobStatus
 from cnaas_nms.db.joblock import Joblock, JoblockError
 
 logger = get_logger()
 
+SETTINGS_DIGEST_KEY = 'device_settings_digest'
+TEMPLATE_DIGEST_KEY = 'device_template_digest'
+
 
 class RepoType(enum.Enum):
     TEMPLATES = 0
@@ -169,6 +175,8 @@ def _refresh_repo_task(repo_type: RepoType = RepoType.TEMPLATES) -> str:
 
     ret = ''
     changed_files: Set[str] = set()
+    # Set to False if the repository was cloned and all settings must be rebuilt
+    incremental = True
     try:
         url, branch = parse_repo_url(remote_repo_path)
         local_repo = Repo(local_repo_path)
@@ -187,6 +195,7 @@ def _refresh_repo_task(repo_type: RepoType = RepoType.TEMPLATES) -> str:
         # Reset head if it's detached
         if local_repo.head.is_detached:
             reset_repo(local_repo, remote_repo_path)
+            incremental = False
         prev_commit = local_repo.commit().hexsha
         diff = local_repo.remotes.origin.pull()
         for item in diff:
@@ -216,6 +225,7 @@ def _refresh_repo_task(repo_type: RepoType = RepoType.TEMPLATES) -> str:
                 str(e)
             ))
 
+        incremental = False
         ret = 'Cloned new from remote. Last commit {} by {} at {}'.format(
             local_repo.head.commit.name_rev,
             local_repo.head.commit.committer,
@@ -224,7 +234,7 @@ def _refresh_repo_task(repo_type: RepoType = RepoType.TEMPLATES) -> str:
 
     if repo_type == RepoType.SETTINGS:
         try:
-            rebuild_settings_cache()
+            rebuild_settings_cache(changed_files if incremental else None)
         except SettingsSyntaxError as e:
             logger.error("Error in settings repo configuration: {}".format(e))
             if repo_chekout_working(repo_type):
@@ -240,6 +250,9 @@ def _refresh_repo_task(repo_type: RepoType = RepoType.TEMPLATES) -> str:
                 repo_save_working_commit(repo_type, local_repo.head.commit.hexsha)
             except Exception:
                 logger.error("Could not save last working commit: {}".format(e))
+        finally:
+            # Group memberships in cached inventories might have changed
+            invalidate_device_inventory()
         logger.debug("Files changed in settings repository: {}".format(changed_files))
         updated_devtypes, updated_hostnames = settings_syncstatus(updated_settings=changed_files)
         logger.debug("Devicestypes to be marked unsynced after repo refresh: {}".
@@ -247,18 +260,33 @@ def _refresh_repo_task(repo_type: RepoType = RepoType.TEMPLATES) -> str:
         logger.debug("Devices to be marked unsynced after repo refresh: {}".
                      format(', '.join(updated_hostnames)))
         with sqla_session() as session:
-            devtype: DeviceType
-            for devtype in updated_devtypes:
-                Device.set_devtype_syncstatus(session, devtype, syncstatus=False)
-            for hostname in updated_hostnames:
-                dev: Device = session.query(Device).\
-                    filter(Device.hostname == hostname).one_or_none()
-                if dev:
+            candidate_devs: List[Device] = session.query(Device).filter(
+                Device.device_type.in_(list(updated_devtypes)) |
+                Device.hostname.in_(list(updated_hostnames))
+            ).all()
+            for hostname in updated_hostnames - {dev.hostname for dev in candidate_devs}:
+                logger.warn("Settings updated for unknown device: {}".format(hostname))
+            digests: Dict[str, Optional[str]] = {}
+            for dev in candidate_devs:
+                if dev.state != DeviceState.MANAGED:
+                    digests[dev.hostname] = None
+                    continue
+                try:
+                    dev_settings, _ = get_settings(dev.hostname, dev.device_type, dev.model)
+                    digests[dev.hostname] = settings_digest(dev_settings)
+                except Exception as e:
+                    logger.debug("Could not get settings digest for {}: {}".format(
+                        dev.hostname, e))
+                    digests[dev.hostname] = None
+            changed_hostnames = update_device_digests(SETTINGS_DIGEST_KEY, digests)
+            for dev in candidate_devs:
+                if dev.hostname in changed_hostnames:
                     dev.synchronized = False
-                else:
-                    logger.warn("Settings updated for unknown device: {}".format(hostname))
+        logger.debug("Devices with changed settings marked unsynced after repo refresh: {}".
+                     format(', '.join(sorted(changed_hostnames))))
 
     if repo_type == RepoType.TEMPLATES:
+        clear_jinja_cache(keep_commit=local_repo.head.commit.hexsha)
         logger.debug("Files changed in template repository: {}".format(changed_files))
         updated_devtypes = template_syncstatus(updated_templates=changed_files)
         updated_list = ['{}:{}'.format(platform, dt.name) for dt, platform in updated_devtypes]
@@ -266,62 +294,92 @@ def _refresh_repo_task(repo_type: RepoType = RepoType.TEMPLATES) -> str:
                      format(', '.join(updated_list)))
         with sqla_session() as session:
             devtype: DeviceType
+            digests: Dict[str, Optional[str]] = {}
+            candidate_devs: List[Device] = []
             for devtype, platform in updated_devtypes:
-                Device.set_devtype_syncstatus(session, devtype, platform, syncstatus=False)
+                try:
+                    digest = template_dependency_digest(platform, devtype)
+                except Exception as e:
+                    logger.debug("Could not get template digest for {}:{}: {}".format(
+                        platform, devtype.name, e))
+                    digest = None
+                devs: List[Device] = session.query(Device).\
+                    filter(Device.device_type == devtype).\
+                    filter(Device.platform == platform).all()
+                for dev in devs:
+                    digests[dev.hostname] = digest
+                candidate_devs += devs
+            changed_hostnames = update_device_digests(TEMPLATE_DIGEST_KEY, digests)
+            for dev in candidate_devs:
+                if dev.hostname in changed_hostnames:
+                    dev.synchronized = False
+        logger.debug("Devices with changed templates marked unsynced after repo refresh: {}".
+                     format(', '.join(sorted(changed_hostnames))))
 
     return ret
 
 
-def template_syncstatus(updated_templates: set) -> Set[Tuple[DeviceType, str]]:
-    """Determine what device types have become unsynchronized because
-    of updated template files."""
-    unsynced_devtypes = set()
-    local_repo_path = app_settings.TEMPLATES_LOCAL
+def settings_digest(settings: dict) -> str:
+    """Fingerprint of the effective settings for a device."""
+    return sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
 
-    # loop through OS/platform types
-    for platform in os.listdir(local_repo_path):
-        path = os.path.join(local_repo_path, platform)
-        if not os.path.isdir(path) or platform.startswith('.'):
-            continue
 
-        mapfile = os.path.join(path, 'mapping.yml')
-        if not os.path.isfile(mapfile):
-            raise RepoStructureException(
-                "File mapping.yml not found in template repo {}".format(path))
+def template_dependency_digest(platform: str, devtype: DeviceType) -> str:
+    """Fingerprint of the content of all template files used to render
+    configuration for a device type on a platform."""
+    digest = sha256()
+    for dependency in sorted(get_template_graph().get_dependencies(platform, devtype)):
+        digest.update(dependency.encode() + b'\0')
         try:
-            with open(mapfile, 'r') as f:
-                mapping = yaml.safe_load(f)
-        except Exception as e:
-            logger.exception(
-                "Could not parse {}/mapping.yml in template repo: {}".format(path, str(e)))
-            raise RepoStructureException(
-                "Could not parse {}/mapping.yml in template repo: {}".format(path, str(e)))
-
-        devtype: DeviceType
-        for devtype in DeviceType:
-            if devtype.name in mapping:
-                update_required = False
-                try:
-                    dependencies = list([mapping[devtype.name]['entrypoint']])
-                    if 'dependencies' in mapping[devtype.name] and \
-                            isinstance(mapping[devtype.name]['dependencies'], list):
-                        dependencies.extend(mapping[devtype.name]['dependencies'])
-                except KeyError as e:
-                    logger.exception(
-                        "Could not parse mapping.yml in template repo for {}, value not found: {}".
-                        format(devtype.name, str(e)))
-                    raise RepoStructureException(
-                        "Could not parse mapping.yml in template repo for {}, value not found: {}".
-                        format(devtype.name, str(e)))
-
-                for dependency in dependencies:
-                    if os.path.join(platform, dependency) in updated_templates:
-                        update_required = True
-                if update_required:
-                    logger.info("Template for device type {} has been updated".
-                                format(devtype.name))
-                    unsynced_devtypes.add((devtype, platform))
+            with open(os.path.join(app_settings.TEMPLATES_LOCAL, dependency), 'rb') as f:
+                digest.update(sha256(f.read()).digest())
+        except FileNotFoundError:
+            digest.update(b'\0')
+    return digest.hexdigest()
+
 
+def update_device_digests(digest_key: str, digests: Dict[str, Optional[str]]) -> Set[str]:
+    """Compare device fingerprints with the ones stored at the previous
+    repository refresh, and store the new fingerprints.
+
+    Args:
+        digest_key: Redis hash used to store fingerprints
+        digests: Dict with hostname as key and fingerprint as value, or
+                 None if a fingerprint could not be calculated
+
+    Returns:
+        Set of hostnames with changed, new or unknown fingerprints
+    """
+    hostnames = list(digests.keys())
+    if not hostnames:
+        return set()
+    try:
+        with redis_session() as redis:
+            stored = redis.hmget(digest_key, hostnames)
+            changed = {hostname for hostname, stored_digest in zip(hostnames, stored)
+                       if digests[hostname] is None or stored_digest != digests[hostname]}
+            new_digests = {h: d for h, d in digests.items() if h in changed and d is not None}
+            unknown = [h for h, d in digests.items() if d is None]
+            if new_digests:
+                redis.hset(digest_key, mapping=new_digests)
+            if unknown:
+                redis.hdel(digest_key, *unknown)
+    except Exception as e:
+        logger.warning("Could not compare device fingerprints: {}".format(e))
+        return set(hostnames)
+    return changed
+
+
+def template_syncstatus(updated_templates: set) -> Set[Tuple[DeviceType, str]]:
+    """Determine what device types have become unsynchronized because
+    of updated template files.
+
+    Templates used by a device type are found by following all template
+    references from the entrypoint and dependencies listed in mapping.yml.
+    """
+    unsynced_devtypes = get_template_graph().get_affected_devtypes(updated_templates)
+    for devtype, platform in unsynced_devtypes:
+        logger.info("Template for device type {} has been updated".format(devtype.name))
     return unsynced_devtypes
 
 
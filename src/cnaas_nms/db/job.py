@@ -1,13 +1,13 @@
 import enum
 import datetime
 import json
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 from sqlalchemy import Column, Integer, Unicode, SmallInteger
 from sqlalchemy import Enum, DateTime
 from sqlalchemy import ForeignKey
 from sqlalchemy.dialects.postgresql.json import JSONB
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, object_session
 from nornir.core.task import AggregatedResult
 
 import cnaas_nms.db.base
@@ -15,6 +15,9 @@ import cnaas_nms.db.device
 from cnaas_nms.confpush.nornir_helper import nr_result_serialize, NornirJobResult
 from cnaas_nms.scheduler.jobresult import StrJobResult, DictJobResult
 from cnaas_nms.db.helper import json_dumper
+from cnaas_nms.db.config_artifact import ConfigArtifact, ArtifactNotFoundError, ARTIFACT_KEY, \
+    store_job_artifacts
+from cnaas_nms.db.config_revision import DeviceConfigRevision
 from cnaas_nms.tools.log import get_logger
 from cnaas_nms.tools.event import add_event
 
@@ -70,10 +73,16 @@ class Job(cnaas_nms.db.base.Base):
     change_score = Column(SmallInteger)  # should be in range 0-100
     start_arguments = Column(JSONB)
 
-    def as_dict(self) -> dict:
-        """Return JSON serializable dict."""
+    def as_dict(self, fields: Optional[List[str]] = None) -> dict:
+        """Return JSON serializable dict.
+
+        Args:
+            fields: Only include these columns, defaults to all columns
+        """
         d = {}
         for col in self.__table__.columns:
+            if fields is not None and col.name not in fields:
+                continue
             value = getattr(self, col.name)
             if issubclass(value.__class__, enum.Enum):
                 value = value.name
@@ -108,7 +117,19 @@ class Job(cnaas_nms.db.base.Base):
     def finish_success(self, res: dict, next_job_id: Optional[int]):
         try:
             if isinstance(res, NornirJobResult) and isinstance(res.nrresult, AggregatedResult):
-                self.result = {'devices': nr_result_serialize(res.nrresult)}
+                devices = nr_result_serialize(res.nrresult)
+                session = object_session(self)
+                if session:
+                    try:
+                        with session.begin_nested():
+                            store_job_artifacts(session, devices)
+                    except Exception as e:
+                        logger.exception("Job {} could not store config artifacts: {}".format(
+                            self.id, str(e)))
+                        devices = nr_result_serialize(res.nrresult)
+                self.result = {'devices': devices}
+                if res.timing:
+                    self.result['timing'] = res.timing
                 if res.change_score and type(res.change_score) == int:
                     self.change_score = res.change_score
             elif isinstance(res, (StrJobResult, DictJobResult)):
@@ -125,6 +146,9 @@ class Job(cnaas_nms.db.base.Base):
             self.status = JobStatus.ABORTED
         else:
             self.status = JobStatus.FINISHED
+        if self.function_name == 'sync_devices' and isinstance(self.result, dict) and \
+                isinstance(self.result.get('devices'), dict):
+            self.add_config_revisions()
         if next_job_id:
             # TODO: check if this exists in the db?
             self.next_job_id = next_job_id
@@ -140,6 +164,24 @@ class Job(cnaas_nms.db.base.Base):
         except Exception as e:
             pass
 
+    def add_config_revisions(self):
+        """Record generated config of each device in a finished syncto job
+        in the device config history."""
+        session = object_session(self)
+        if not session:
+            return
+        devices = self.result['devices']
+        Device = cnaas_nms.db.device.Device
+        try:
+            with session.begin_nested():
+                config_hashes = dict(session.query(Device.hostname, Device.confhash).
+                                     filter(Device.hostname.in_(devices.keys())).all())
+                DeviceConfigRevision.add_job_revisions(
+                    session, self.id, self.finish_time, devices, config_hashes)
+        except Exception as e:
+            logger.exception("Job {} could not record config revisions: {}".format(
+                self.id, str(e)))
+
     def finish_exception(self, e: Exception, traceback: str):
         logger.warning("Job {} finished with exception: {}".format(self.id, str(e)))
         self.finish_time = datetime.datetime.utcnow()
@@ -229,34 +271,49 @@ class Job(cnaas_nms.db.base.Base):
             Returns a result dict with keys: config, job_id and finish_time
         """
         result = {}
-        query_part = session.query(Job).filter(Job.function_name == 'sync_devices'). \
-            filter(Job.result.has_key('devices')).filter(Job.result['devices'].has_key(hostname))
+        query_part = session.query(DeviceConfigRevision).\
+            filter(DeviceConfigRevision.hostname == hostname)
 
         if job_id and type(job_id) == int:
-            query_part = query_part.filter(Job.id == job_id)
+            query_part = query_part.filter(DeviceConfigRevision.job_id == job_id)
         elif previous and type(previous) == int:
-            query_part = query_part.order_by(Job.id.desc()).offset(previous)
+            query_part = query_part.order_by(DeviceConfigRevision.job_id.desc()).offset(previous)
         elif before and type(before) == datetime.datetime:
-            query_part = query_part.filter(Job.finish_time < before).order_by(Job.id.desc())
+            query_part = query_part.filter(DeviceConfigRevision.finish_time < before).\
+                order_by(DeviceConfigRevision.finish_time.desc())
         else:
-            query_part = query_part.order_by(Job.id.desc())
+            query_part = query_part.order_by(DeviceConfigRevision.job_id.desc())
 
-        job: Job = query_part.first()
-        if not job:
+        revision: DeviceConfigRevision = query_part.first()
+        if not revision:
             raise JobNotFoundError("No matching job found")
 
-        result['job_id'] = job.id
-        result['finish_time'] = job.finish_time.isoformat(timespec='seconds')
-
-        if 'job_tasks' not in job.result['devices'][hostname] or \
-                'failed' not in job.result['devices'][hostname]:
+        result['job_id'] = revision.job_id
+        result['finish_time'] = revision.finish_time.isoformat(timespec='seconds')
+        result['failed'] = revision.failed
+
+        if revision.config_artifact:
+            try:
+                result['config'] = ConfigArtifact.resolve(
+                    session, {ARTIFACT_KEY: revision.config_artifact})
+            except ArtifactNotFoundError as e:
+                raise InvalidJobError("Invalid job data found in database: {}".format(e))
+            return result
+
+        # Revisions recorded before configs were stored as artifacts, or with
+        # short configs kept inline, only have the config in the job result
+        job: Job = session.query(Job).filter(Job.id == revision.job_id).one_or_none()
+        if not job or not isinstance(job.result, dict) or \
+                hostname not in job.result.get('devices', {}) or \
+                'job_tasks' not in job.result['devices'][hostname]:
             raise InvalidJobError("Invalid job data found in database: missing job_tasks")
 
         for task in job.result['devices'][hostname]['job_tasks']:
             if task['task_name'] == 'Generate device config':
-                result['config'] = task['result']
-
-        result['failed'] = job.result['devices'][hostname]['failed']
+                try:
+                    result['config'] = ConfigArtifact.resolve(session, task['result'])
+                except ArtifactNotFoundError as e:
+                    raise InvalidJobError("Invalid job data found in database: {}".format(e))
 
         return result
 
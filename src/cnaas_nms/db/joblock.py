@@ -1,18 +1,37 @@
 import datetime
-from typing import Optional, Dict
+import time
+from typing import Optional, Dict, List
 
 from sqlalchemy import Column, String, DateTime, Boolean, Integer, ForeignKey
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import relationship
 
 import cnaas_nms.db.base
 from cnaas_nms.db.job import Job
-from cnaas_nms.db.session import sqla_session
+from cnaas_nms.db.session import sqla_session, redis_session
+from cnaas_nms.tools.log import get_logger
+
+
+# Key for the postgres advisory lock held while checking and taking job locks
+ADVISORY_LOCK_ID = 7417
+# Name of the lock for all devices, conflicts with all device locks
+DEVICES_LOCK = 'devices'
+JOBLOCK_STATS_KEY = 'joblock_stats'
+# Seconds to wait for device locks held by other jobs
+LOCK_WAIT_TIMEOUT = 30
+LOCK_POLL_INTERVAL = 1
 
 
 class JoblockError(Exception):
     pass
 
 
+def lock_for_update(session: sqla_session):
+    """Serialize taking of job locks until the current transaction ends."""
+    session.execute(select(func.pg_advisory_xact_lock(ADVISORY_LOCK_ID)))
+
+
 class Joblock(cnaas_nms.db.base.Base):
     __tablename__ = 'joblock'
     job_id = Column(Integer, ForeignKey('job.id'), unique=True, primary_key=True)
@@ -35,13 +54,19 @@ class Joblock(cnaas_nms.db.base.Base):
 
     @classmethod
     def acquire_lock(cls, session: sqla_session, name: str, job_id: int) -> bool:
-        curlock = session.query(Joblock).filter(Joblock.name == name).one_or_none()
-        if curlock:
+        lock_for_update(session)
+        if name == DEVICES_LOCK and \
+                session.query(DeviceLock).filter(DeviceLock.job_id != job_id).first():
+            session.commit()
             return False
-        newlock = Joblock(job_id=job_id, name=name, start_time=datetime.datetime.now())
-        session.add(newlock)
+        acquired = session.execute(
+            insert(Joblock.__table__).
+            values(job_id=job_id, name=name, start_time=datetime.datetime.now(), abort=False).
+            on_conflict_do_nothing().
+            returning(Joblock.__table__.c.job_id)
+        ).scalar()
         session.commit()
-        return True
+        return acquired is not None
 
     @classmethod
     def release_lock(cls, session: sqla_session, name: Optional[str] = None,
@@ -90,5 +115,142 @@ class Joblock(cnaas_nms.db.base.Base):
     @classmethod
     def clear_locks(cls, session: sqla_session):
         """Clear/release all locks in the database."""
+        session.query(DeviceLock).delete()
         return session.query(Joblock).delete()
 
+
+class DeviceLock(cnaas_nms.db.base.Base):
+    """Lock for configuring a single device, so jobs configuring different
+    devices can run at the same time."""
+    __tablename__ = 'devicelock'
+    hostname = Column(String(64), primary_key=True)
+    job_id = Column(Integer, ForeignKey('job.id'), nullable=False, index=True)
+    start_time = Column(DateTime, default=datetime.datetime.now)
+
+    def as_dict(self) -> dict:
+        """Return JSON serializable dict."""
+        return {
+            'hostname': self.hostname,
+            'job_id': self.job_id,
+            'start_time': str(self.start_time),
+        }
+
+    @classmethod
+    def get_conflicts(cls, session: sqla_session, hostnames: List[str],
+                      job_id: int) -> Dict[str, int]:
+        """Get locks held by other jobs for the specified devices.
+
+        Returns:
+            Dict with hostname, or name of a lock for all devices, as key
+            and job_id as value
+        """
+        conflicts = dict(
+            session.query(DeviceLock.hostname, DeviceLock.job_id).
+            filter(DeviceLock.hostname.in_(hostnames)).
+            filter(DeviceLock.job_id != job_id).all()
+        )
+        devices_lock = session.query(Joblock).filter(Joblock.name == DEVICES_LOCK).one_or_none()
+        if devices_lock and devices_lock.job_id != job_id:
+            conflicts[DEVICES_LOCK] = devices_lock.job_id
+        return conflicts
+
+    @classmethod
+    def acquire_locks(cls, session: sqla_session, hostnames: List[str], job_id: int) -> bool:
+        """Lock all of the specified devices for a job, or none of them if
+        any device is already locked by another job."""
+        lock_for_update(session)
+        if cls.get_conflicts(session, hostnames, job_id):
+            session.commit()
+            return False
+        if hostnames:
+            now = datetime.datetime.now()
+            session.execute(
+                insert(DeviceLock.__table__).
+                values([{'hostname': x, 'job_id': job_id, 'start_time': now}
+                        for x in sorted(set(hostnames))]).
+                on_conflict_do_nothing()
+            )
+        session.commit()
+        return True
+
+    @classmethod
+    def release_locks(cls, session: sqla_session, job_id: int) -> int:
+        """Release all device locks held by a job.
+
+        Returns:
+            Number of released device locks
+        """
+        count = session.query(DeviceLock).filter(DeviceLock.job_id == job_id).delete()
+        session.commit()
+        return count
+
+
+def record_lock_wait(wait_time: float, acquired: bool):
+    """Update lock wait stats in redis, shared by all scheduler processes.
+
+    Args:
+        wait_time: Seconds spent waiting for locks held by other jobs,
+                   0 if the locks were free on the first attempt
+        acquired: True if the locks were acquired
+    """
+    logger = get_logger()
+    try:
+        with redis_session() as redis:
+            pipe = redis.pipeline()
+            pipe.hincrby(JOBLOCK_STATS_KEY, 'acquired' if acquired else 'failed', 1)
+            if wait_time > 0:
+                pipe.hincrby(JOBLOCK_STATS_KEY, 'waited', 1)
+                pipe.hincrbyfloat(JOBLOCK_STATS_KEY, 'wait_time_total', wait_time)
+                pipe.hset(JOBLOCK_STATS_KEY, 'wait_time_last', round(wait_time, 3))
+            pipe.hget(JOBLOCK_STATS_KEY, 'wait_time_max')
+            wait_time_max = pipe.execute()[-1]
+            if wait_time > float(wait_time_max or 0):
+                redis.hset(JOBLOCK_STATS_KEY, 'wait_time_max', round(wait_time, 3))
+    except Exception as e:
+        logger.debug("Could not record job lock stats: {}".format(e))
+
+
+def get_lock_stats() -> dict:
+    """Get lock wait stats recorded by all scheduler processes."""
+    with redis_session() as redis:
+        stats = redis.hgetall(JOBLOCK_STATS_KEY)
+    acquired = int(stats.get('acquired', 0))
+    waited = int(stats.get('waited', 0))
+    wait_time_total = float(stats.get('wait_time_total', 0))
+    return {
+        'acquired': acquired,
+        'failed': int(stats.get('failed', 0)),
+        'waited': waited,
+        'wait_time_avg': round(wait_time_total / waited, 3) if waited else 0.0,
+        'wait_time_max': float(stats.get('wait_time_max', 0)),
+        'wait_time_last': float(stats.get('wait_time_last', 0)),
+    }
+
+
+def acquire_device_locks(hostnames: List[str], job_id: int,
+                         timeout: float = LOCK_WAIT_TIMEOUT):
+    """Lock devices for a job, waiting up to timeout seconds for other jobs
+    configuring any of the same devices to finish.
+
+    Raises:
+        JoblockError
+    """
+    logger = get_logger()
+    start = time.monotonic()
+    wait_time = 0.0
+    while True:
+        with sqla_session() as session:
+            if DeviceLock.acquire_locks(session, hostnames, job_id):
+                record_lock_wait(wait_time, True)
+                return
+            conflicts = DeviceLock.get_conflicts(session, hostnames, job_id)
+        if wait_time + LOCK_POLL_INTERVAL > timeout:
+            break
+        logger.debug("Job {} waiting for device locks held by jobs: {}".format(
+            job_id, conflicts))
+        time.sleep(LOCK_POLL_INTERVAL)
+        wait_time = time.monotonic() - start
+    record_lock_wait(wait_time, False)
+    raise JoblockError("Unable to acquire lock for configuring devices, locked by: {}".format(
+        ", ".join(["{} (job {})".format(k, v) for k, v in conflicts.items()])))
+
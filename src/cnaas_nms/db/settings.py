@@ -1,13 +1,20 @@
 import os
 import re
+import json
+import hashlib
+import threading
 import pkg_resources
 import importlib
-from typing import List, Optional, Union, Tuple, Set, Dict
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
+from bisect import bisect_left
+from typing import List, Optional, Union, Tuple, Set, Dict, Pattern, Iterable
 
 import yaml
+from git import Repo
+from git.exc import InvalidGitRepositoryError, NoSuchPathError
 from pydantic.error_wrappers import ValidationError
 from redis import StrictRedis
-from redis_lru import RedisLRU
 
 from cnaas_nms.app_settings import app_settings, api_settings
 from cnaas_nms.db.settings_fields import f_groups
@@ -15,6 +22,8 @@ from cnaas_nms.tools.mergedict import merge_dict_origin
 from cnaas_nms.db.device import Device, DeviceType, DeviceState
 from cnaas_nms.db.session import sqla_session, redis_session
 from cnaas_nms.db.mgmtdomain import Mgmtdomain
+from cnaas_nms.db.settings_cache import SettingsCache
+from cnaas_nms.db.vlan_index import VlanIndex, load_vlan_index, save_vlan_index
 from cnaas_nms.tools.log import get_logger
 
 
@@ -44,7 +53,7 @@ redis_client = StrictRedis(
     host=app_settings.REDIS_HOSTNAME, port=app_settings.REDIS_PORT,
     retry_on_timeout=True, socket_keepalive=True
 )
-redis_lru_cache = RedisLRU(redis_client)
+settings_cache = SettingsCache(redis_client, lambda: get_settings_commit())
 
 
 class VerifyPathException(Exception):
@@ -99,8 +108,29 @@ DIR_STRUCTURE = {
     }
 }
 
+ACCESS_VXLANS_KEY = 'access_vxlans'
+DIST_VXLAN_ROLLUP_KEY = 'dist_vxlan_rollup'
 MODEL_IF_REGEX = re.compile(r'^interfaces_(.*)\.yml$')
 
+SettingsLayer = namedtuple('SettingsLayer', ['filename', 'digest', 'data'])
+
+# Parsed settings files keyed by sha256 of the file content, and a mapping
+# from filename to (stat signature, digest) so unchanged files are not reread.
+# Both are reset whenever the settings repository moves to a new commit.
+_settings_layers: Dict[str, object] = {}
+_settings_layer_files: Dict[str, Tuple[Tuple[int, int], str]] = {}
+_settings_layers_commit: Optional[str] = None
+_settings_verified_commit: Optional[str] = None
+_settings_layers_lock = threading.Lock()
+# Selector indexes for settings layers filtered per device, keyed by digest,
+# and (digest, origin) of layers that have already passed syntax check
+_settings_selector_indexes: Dict[str, 'SelectorIndex'] = {}
+_settings_syntax_checked: Set[Tuple[str, str]] = set()
+# Validated top level settings values, keyed by setting name and id of the
+# value object in a settings layer
+_settings_fragments: OrderedDict = OrderedDict()
+SETTINGS_FRAGMENT_CACHE_SIZE = 4096
+
 
 def get_model_specific_configfiles(only_modelname: bool = False) -> dict:
     """Return all model specific configuration file names.
@@ -251,80 +281,163 @@ def get_pydantic_field_descr(schema: dict, loc: tuple):
         return None
 
 
+def format_validation_error(validation_error: ValidationError, settings_dict: dict,
+                            settings_metadata_dict: dict) -> str:
+    """Format a somewhat helpful error message from a pydantic ValidationError
+    for settings_dict, including the origin of each bad value."""
+    logger = get_logger()
+    msg = ''
+    for num, error in enumerate(validation_error.errors()):
+        # If there are two errors and the last one is of type none allowed
+        # then skip recording the second error because it's an implication
+        # of the first error (the value has to be correct or none)
+        # TODO: handle multiple occurrences of this?
+        if len(validation_error.errors()) == 2 and num == 1 and error['type'] == 'type_error.none.allowed':
+            continue
+        # TODO: Find a way to present customised error message when string
+        # regex match fails instead of just showing the regex pattern.
+        loc = error['loc']
+        origin = 'unknown'
+        if loc[0] in settings_metadata_dict:
+            origin = settings_metadata_dict[loc[0]]
+        error_msg = "Validation error for setting {}, bad value: {} (value origin: {})\n".format(
+            '->'.join(str(x) for x in loc),
+            get_pydantic_error_value(settings_dict, loc),
+            origin
+        )
+        try:
+            pydantic_descr = get_pydantic_field_descr(f_root.schema(), loc)
+            if pydantic_descr:
+                pydantic_descr_msg = ", field should be: {}".format(pydantic_descr)
+            else:
+                pydantic_descr_msg = ""
+        except Exception as descr_error:
+            logger.debug(descr_error)
+            pydantic_descr_msg = ""
+        error_msg += "Message: {}{}\n".format(error['msg'], pydantic_descr_msg)
+        msg += error_msg
+    return msg
+
+
+def fragment_validation_supported() -> bool:
+    """Top level settings can only be validated one by one if the settings
+    model has no root validators or required fields."""
+    return not f_root.__pre_root_validators__ and not f_root.__post_root_validators__ and \
+        not any(field.required for field in f_root.__fields__.values())
+
+
+def validate_settings_fragment(key: str, value) -> Tuple[object, list]:
+    """Validate the value of a single top level setting.
+
+    Returned values are cached for as long as the value object is cached
+    in a settings layer, so each layer is only validated once.
+
+    Returns:
+        Tuple with (value as it would be returned by f_root.dict(), list of errors)
+    """
+    cache_key = (key, id(value))
+    with _settings_layers_lock:
+        cached = _settings_fragments.get(cache_key)
+        if cached and cached[0] is value:
+            _settings_fragments.move_to_end(cache_key)
+            return cached[1], []
+    field = f_root.__fields__[key]
+    validated, errors = field.validate(value, {}, loc=field.alias, cls=f_root)
+    if errors:
+        return None, errors if isinstance(errors, list) else [errors]
+    fragment = f_root.construct(**{key: validated}).dict(include={key})[key]
+    with _settings_layers_lock:
+        _settings_fragments[cache_key] = (value, fragment)
+        while len(_settings_fragments) > SETTINGS_FRAGMENT_CACHE_SIZE:
+            _settings_fragments.popitem(last=False)
+    return fragment, []
+
+
 def check_settings_syntax(settings_dict: dict, settings_metadata_dict: dict) -> dict:
     """Verify settings syntax and return a somewhat helpful error message.
 
+    Each top level setting is validated separately, and validated values
+    are reused for settings that come from the same settings layer.
+
     Raises:
         SettingsSyntaxError
     """
-    logger = get_logger()
-    try:
-        ret_dict = f_root(**settings_dict).dict()
-    except ValidationError as validation_error:
-        msg = ''
-        for num, error in enumerate(validation_error.errors()):
-            # If there are two errors and the last one is of type none allowed
-            # then skip recording the second error because it's an implication
-            # of the first error (the value has to be correct or none)
-            # TODO: handle multiple occurrences of this?
-            if len(validation_error.errors()) == 2 and num == 1 and error['type'] == 'type_error.none.allowed':
-                continue
-            # TODO: Find a way to present customised error message when string
-            # regex match fails instead of just showing the regex pattern.
-            loc = error['loc']
-            origin = 'unknown'
-            if loc[0] in settings_metadata_dict:
-                origin = settings_metadata_dict[loc[0]]
-            error_msg = "Validation error for setting {}, bad value: {} (value origin: {})\n".format(
-                '->'.join(str(x) for x in loc),
-                get_pydantic_error_value(settings_dict, loc),
-                origin
-            )
-            try:
-                pydantic_descr = get_pydantic_field_descr(f_root.schema(), loc)
-                if pydantic_descr:
-                    pydantic_descr_msg = ", field should be: {}".format(pydantic_descr)
-                else:
-                    pydantic_descr_msg = ""
-            except Exception as descr_error:
-                logger.debug(descr_error)
-                pydantic_descr_msg = ""
-            error_msg += "Message: {}{}\n".format(error['msg'], pydantic_descr_msg)
-            msg += error_msg
-        raise SettingsSyntaxError(msg)
-    else:
-        return ret_dict
+    if not fragment_validation_supported():
+        try:
+            return f_root(**settings_dict).dict()
+        except ValidationError as validation_error:
+            raise SettingsSyntaxError(format_validation_error(
+                validation_error, settings_dict, settings_metadata_dict))
+
+    ret_dict = f_root.construct().dict()
+    errors = []
+    for key in f_root.__fields__.keys():
+        if key not in settings_dict:
+            continue
+        fragment, fragment_errors = validate_settings_fragment(key, settings_dict[key])
+        if fragment_errors:
+            errors += fragment_errors
+        else:
+            ret_dict[key] = fragment
+    if errors:
+        raise SettingsSyntaxError(format_validation_error(
+            ValidationError(errors, f_root), settings_dict, settings_metadata_dict))
+    return ret_dict
 
 
-def check_settings_collisions(unique_vlans: bool = True):
+def check_settings_collisions(unique_vlans: bool = True,
+                              hostnames: Optional[List[str]] = None):
     """Check settings for any duplicates/collisions.
     This will call get_settings on all devices so make sure to not call this
     from get_settings.
 
+    VLAN allocations are kept in a persisted VlanIndex, so only devices
+    whose settings changed since the last check are reindexed.
+
     Args:
         unique_vlans: If enabled VLANs has to be globally unique
+        hostnames: Only check settings for these devices, defaults to all
+                   managed devices
 
-    Returns:
-
+    Raises:
+        VlanConflictError: Listing all VLAN/VNI conflicts found
     """
+    logger = get_logger()
+    conflicts: List[str] = []
     mgmt_vlans: Set[int] = set()
-    devices_dict: dict[str, dict] = {}
+    index = load_vlan_index()
+    if index is None:
+        logger.debug("No VLAN index found, indexing all managed devices")
+        index = VlanIndex()
+        hostnames = None
     with sqla_session() as session:
         mgmtdoms = session.query(Mgmtdomain).all()
         for mgmtdom in mgmtdoms:
             if mgmtdom.vlan and isinstance(mgmtdom.vlan, int):
                 if unique_vlans and mgmtdom.vlan in mgmt_vlans:
-                    raise VlanConflictError(
+                    conflicts.append(
                         "Management VLAN {} used in multiple management domains".format(
                             mgmtdom.vlan
                         ))
                 mgmt_vlans.add(mgmtdom.vlan)
-        managed_devices: List[Device] = \
-            session.query(Device).filter(Device.state == DeviceState.MANAGED).all()
+        managed_query = session.query(Device).filter(Device.state == DeviceState.MANAGED)
+        if hostnames is not None:
+            managed_query = managed_query.filter(Device.hostname.in_(hostnames))
+        managed_devices: List[Device] = managed_query.all()
+        managed_hostnames: Set[str] = set()
         for dev in managed_devices:
             dev_settings, _ = get_settings(dev.hostname, dev.device_type)
-            devices_dict[dev.hostname] = dev_settings
-    check_vlan_collisions(devices_dict, mgmt_vlans, unique_vlans)
+            index.update_device(dev.hostname, dev_settings, dev.device_type == DeviceType.ACCESS)
+            managed_hostnames.add(dev.hostname)
+    checked_hostnames = index.devices.keys() if hostnames is None else hostnames
+    for hostname in set(checked_hostnames) - managed_hostnames:
+        index.remove_device(hostname)
+    logger.debug("Reindexed VLANs for {} devices, {} devices in VLAN index".format(
+        len(index.changed), len(index.devices)))
+    save_vlan_index(index)
+    conflicts += index.get_conflicts(mgmt_vlans, unique_vlans)
+    if conflicts:
+        raise VlanConflictError("; ".join(conflicts))
     check_group_priority_collisions()
 
 
@@ -342,74 +455,32 @@ def get_internal_vlan_range(settings) -> range:
 
 
 def check_vlan_collisions(devices_dict: Dict[str, dict], mgmt_vlans: Set[int],
-                          unique_vlans: bool = True):
-    logger = get_logger()
-    # save global VLAN IDs and their unique vxlan name
-    global_vlans: dict[int, str] = dict.fromkeys(mgmt_vlans, 'management')
-    global_vnis: dict[int, str] = {}
-    device_vlan_ids: dict[str, Set[int]] = {}  # save used VLAN IDs per device
-    device_vlan_names: dict[str, Set[str]] = {}  # save used VLAN names per device
-    access_hostnames: List[str] = []
-    with sqla_session() as session:
-        access_devs = session.query(Device).filter(Device.device_type == DeviceType.ACCESS).all()
-        for dev in access_devs:
-            access_hostnames.append(dev.hostname)
+                          unique_vlans: bool = True,
+                          access_hostnames: Optional[Set[str]] = None):
+    """Check VLAN and VNI allocations in settings for a set of devices.
+
+    Args:
+        devices_dict: Settings dict per hostname
+        mgmt_vlans: VLAN ids used by management domains
+        unique_vlans: If enabled VLANs has to be globally unique
+        access_hostnames: Hostnames of access switches, defaults to all
+                          access switches in the database
 
+    Raises:
+        VlanConflictError: Listing all VLAN/VNI conflicts found
+    """
+    if access_hostnames is None:
+        with sqla_session() as session:
+            access_hostnames = {
+                dev.hostname for dev in
+                session.query(Device).filter(Device.device_type == DeviceType.ACCESS).all()
+            }
+    index = VlanIndex()
     for hostname, settings in devices_dict.items():
-        if 'vxlans' not in settings:
-            continue
-        for vxlan_name, vxlan_data in settings['vxlans'].items():
-            # VXLAN VNI checks
-            if 'vni' not in vxlan_data or not isinstance(vxlan_data['vni'], int):
-                logger.error("VXLAN {} is missing vni".format(vxlan_name))
-                continue
-            if vxlan_data['vni'] in global_vnis and \
-                    global_vnis[vxlan_data['vni']] != vxlan_name:
-                raise VlanConflictError(
-                    "VXLAN VNI {} used in VXLAN {} is already used elsewhere".format(
-                        vxlan_data['vni'], vxlan_name
-                    ))
-            elif vxlan_data['vni'] not in global_vnis:
-                global_vnis[vxlan_data['vni']] = vxlan_name
-            # VLAN id checks
-            if 'vlan_id' not in vxlan_data or not isinstance(vxlan_data['vlan_id'], int):
-                logger.error("VXLAN {} is missing vlan_id".format(vxlan_name))
-                continue
-            if unique_vlans and vxlan_data['vlan_id'] in global_vlans and \
-                    global_vlans[vxlan_data['vlan_id']] != vxlan_name:
-                raise VlanConflictError(
-                    "VLAN id {} used in VXLAN {} is already used elsewhere".format(
-                        vxlan_data['vlan_id'], vxlan_name
-                    ))
-            elif hostname in device_vlan_ids and \
-                    vxlan_data['vlan_id'] in device_vlan_ids[hostname]:
-                raise VlanConflictError("VLAN id {} used multiple times in device {}".format(
-                    vxlan_data['vlan_id'], hostname
-                ))
-            elif hostname in device_vlan_ids:
-                device_vlan_ids[hostname].add(vxlan_data['vlan_id'])
-            else:
-                device_vlan_ids[hostname] = {vxlan_data['vlan_id']}
-            if vxlan_data['vlan_id'] in get_internal_vlan_range(settings):
-                raise VlanConflictError(
-                    "VLAN id {} is overlapping with internal VLAN range".format(
-                        vxlan_data['vlan_id'])
-                )
-            global_vlans[vxlan_data['vlan_id']] = vxlan_name
-            # VLAN name checks
-            if 'vlan_name' not in vxlan_data or not isinstance(vxlan_data['vlan_name'], str):
-                logger.error("VXLAN {} is missing vlan_name".format(vxlan_name))
-                continue
-            if hostname in device_vlan_names and \
-                    vxlan_data['vlan_name'] in device_vlan_names[hostname] and \
-                    hostname in access_hostnames:  # only trigger for access switches
-                raise VlanConflictError("VLAN name {} used multiple times in device {}".format(
-                    vxlan_data['vlan_name'], hostname
-                ))
-            elif hostname in device_vlan_names:
-                device_vlan_names[hostname].add(vxlan_data['vlan_name'])
-            else:
-                device_vlan_names[hostname] = {vxlan_data['vlan_name']}
+        index.update_device(hostname, settings, hostname in access_hostnames)
+    conflicts = index.get_conflicts(mgmt_vlans, unique_vlans)
+    if conflicts:
+        raise VlanConflictError("; ".join(conflicts))
 
 
 def check_group_priority_collisions(settings: Optional[dict] = None):
@@ -436,10 +507,102 @@ def check_group_priority_collisions(settings: Optional[dict] = None):
         priorities[group['group']['group_priority']] = group['group']['name']
 
 
-@redis_lru_cache
-def read_settings_file(filename):
-    with open(filename, 'r') as f:
-        return yaml.safe_load(f)
+def get_settings_commit() -> Optional[str]:
+    """Return the commit hexsha currently checked out in the local settings
+    repository, or None if it's not a git repository."""
+    try:
+        return Repo(app_settings.SETTINGS_LOCAL).head.commit.hexsha
+    except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+        return None
+
+
+def sync_settings_layer_cache(commit: Optional[str] = None) -> Optional[str]:
+    """Drop compiled settings layers if the settings repository has moved
+    to another commit since they were parsed.
+
+    Args:
+        commit: Settings repository commit read after a refresh, defaults
+                to the commit of the current settings cache generation
+
+    Returns:
+        Current settings repository commit
+    """
+    global _settings_layers_commit, _settings_verified_commit
+    if commit is None:
+        commit = settings_cache.get_commit()
+        # Settings repository is not a git repository
+        if commit == 'None':
+            commit = None
+    with _settings_layers_lock:
+        if commit != _settings_layers_commit:
+            _settings_layers.clear()
+            _settings_layer_files.clear()
+            _settings_selector_indexes.clear()
+            _settings_syntax_checked.clear()
+            _settings_fragments.clear()
+            _settings_layers_commit = commit
+            _settings_verified_commit = None
+    return commit
+
+
+def clear_settings_layer_cache():
+    """Drop all compiled settings layers in this process."""
+    global _settings_layers_commit, _settings_verified_commit
+    with _settings_layers_lock:
+        _settings_layers.clear()
+        _settings_layer_files.clear()
+        _settings_selector_indexes.clear()
+        _settings_syntax_checked.clear()
+        _settings_fragments.clear()
+        _settings_layers_commit = None
+        _settings_verified_commit = None
+
+
+def get_settings_layer(filename: str) -> SettingsLayer:
+    """Return the parsed content of a settings file. Files are only read
+    again if their size or modification time has changed, and only parsed
+    again if their content hash has changed."""
+    stat = os.stat(filename)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _settings_layers_lock:
+        cached = _settings_layer_files.get(filename)
+        if cached and cached[0] == signature and cached[1] in _settings_layers:
+            return SettingsLayer(filename, cached[1], _settings_layers[cached[1]])
+
+    with open(filename, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    with _settings_layers_lock:
+        data = _settings_layers.get(digest)
+    if data is None:
+        data = yaml.safe_load(content)
+    with _settings_layers_lock:
+        # Keep the first parsed copy if another thread parsed it meanwhile
+        data = _settings_layers.setdefault(digest, data)
+        _settings_layer_files[filename] = (signature, digest)
+    return SettingsLayer(filename, digest, data)
+
+
+@lru_cache(maxsize=2)
+def get_default_settings(filename: str = 'default_settings.yml') -> dict:
+    """Return CNaaS-NMS default settings shipped with the package."""
+    data_dir = pkg_resources.resource_filename(__name__, 'data')
+    with open(os.path.join(data_dir, filename), 'r') as f_default_settings:
+        return yaml.safe_load(f_default_settings)
+
+
+def verify_settings_repo(local_repo_path: str, commit: Optional[str]):
+    """Verify the directory structure of the settings repository once
+    per commit.
+
+    Raises:
+        VerifyPathException
+    """
+    global _settings_verified_commit
+    if commit is not None and commit == _settings_verified_commit:
+        return
+    verify_dir_structure(local_repo_path, DIR_STRUCTURE)
+    _settings_verified_commit = commit
 
 
 def read_settings(local_repo_path: str, path: List[str], origin: str,
@@ -461,7 +624,8 @@ def read_settings(local_repo_path: str, path: List[str], origin: str,
     """
     logger = get_logger()
     filename = get_setting_filename(local_repo_path, path)
-    yamldata = read_settings_file(filename)
+    layer = get_settings_layer(filename)
+    yamldata = layer.data
     if not yamldata:
         return merged_settings, merged_settings_origin
     elif not isinstance(yamldata, dict):
@@ -469,9 +633,12 @@ def read_settings(local_repo_path: str, path: List[str], origin: str,
         return merged_settings, merged_settings_origin
     settings: dict = yamldata
     if groups or hostname:
-        syntax_dict, syntax_dict_origin = merge_dict_origin({}, settings, {}, origin)
-        check_settings_syntax(syntax_dict, syntax_dict_origin)
-        settings = filter_yamldata(settings, groups, hostname)
+        # Syntax only has to be verified once per file content
+        if (layer.digest, origin) not in _settings_syntax_checked:
+            syntax_dict, syntax_dict_origin = merge_dict_origin({}, settings, {}, origin)
+            check_settings_syntax(syntax_dict, syntax_dict_origin)
+            _settings_syntax_checked.add((layer.digest, origin))
+        settings = get_selector_index(layer).filter(groups, hostname)
     return merge_dict_origin(merged_settings, settings, merged_settings_origin, origin)
 
 
@@ -540,6 +707,259 @@ def filter_yamldata(data: Union[List, dict], groups: List[str], hostname: str, r
         return data
 
 
+class SelectorIndex(object):
+    """Compiled form of a settings layer that is filtered by groups and
+    devices selectors, giving the same result as filter_yamldata.
+
+    The layer is walked once to find all dicts with a groups or devices
+    selector, and an inverted index from group name and hostname to these
+    selectors is built. Subtrees without selectors are normalized once and
+    reused as is. Filtering for a device is then a set union over the index
+    followed by a walk of only the parts of the layer that contain
+    selectors, and results are shared by all devices matching the same
+    selectors. Returned data must not be modified.
+    """
+    def __init__(self, data: Union[List, dict], recdepth: int = 100):
+        self.by_group: Dict[str, Set[int]] = {}
+        self.by_hostname: Dict[str, Set[int]] = {}
+        self.selector_count = 0
+        self._results: Dict[frozenset, Union[List, dict]] = {}
+        self._lock = threading.Lock()
+        self._static, self._root = self._compile(data, recdepth)
+
+    def _compile(self, data, recdepth) -> Tuple[bool, object]:
+        """Returns (True, filtered data) for subtrees without selectors and
+        (False, compiled node) for subtrees with selectors."""
+        if recdepth < 1:
+            return True, data
+        elif isinstance(data, list):
+            items = []
+            static = True
+            for item in data:
+                item_static, item_value = self._compile(item, recdepth - 1)
+                if item_static and not item_value:
+                    continue
+                static = static and item_static
+                items.append((item_static, item_value))
+            if static:
+                return True, [value for _, value in items]
+            return False, ('list', None, items)
+        elif isinstance(data, dict):
+            items = []
+            static = True
+            selector_id = None
+            for k, v in data.items():
+                if not v:
+                    items.append((k, True, v))
+                    continue
+                if k == 'groups' or k == 'devices':
+                    if not isinstance(v, list):  # Should already be checked by pydantic now
+                        raise SettingsSyntaxError(
+                            "{} field must be a list or empty (currently {}) in: {}".
+                            format(k.capitalize(), type(v).__name__, data))
+                    if selector_id is None:
+                        selector_id = self.selector_count
+                        self.selector_count += 1
+                    index = self.by_group if k == 'groups' else self.by_hostname
+                    for name in v:
+                        index.setdefault(name, set()).add(selector_id)
+                    items.append((k, True, v))
+                    continue
+                value_static, value = self._compile(v, recdepth - 1)
+                if value_static and not value:
+                    continue
+                static = static and value_static
+                items.append((k, value_static, value))
+            if static and selector_id is None:
+                return True, {k: value for k, _, value in items}
+            return False, ('dict', selector_id, items)
+        else:
+            return True, data
+
+    def _filter(self, node, matched: Set[int]):
+        kind, selector_id, items = node
+        if selector_id is not None and selector_id not in matched:
+            return None
+        if kind == 'list':
+            ret_l = []
+            for static, value in items:
+                if not static:
+                    value = self._filter(value, matched)
+                if value:
+                    ret_l.append(value)
+            return ret_l
+        ret_d = {}
+        for k, static, value in items:
+            if static:
+                ret_d[k] = value
+            else:
+                ret_value = self._filter(value, matched)
+                if ret_value:
+                    ret_d[k] = ret_value
+        return ret_d
+
+    def matched_selectors(self, groups: Optional[List[str]], hostname: Optional[str]) -> Set[int]:
+        matched: Set[int] = set(self.by_hostname.get(hostname, ()))
+        for group in groups or []:
+            matched |= self.by_group.get(group, set())
+        return matched
+
+    def filter(self, groups: Optional[List[str]], hostname: Optional[str]) -> \
+            Union[List, dict]:
+        """Filter data for a device in groups with hostname."""
+        if self._static:
+            return self._root
+        key = frozenset(self.matched_selectors(groups, hostname))
+        with self._lock:
+            if key in self._results:
+                return self._results[key]
+        ret = self._filter(self._root, key)
+        with self._lock:
+            self._results[key] = ret
+        return ret
+
+
+def get_selector_index(layer: SettingsLayer) -> SelectorIndex:
+    """Get the compiled SelectorIndex for a settings layer."""
+    index = _settings_selector_indexes.get(layer.digest)
+    if index is None:
+        index = SelectorIndex(layer.data)
+        _settings_selector_indexes[layer.digest] = index
+    return index
+
+
+def vxlans_digest(vxlans: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(vxlans, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def save_access_vxlans(hostname: str, vxlans: dict) -> str:
+    """Store the VXLANs of an access device for use in the downstream VXLAN
+    rollup of its DIST switches. Stored VXLANs are only used as long as the
+    settings repository is at the same commit.
+
+    Returns:
+        Digest of the VXLANs
+    """
+    digest = vxlans_digest(vxlans)
+    with redis_session() as redis:
+        redis.hset(ACCESS_VXLANS_KEY, hostname, json.dumps({
+            'commit': settings_cache.get_commit(),
+            'digest': digest,
+            'vxlans': vxlans
+        }, default=str))
+    return digest
+
+
+def clear_access_vxlans(hostnames: Optional[Iterable[str]] = None):
+    """Remove stored access device VXLANs and DIST rollups, for the
+    specified hostnames or all devices."""
+    with redis_session() as redis:
+        if hostnames is None:
+            redis.delete(ACCESS_VXLANS_KEY, DIST_VXLAN_ROLLUP_KEY)
+        elif hostnames:
+            redis.hdel(ACCESS_VXLANS_KEY, *hostnames)
+
+
+def clear_dist_vxlan_rollups(hostnames: Iterable[str]):
+    """Remove stored downstream VXLAN rollups for DIST switches."""
+    hostnames = list(hostnames)
+    if not hostnames:
+        return
+    with redis_session() as redis:
+        redis.hdel(DIST_VXLAN_ROLLUP_KEY, *hostnames)
+
+
+def invalidate_downstream_vxlans(hostnames: Iterable[str]) -> Set[str]:
+    """Invalidate cached settings of DIST switches whose set of downstream
+    access devices might have changed, after linknets of the specified
+    devices were added or removed. Rollups of other DIST switches are kept.
+
+    Args:
+        hostnames: Devices at either end of added or removed linknets
+
+    Returns:
+        Hostnames of invalidated DIST switches
+    """
+    dist_hostnames: Set[str] = set()
+    with sqla_session() as session:
+        devs: List[Device] = session.query(Device).\
+            filter(Device.hostname.in_(list(hostnames))).all()
+        for dev in devs:
+            if dev.device_type == DeviceType.DIST:
+                dist_hostnames.add(dev.hostname)
+            elif dev.device_type == DeviceType.ACCESS:
+                for neighbor_dev in dev.get_neighbors(session):
+                    if neighbor_dev.device_type == DeviceType.DIST:
+                        dist_hostnames.add(neighbor_dev.hostname)
+    if dist_hostnames:
+        get_logger().debug("Invalidating downstream VXLANs for DIST devices: {}".format(
+            ", ".join(sorted(dist_hostnames))))
+        invalidate_settings_cache(set(), dist_hostnames)
+    return dist_hostnames
+
+
+def get_downstream_vxlans(hostname: str, ds_hostnames: List[str]) -> dict:
+    """Get the union of VXLANs used by downstream access devices of a DIST
+    switch.
+
+    The result is materialized together with the downstream hostnames and
+    the digest of each downstream device VXLANs, and reused as long as both
+    are unchanged. Only access devices without stored VXLANs, which are
+    removed when settings for the access device change, are looked up
+    using get_settings.
+
+    Args:
+        hostname: DIST hostname
+        ds_hostnames: Hostnames of downstream access devices
+
+    Returns:
+        Dict of VXLANs
+    """
+    logger = get_logger()
+    ds_hostnames = sorted(ds_hostnames)
+    with redis_session() as redis:
+        pipe = redis.pipeline(transaction=False)
+        pipe.hget(DIST_VXLAN_ROLLUP_KEY, hostname)
+        if ds_hostnames:
+            pipe.hmget(ACCESS_VXLANS_KEY, ds_hostnames)
+        res = pipe.execute()
+    stored_rollup = json.loads(res[0]) if res[0] else None
+    commit = settings_cache.get_commit()
+    ds_entries = {}
+    for ds_hostname, entry in zip(ds_hostnames, res[1] if ds_hostnames else []):
+        if entry:
+            entry = json.loads(entry)
+            # Access VXLANs from another settings commit has to be looked up again
+            if entry.get('commit') == commit:
+                ds_entries[ds_hostname] = entry
+
+    ds_digests = {h: e['digest'] for h, e in ds_entries.items()}
+    if stored_rollup and len(ds_digests) == len(ds_hostnames) and \
+            stored_rollup['downstream'] == ds_digests:
+        return stored_rollup['vxlans']
+
+    vxlans: dict = {}
+    for ds_hostname in ds_hostnames:
+        if ds_hostname in ds_entries:
+            ds_vxlans = ds_entries[ds_hostname]['vxlans']
+        else:
+            ds_settings, _ = get_settings(ds_hostname, DeviceType.ACCESS)
+            ds_vxlans = ds_settings['vxlans']
+            ds_digests[ds_hostname] = save_access_vxlans(ds_hostname, ds_vxlans)
+        for vxlan_name, vxlan_data in ds_vxlans.items():
+            if vxlan_name not in vxlans:
+                vxlans[vxlan_name] = vxlan_data
+    logger.debug("Updated downstream VXLAN rollup for {} from {} access devices".format(
+        hostname, len(ds_hostnames)))
+    with redis_session() as redis:
+        redis.hset(DIST_VXLAN_ROLLUP_KEY, hostname, json.dumps({
+            'downstream': ds_digests,
+            'vxlans': vxlans
+        }, default=str))
+    return vxlans
+
+
 def get_downstream_dependencies(hostname: str, settings: dict) -> dict:
     with sqla_session() as session:
         dev: Device = session.query(Device).filter(Device.hostname == hostname).one_or_none()
@@ -553,15 +973,16 @@ def get_downstream_dependencies(hostname: str, settings: dict) -> dict:
         for neighbor_dev in neighbor_devices:
             if neighbor_dev.device_type == DeviceType.ACCESS:
                 ds_hostnames.append(neighbor_dev.hostname)
-        for ds_hostname in ds_hostnames:
-            ds_settings, _ = get_settings(ds_hostname, DeviceType.ACCESS)
-            for vxlan_name, vxlan_data in ds_settings['vxlans'].items():
-                if vxlan_name not in settings['vxlans'].keys():
-                    settings['vxlans'][vxlan_name] = vxlan_data
+    ds_vxlans = get_downstream_vxlans(hostname, ds_hostnames)
+    # Copy before adding so cached settings layers are never modified
+    settings['vxlans'] = dict(settings['vxlans'])
+    for vxlan_name, vxlan_data in ds_vxlans.items():
+        if vxlan_name not in settings['vxlans'].keys():
+            settings['vxlans'][vxlan_name] = vxlan_data
     return settings
 
 
-@redis_lru_cache
+@settings_cache
 def get_settings(hostname: Optional[str] = None, device_type: Optional[DeviceType] = None,
                  device_model: Optional[str] = None) -> Tuple[dict, dict]:
     """Get settings to use for device matching hostname or global
@@ -569,16 +990,15 @@ def get_settings(hostname: Optional[str] = None, device_type: Optional[DeviceTyp
     logger = get_logger()
 
     local_repo_path = app_settings.SETTINGS_LOCAL
+    commit = sync_settings_layer_cache()
     try:
-        verify_dir_structure(local_repo_path, DIR_STRUCTURE)
+        verify_settings_repo(local_repo_path, commit)
     except VerifyPathException as e:
         logger.exception("Exception when verifying settings repository directory structure")
         raise e
 
     # 1. Get CNaaS-NMS default settings
-    data_dir = pkg_resources.resource_filename(__name__, 'data')
-    with open(os.path.join(data_dir, 'default_settings.yml'), 'r') as f_default_settings:
-        settings: dict = yaml.safe_load(f_default_settings)
+    settings: dict = get_default_settings()
 
     settings_origin = {}
     for k in settings.keys():
@@ -674,13 +1094,14 @@ def get_settings(hostname: Optional[str] = None, device_type: Optional[DeviceTyp
     return verified_settings, settings_origin
 
 
-@redis_lru_cache
+@settings_cache
 def get_group_settings():
     logger = get_logger()
     settings: dict = {}
     settings_origin: dict = {}
 
     local_repo_path = app_settings.SETTINGS_LOCAL
+    sync_settings_layer_cache()
     try:
         verify_dir_structure(os.path.join(local_repo_path, 'global'),
                              DIR_STRUCTURE['global'])
@@ -688,40 +1109,115 @@ def get_group_settings():
         logger.exception("Exception when verifying settings repository directory structure")
         raise e
 
-    data_dir = pkg_resources.resource_filename(__name__, 'data')
-    with open(os.path.join(data_dir, 'default_groups.yml'), 'r') as f_default_settings:
-        default_settings: dict = yaml.safe_load(f_default_settings)
+    default_settings: dict = get_default_settings('default_groups.yml')
 
     settings, settings_origin = read_settings(local_repo_path,
                                               ['global', 'groups.yml'],
                                               'global',
                                               settings,
                                               settings_origin)
-    settings['groups'] += default_settings['groups']
+    settings['groups'] = settings['groups'] + default_settings['groups']
     check_settings_syntax(settings, settings_origin)
     return f_groups(**settings).dict(), settings_origin
 
 
-@redis_lru_cache
-def get_groups(hostname: Optional[str] = None) -> List[str]:
-    """Return list of names for valid groups."""
-    groups = []
-    settings, origin = get_group_settings()
-    if not settings:
-        return groups
-    if not settings.get("groups", None):
-        return groups
-    for group in settings['groups']:
-        if 'name' not in group['group']:
-            continue
-        if hostname:
-            if 'regex' not in group['group']:
+def regex_literal_prefix(regex: str) -> str:
+    """Return the literal string that all hostnames matched by regex (using
+    re.match) must start with, or an empty string if it can't be determined."""
+    if '|' in regex:
+        return ''
+    prefix = ''
+    i = 1 if regex.startswith('^') else 0
+    while i < len(regex):
+        char = regex[i]
+        if char == '\\' and i + 1 < len(regex) and regex[i + 1] in '.-_':
+            next_char = regex[i + 1]
+            i += 2
+        elif char.isalnum() or char in '-_':
+            next_char = char
+            i += 1
+        else:
+            break
+        # A quantifier after a character makes that character optional
+        if i < len(regex) and regex[i] in '*?{':
+            break
+        prefix += next_char
+    return prefix
+
+
+class GroupMatcher:
+    """Precompiled hostname regexes for all groups defined in settings."""
+    def __init__(self, group_settings: dict):
+        self.names: List[str] = []
+        # (group name, literal hostname prefix, compiled regex) for groups with a regex
+        self.matchers: List[Tuple[str, str, Pattern]] = []
+        if not group_settings or not group_settings.get("groups", None):
+            return
+        for group in group_settings['groups']:
+            if 'name' not in group['group']:
                 continue
-            # TODO: try and catch, report what regex failed
-            if not re.match(group['group']['regex'], hostname):
+            self.names.append(group['group']['name'])
+            if 'regex' not in group['group']:
                 continue
-        groups.append(group['group']['name'])
-    return groups
+            try:
+                compiled = re.compile(group['group']['regex'])
+            except re.error as e:
+                raise SettingsSyntaxError("Invalid regex for group {}: {}".format(
+                    group['group']['name'], e))
+            self.matchers.append((group['group']['name'],
+                                  regex_literal_prefix(group['group']['regex']),
+                                  compiled))
+
+    def groups(self, hostname: str) -> List[str]:
+        """Return names of groups hostname is a member of."""
+        return [name for name, prefix, regex in self.matchers
+                if hostname.startswith(prefix) and regex.match(hostname)]
+
+    def groups_bulk(self, hostnames: Iterable[str]) -> Dict[str, List[str]]:
+        """Return a dict with {hostname: [group names]} for all hostnames.
+        Only hostnames sharing the literal prefix of a group regex are
+        tested against it."""
+        sorted_hostnames = sorted(set(hostnames))
+        ret: Dict[str, List[str]] = {hostname: [] for hostname in sorted_hostnames}
+        for name, prefix, regex in self.matchers:
+            start = bisect_left(sorted_hostnames, prefix)
+            for hostname in sorted_hostnames[start:]:
+                if not hostname.startswith(prefix):
+                    break
+                if regex.match(hostname):
+                    ret[hostname].append(name)
+        return ret
+
+
+_group_matcher: Optional[GroupMatcher] = None
+_group_matcher_key: Optional[tuple] = None
+
+
+def get_group_matcher() -> GroupMatcher:
+    """Return a GroupMatcher for the current group settings, only compiled
+    again when group definitions has changed."""
+    global _group_matcher, _group_matcher_key
+    settings, origin = get_group_settings()
+    key = tuple((group['group'].get('name'), group['group'].get('regex'))
+                for group in (settings or {}).get('groups') or [])
+    if _group_matcher is None or key != _group_matcher_key:
+        _group_matcher = GroupMatcher(settings)
+        _group_matcher_key = key
+    return _group_matcher
+
+
+@settings_cache
+def get_groups(hostname: Optional[str] = None) -> List[str]:
+    """Return list of names for valid groups."""
+    if hostname:
+        return get_group_matcher().groups(hostname)
+    return list(get_group_matcher().names)
+
+
+def get_groups_bulk(hostnames: Iterable[str]) -> Dict[str, List[str]]:
+    """Return a dict with {hostname: [group names]} for all specified
+    hostnames in one pass."""
+    return get_group_matcher().groups_bulk(hostnames)
 
 
 def get_group_regex(group_name: str) -> Optional[str]:
@@ -746,23 +1242,25 @@ def get_groups_priorities(hostname: Optional[str] = None,
     """Return dicts with {name: priority} for groups"""
     groups_priorities = {}
 
+    settings_arg = settings
     if not settings:
         settings, _ = get_group_settings()
     if not settings:
         return groups_priorities
     if not settings.get("groups", None):
         return groups_priorities
+    if hostname:
+        if settings_arg:
+            member_groups = GroupMatcher(settings).groups(hostname)
+        else:
+            member_groups = get_group_matcher().groups(hostname)
     for group in settings['groups']:
         if 'name' not in group['group']:
             continue
         if 'group_priority' not in group['group'] or group['group']['group_priority'] == 0:
             continue
-        if hostname:
-            if 'regex' not in group['group']:
-                continue
-            # TODO: try and catch, report what regex failed
-            if not re.match(group['group']['regex'], hostname):
-                continue
+        if hostname and group['group']['name'] not in member_groups:
+            continue
         groups_priorities[group['group']['name']] = group['group']['group_priority']
     return groups_priorities
 
@@ -788,11 +1286,10 @@ def parse_device_primary_groups() -> Dict[str, str]:
     groups_priorities_sorted = get_groups_priorities_sorted()
     device_primary_group: Dict[str, str] = {}
     with sqla_session() as session:
-        devices: List[Device] = session.query(Device).all()
-        for dev in devices:
-            groups = get_groups(dev.hostname)
-            primary_group: str = find_primary_group(groups, groups_priorities_sorted)
-            device_primary_group[dev.hostname] = primary_group
+        hostnames: List[str] = [row.hostname for row in session.query(Device.hostname)]
+    for hostname, groups in get_groups_bulk(hostnames).items():
+        primary_group: str = find_primary_group(groups, groups_priorities_sorted)
+        device_primary_group[hostname] = primary_group
     return device_primary_group
 
 
@@ -827,18 +1324,143 @@ def get_device_primary_groups(no_cache: bool = False) -> Dict[str, str]:
     return device_primary_group
 
 
-def rebuild_settings_cache() -> None:
+def get_settings_rebuild_scope(changed_files: Set[str]) -> \
+        Optional[Tuple[Set[DeviceType], Set[str]]]:
+    """Determine which cached settings are affected by a set of changed
+    files in the settings repository.
+
+    Args:
+        changed_files: File paths relative to the settings repository root
+
+    Returns:
+        None if all settings has to be rebuilt, otherwise a tuple with
+        (set of affected device types, set of affected hostnames)
+    """
+    logger = get_logger()
+    devtypes: Set[DeviceType] = set()
+    hostnames: Set[str] = set()
+    groups: Set[str] = set()
+    filename: str
+    for filename in changed_files:
+        path = filename.split(os.path.sep)
+        basedir = path[0]
+        if basedir not in DIR_STRUCTURE:
+            continue
+        if basedir == 'global':
+            return None
+        elif basedir == 'fabric':
+            devtypes.update({DeviceType.DIST, DeviceType.CORE})
+        elif basedir in ['access', 'dist', 'core']:
+            devtypes.add(DeviceType[basedir.upper()])
+        elif basedir == 'devices' and len(path) >= 2:
+            if Device.valid_hostname(path[1]):
+                hostnames.add(path[1])
+        elif basedir == 'groups' and len(path) >= 2:
+            groups.add(path[1])
+        else:
+            logger.warn("Unhandled settings file found {}, rebuilding all settings".
+                        format(filename))
+            return None
+
+    if groups:
+        for hostname, primary_group in get_device_primary_groups().items():
+            if primary_group in groups:
+                hostnames.add(hostname)
+
+    # DIST settings include VXLANs from downstream ACCESS devices
+    if DeviceType.ACCESS in devtypes:
+        devtypes.add(DeviceType.DIST)
+    elif hostnames:
+        with sqla_session() as session:
+            access_devs: List[Device] = session.query(Device).\
+                filter(Device.hostname.in_(hostnames)).\
+                filter(Device.device_type == DeviceType.ACCESS).all()
+            for dev in access_devs:
+                for neighbor_dev in dev.get_neighbors(session):
+                    if neighbor_dev.device_type == DeviceType.DIST:
+                        hostnames.add(neighbor_dev.hostname)
+    return devtypes, hostnames
+
+
+def invalidate_settings_cache(devtypes: Set[DeviceType], hostnames: Set[str],
+                              commit: Optional[str] = None) -> int:
+    """Start a new settings cache generation where cached get_settings
+    results for the specified device types and hostnames are removed, and
+    all other cached results are kept.
+
+    Returns:
+        Number of cache entries kept
+    """
+    tokens = ['{!r}'.format(devtype) for devtype in devtypes]
+    tokens += ['{!r}'.format(hostname) for hostname in hostnames]
+    key_prefix = '{}:get_settings('.format(__name__)
+
+    def keep(key: str) -> bool:
+        return not key.startswith(key_prefix) or not any(t in key for t in tokens)
+
+    if commit is None:
+        commit = get_settings_commit()
+    kept = settings_cache.new_generation(commit, keep)
+    # Stored access VXLANs used by DIST rollups
+    if DeviceType.ACCESS in devtypes:
+        clear_access_vxlans()
+    else:
+        clear_access_vxlans(hostnames)
+        clear_dist_vxlan_rollups(hostnames)
+    return kept
+
+
+def rebuild_settings_cache(changed_files: Optional[Set[str]] = None) -> None:
     """Clear cache and rebuild for devicetypes.
 
+    Args:
+        changed_files: Files changed in the settings repository since the
+                       last rebuild. If specified, only settings affected by
+                       these files are rebuilt and checked for collisions.
+
     Raises:
         SettingsSyntaxError: Syntax is wrong in settings files
         VlanConflictError: Multiple conflicting VLANs exists on same device
     """
     logger = get_logger()
-    logger.debug("Clearing redis-lru cache for settings")
-    with redis_session() as redis_db:
-        cache = RedisLRU(redis_db)
-        cache.clear_all_cache()
+    scope = None
+    if changed_files is not None:
+        scope = get_settings_rebuild_scope(changed_files)
+    if scope is not None:
+        devtypes, hostnames = scope
+        commit = sync_settings_layer_cache(get_settings_commit())
+        kept = invalidate_settings_cache(devtypes, hostnames, commit)
+        logger.debug("Incremental rebuild of settings cache for device types {} and {} "
+                     "devices, {} cache entries kept".format(
+                         ', '.join([dt.name for dt in devtypes]), len(hostnames), kept))
+        if not devtypes and not hostnames:
+            return
+        for devtype in devtypes:
+            get_settings(device_type=devtype)
+        for hostname in hostnames:
+            if os.path.isdir(os.path.join(app_settings.SETTINGS_LOCAL, 'devices', hostname)):
+                get_settings(hostname)
+        for devtype_str, device_models in get_model_specific_configfiles(True).items():
+            devtype = DeviceType[devtype_str]
+            if devtype not in devtypes:
+                continue
+            for device_model in device_models:
+                get_settings('nonexisting', devtype, device_model)
+        if devtypes:
+            # All devices of the affected types has to be checked
+            check_settings_collisions(api_settings.GLOBAL_UNIQUE_VLANS)
+        else:
+            check_settings_collisions(api_settings.GLOBAL_UNIQUE_VLANS, list(hostnames))
+        logger.debug("Settings cache stats: {}".format(settings_cache.get_stats()))
+        return
+
+    logger.debug("Starting new settings cache generation")
+    commit = sync_settings_layer_cache(get_settings_commit())
+    settings_cache.new_generation(commit)
+    # Stored access VXLANs and DIST rollups are kept as long as the settings
+    # commit is the same, unless the commit can't be determined
+    if commit is None:
+        clear_access_vxlans()
     update_device_primary_groups()
     get_settings()
     test_devtypes = [DeviceType.ACCESS, DeviceType.DIST, DeviceType.CORE]
@@ -856,3 +1478,4 @@ def rebuild_settings_cache() -> None:
         for device_model in device_models:
             get_settings('nonexisting', devtype, device_model)
     check_settings_collisions(api_settings.GLOBAL_UNIQUE_VLANS)
+    logger.debug("Settings cache stats: {}".format(settings_cache.get_stats()))
@@ -0,0 +1,216 @@
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Optional
+
+from redis import StrictRedis
+
+from cnaas_nms.tools.log import get_logger
+
+
+class SettingsCache(object):
+    """Two-tier cache for functions building settings.
+
+    Results are cached in a bounded in-process LRU in front of a shared
+    redis cache. Values in redis are pickled and zlib compressed.
+
+    All keys are namespaced by the settings repository commit and a
+    generation number that is increased in redis every time the settings
+    cache is rebuilt, so old entries are never read again and just expire
+    in redis. The commit and generation are stored in redis when a new
+    generation is started and checked at most every generation_interval
+    seconds, and the in-process tier is dropped when the namespace changes.
+    commit_func is only used to find the commit if no generation has been
+    started yet.
+
+    Cached values are shared between callers in the same process and must
+    not be modified.
+    """
+    def __init__(self, client: StrictRedis, commit_func: Callable[[], Optional[str]],
+                 max_entries: int = 1024, ttl: int = 15 * 60,
+                 key_prefix: str = 'SettingsCache', generation_interval: float = 1.0,
+                 compress_level: int = 1):
+        self.client = client
+        self.commit_func = commit_func
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.generation_interval = generation_interval
+        self.compress_level = compress_level
+        self._lock = threading.Lock()
+        self._local: OrderedDict = OrderedDict()
+        self._local_namespace: Optional[str] = None
+        self._generation: Optional[int] = None
+        self._commit: Optional[str] = None
+        self._generation_checked = 0.0
+        self.stats = {
+            'local_hits': 0, 'redis_hits': 0, 'misses': 0,
+            'evictions': 0, 'invalidations': 0
+        }
+
+    @property
+    def generation_key(self) -> str:
+        return '{}:generation'.format(self.key_prefix)
+
+    @property
+    def commit_key(self) -> str:
+        return '{}:commit'.format(self.key_prefix)
+
+    def _refresh(self):
+        """Read current commit and generation from redis if they have not
+        been checked in the last generation_interval seconds."""
+        now = time.monotonic()
+        if self._generation is not None and \
+                now - self._generation_checked <= self.generation_interval:
+            return
+        generation = self.client.get(self.generation_key)
+        commit = self.client.get(self.commit_key)
+        if isinstance(commit, bytes):
+            commit = commit.decode()
+        if commit is None:
+            # No generation started yet, repository is only read once
+            commit = self._commit if self._commit is not None else str(self.commit_func())
+        with self._lock:
+            self._generation = int(generation or 0)
+            self._commit = commit
+            self._generation_checked = now
+
+    def get_generation(self) -> int:
+        self._refresh()
+        return self._generation
+
+    def get_commit(self) -> str:
+        """Settings repository commit of the current cache generation."""
+        self._refresh()
+        return self._commit
+
+    def get_namespace(self, commit: Optional[str] = None, generation: Optional[int] = None) -> str:
+        if commit is None or generation is None:
+            self._refresh()
+        if commit is None:
+            commit = self._commit
+        if generation is None:
+            generation = self._generation
+        return '{}:{}:{}'.format(self.key_prefix, commit, generation)
+
+    def encode(self, value) -> bytes:
+        return zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL),
+                             self.compress_level)
+
+    @staticmethod
+    def decode(data: bytes):
+        return pickle.loads(zlib.decompress(data))
+
+    def _local_get(self, namespace: str, key: str):
+        """Must be called with lock held."""
+        if namespace != self._local_namespace:
+            if self._local:
+                self.stats['invalidations'] += len(self._local)
+            self._local.clear()
+            self._local_namespace = namespace
+            raise KeyError(key)
+        value = self._local[key]
+        self._local.move_to_end(key)
+        return value
+
+    def _local_set(self, namespace: str, key: str, value):
+        """Must be called with lock held."""
+        if namespace != self._local_namespace:
+            return
+        self._local[key] = value
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            try:
+                for arg in args:
+                    hash(arg)
+                for value in kwargs.values():
+                    hash(value)
+            except TypeError:
+                return func(*args, **kwargs)
+            namespace = self.get_namespace()
+            key = '{}:{}{!r}:{!r}'.format(func.__module__, func.__qualname__, args, kwargs)
+            with self._lock:
+                try:
+                    value = self._local_get(namespace, key)
+                    self.stats['local_hits'] += 1
+                    return value
+                except KeyError:
+                    pass
+            data = self.client.get('{}:{}'.format(namespace, key))
+            if data is not None:
+                value = self.decode(data)
+                with self._lock:
+                    self.stats['redis_hits'] += 1
+                    self._local_set(namespace, key, value)
+                return value
+            value = func(*args, **kwargs)
+            self.client.setex('{}:{}'.format(namespace, key), self.ttl, self.encode(value))
+            with self._lock:
+                self.stats['misses'] += 1
+                self._local_set(namespace, key, value)
+            return value
+        return inner
+
+    def new_generation(self, commit: Optional[str], keep: Optional[Callable[[str], bool]] = None) -> int:
+        """Start a new cache generation for a settings commit, invalidating
+        all cached entries in all processes.
+
+        Args:
+            commit: Settings repository commit
+            keep: Optional function that gets the function call part of a
+                  key as argument and returns True if the entry from the
+                  previous generation is still valid and should be copied
+                  to the new generation
+
+        Returns:
+            Number of entries copied from the previous generation
+        """
+        logger = get_logger()
+        pipe = self.client.pipeline()
+        pipe.get(self.commit_key)
+        pipe.get(self.generation_key)
+        old_commit, old_generation = pipe.execute()
+        generation = self.client.incr(self.generation_key)
+        self.client.set(self.commit_key, str(commit))
+        with self._lock:
+            self._generation = generation
+            self._commit = str(commit)
+            self._generation_checked = time.monotonic()
+        if keep is None or old_commit is None:
+            return 0
+
+        old_namespace = self.get_namespace(old_commit.decode(), int(old_generation or 0))
+        new_namespace = self.get_namespace(str(commit), generation)
+        keys = [k for k in self.client.scan_iter('{}:*'.format(old_namespace), count=1000)]
+        keys = [k for k in keys if keep(k.decode()[len(old_namespace) + 1:])]
+        copied = 0
+        for i in range(0, len(keys), 100):
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys[i:i + 100]:
+                pipe.pttl(key)
+                pipe.get(key)
+            res = pipe.execute()
+            pipe = self.client.pipeline(transaction=False)
+            for key, pttl, data in zip(keys[i:i + 100], res[0::2], res[1::2]):
+                if data is None or pttl is None or pttl <= 0:
+                    continue
+                new_key = new_namespace + key.decode()[len(old_namespace):]
+                pipe.psetex(new_key, pttl, data)
+                copied += 1
+            pipe.execute()
+        logger.debug("Copied {} settings cache entries to generation {}".format(
+            copied, generation))
+        return copied
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, 'local_entries': len(self._local)}
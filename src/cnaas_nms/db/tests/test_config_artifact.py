@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import unittest
+import zlib
+from unittest import mock
+
+from cnaas_nms.db.config_artifact import ConfigArtifact, store_job_artifacts, \
+    resolve_job_artifacts
+
+
+class ConfigArtifactTests(unittest.TestCase):
+    def setUp(self):
+        self.config = "hostname eosaccess1\n" * 100
+        self.devices = {
+            'eosaccess1': {'failed': False, 'job_tasks': [
+                {'task_name': 'Generate device config', 'result': self.config,
+                 'diff': '', 'failed': False},
+                {'task_name': 'Sync device config', 'result': None,
+                 'diff': '+interface Ethernet1', 'failed': False},
+            ]},
+            'eosaccess2': {'failed': False, 'job_tasks': [
+                {'task_name': 'Generate device config', 'result': self.config,
+                 'diff': '', 'failed': False},
+            ]},
+        }
+
+    def test_store_job_artifacts(self):
+        session = mock.MagicMock()
+        self.assertEqual(store_job_artifacts(session, self.devices), 2)
+        # Same config is only stored once
+        self.assertEqual(session.execute.call_count, 1)
+        ref = {'artifact': ConfigArtifact.get_digest(self.config)}
+        self.assertEqual(self.devices['eosaccess1']['job_tasks'][0]['result'], ref)
+        self.assertEqual(self.devices['eosaccess2']['job_tasks'][0]['result'], ref)
+        # Short diffs are kept inline
+        self.assertEqual(self.devices['eosaccess1']['job_tasks'][1]['diff'],
+                         '+interface Ethernet1')
+
+    def test_resolve_job_artifacts(self):
+        store_job_artifacts(mock.MagicMock(), self.devices)
+        artifact = ConfigArtifact(sha256=ConfigArtifact.get_digest(self.config),
+                                  data=zlib.compress(self.config.encode('utf-8')))
+        session = mock.MagicMock()
+        session.query.return_value.filter.return_value = [artifact]
+        resolve_job_artifacts(session, self.devices)
+        self.assertEqual(session.query.call_count, 1)
+        self.assertEqual(self.devices['eosaccess1']['job_tasks'][0]['result'], self.config)
+        self.assertEqual(self.devices['eosaccess2']['job_tasks'][0]['result'], self.config)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import datetime
+import unittest
+from unittest import mock
+
+from cnaas_nms.db.config_revision import DeviceConfigRevision
+
+
+class ConfigRevisionTests(unittest.TestCase):
+    def test_add_job_revisions(self):
+        session = mock.MagicMock()
+        finish_time = datetime.datetime(2021, 10, 1, 12, 0, 0)
+        devices = {
+            'eosaccess1': {'failed': False, 'job_tasks': [
+                {'task_name': 'Generate device config', 'result': {'artifact': 'a' * 64}},
+                {'task_name': 'Sync device config', 'result': None, 'diff': ''},
+            ]},
+            'eosaccess2': {'failed': True, 'job_tasks': [
+                {'task_name': 'Generate device config', 'result': 'hostname eosaccess2'},
+            ]},
+        }
+        revisions = DeviceConfigRevision.add_job_revisions(
+            session, 5, finish_time, devices, {'eosaccess1': 'b' * 64})
+        self.assertEqual(session.add.call_count, 2)
+        self.assertEqual([r.as_dict() for r in revisions], [
+            {'id': None, 'hostname': 'eosaccess1', 'job_id': 5,
+             'finish_time': '2021-10-01T12:00:00', 'failed': False,
+             'config_artifact': 'a' * 64, 'config_hash': 'b' * 64},
+            {'id': None, 'hostname': 'eosaccess2', 'job_id': 5,
+             'finish_time': '2021-10-01T12:00:00', 'failed': True,
+             'config_artifact': None, 'config_hash': None},
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,7 @@
 import unittest
 
 from cnaas_nms.db.git import template_syncstatus, repo_save_working_commit, \
-    repo_chekout_working, RepoType
+    repo_chekout_working, RepoType, template_dependency_digest, settings_digest
 from cnaas_nms.db.device import DeviceType
 from cnaas_nms.db.session import redis_session
 
@@ -24,6 +24,13 @@ class GitTests(unittest.TestCase):
             self.assertEqual(type(devtype[1]), str)
         self.assertTrue((DeviceType.ACCESS, 'eos') in devtypes)
 
+    def test_device_digests(self):
+        digest = template_dependency_digest('eos', DeviceType.ACCESS)
+        self.assertEqual(digest, template_dependency_digest('eos', DeviceType.ACCESS))
+        self.assertNotEqual(digest, template_dependency_digest('eos', DeviceType.DIST))
+        self.assertEqual(settings_digest({'a': 1, 'b': [1, 2]}),
+                         settings_digest({'b': [1, 2], 'a': 1}))
+
     def test_savecommit(self):
         self.assertFalse(
             repo_chekout_working(RepoType.SETTINGS, dry_run=True),
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+
+from cnaas_nms.db.joblock import DeviceLock, JoblockError, acquire_device_locks
+
+
+class DeviceLockTests(unittest.TestCase):
+    def test_acquire_locks(self):
+        session = mock.MagicMock()
+        with mock.patch.object(DeviceLock, 'get_conflicts', return_value={}):
+            self.assertTrue(DeviceLock.acquire_locks(session, ['eosaccess1', 'eosaccess2'], 5))
+        # Advisory lock and insert of all devices
+        self.assertEqual(session.execute.call_count, 2)
+        insert = str(session.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+        self.assertIn('INSERT INTO devicelock', insert)
+        self.assertIn('ON CONFLICT DO NOTHING', insert)
+        session.commit.assert_called_once()
+
+    def test_acquire_locks_conflict(self):
+        session = mock.MagicMock()
+        with mock.patch.object(DeviceLock, 'get_conflicts', return_value={'eosaccess1': 4}):
+            self.assertFalse(DeviceLock.acquire_locks(session, ['eosaccess1', 'eosaccess2'], 5))
+        # Only the advisory lock, no insert
+        self.assertEqual(session.execute.call_count, 1)
+
+    @mock.patch('cnaas_nms.db.joblock.record_lock_wait')
+    @mock.patch('cnaas_nms.db.joblock.sqla_session')
+    @mock.patch('cnaas_nms.db.joblock.time.sleep')
+    def test_acquire_device_locks_wait(self, sleep, sqla_session, record_lock_wait):
+        with mock.patch.object(DeviceLock, 'acquire_locks', side_effect=[False, True]), \
+                mock.patch.object(DeviceLock, 'get_conflicts', return_value={'eosaccess1': 4}):
+            acquire_device_locks(['eosaccess1'], 5, timeout=10)
+        sleep.assert_called_once()
+        self.assertTrue(record_lock_wait.call_args[0][1])
+
+        with mock.patch.object(DeviceLock, 'acquire_locks', return_value=False), \
+                mock.patch.object(DeviceLock, 'get_conflicts', return_value={'eosaccess1': 4}):
+            with self.assertRaisesRegex(JoblockError, 'eosaccess1 \\(job 4\\)'):
+                acquire_device_locks(['eosaccess1'], 5, timeout=0)
+        self.assertFalse(record_lock_wait.call_args[0][1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,18 @@
 import os
 import yaml
+import tempfile
+import json
 import unittest
 import pkg_resources
+from unittest import mock
 
 from cnaas_nms.db.settings import get_settings, verify_dir_structure, \
     DIR_STRUCTURE, VerifyPathException, \
     check_vlan_collisions, VlanConflictError, \
     get_groups_priorities_sorted, get_device_primary_groups, \
-    check_group_priority_collisions
+    check_group_priority_collisions, get_settings_layer, \
+    GroupMatcher, regex_literal_prefix, SelectorIndex, filter_yamldata, \
+    check_settings_syntax, SettingsSyntaxError, get_downstream_vxlans, vxlans_digest
 from cnaas_nms.db.device import DeviceType
 
 class SettingsTests(unittest.TestCase):
@@ -219,6 +224,112 @@ class SettingsTests(unittest.TestCase):
         del group_settings_dict['groups'][2]
         self.assertIsNone(check_group_priority_collisions(group_settings_dict))
 
+    def test_settings_layer_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, 'base_system.yml')
+            with open(filename, 'w') as f:
+                f.write("ntp_servers:\n  - host: 10.0.0.1\n")
+            layer = get_settings_layer(filename)
+            self.assertEqual(layer.data, {'ntp_servers': [{'host': '10.0.0.1'}]})
+            # Unchanged file should return the same parsed object
+            self.assertIs(get_settings_layer(filename).data, layer.data)
+            with open(filename, 'w') as f:
+                f.write("ntp_servers:\n  - host: 10.0.0.2\n")
+            os.utime(filename, ns=(0, 0))
+            new_layer = get_settings_layer(filename)
+            self.assertNotEqual(layer.digest, new_layer.digest)
+            self.assertEqual(new_layer.data['ntp_servers'][0]['host'], '10.0.0.2')
+
+    def test_regex_literal_prefix(self):
+        self.assertEqual(regex_literal_prefix('^eosaccess[0-9]+'), 'eosaccess')
+        self.assertEqual(regex_literal_prefix(r'eos-dist\.lab'), 'eos-dist.lab')
+        self.assertEqual(regex_literal_prefix('abc?'), 'ab')
+        self.assertEqual(regex_literal_prefix('(?i)abc'), '')
+        self.assertEqual(regex_literal_prefix('a|b'), '')
+        self.assertEqual(regex_literal_prefix('.*'), '')
+
+    def test_group_matcher(self):
+        group_settings_dict = {
+            "groups": [
+                {"group": {"name": "ALL", "regex": ".*"}},
+                {"group": {"name": "ACCESS", "regex": "^eosaccess"}},
+                {"group": {"name": "DIST", "regex": "eosdist[0-9]$"}},
+                {"group": {"name": "EMPTY", "regex": ""}},
+                {"group": {"name": "NOREGEX"}},
+            ]
+        }
+        matcher = GroupMatcher(group_settings_dict)
+        self.assertEqual(matcher.names, ['ALL', 'ACCESS', 'DIST', 'EMPTY', 'NOREGEX'])
+        hostnames = ['eosdist1', 'eosaccess', 'eosdist10', 'other']
+        result = matcher.groups_bulk(hostnames)
+        for hostname in hostnames:
+            self.assertEqual(result[hostname], matcher.groups(hostname))
+        self.assertEqual(result['eosaccess'], ['ALL', 'ACCESS', 'EMPTY'])
+        self.assertEqual(result['eosdist1'], ['ALL', 'DIST', 'EMPTY'])
+        self.assertEqual(result['eosdist10'], ['ALL', 'EMPTY'])
+
+    def test_selector_index(self):
+        settings_data = {
+            "ntp_servers": [{"host": "10.0.0.1"}],
+            "vxlans": {
+                "student1": {"vni": 100, "vlan_id": 100, "groups": ["STUDENT"]},
+                "staff1": {"vni": 200, "vlan_id": 200, "groups": ["STAFF", "ALL"],
+                           "devices": ["eosaccess1"]},
+                "local1": {"vni": 300, "vlan_id": 300, "devices": ["eosdist1"],
+                           "tags": [{"name": "a", "groups": ["STAFF"]}, {"name": "b"}]},
+                "empty1": {"vni": 400, "vlan_id": 400, "groups": []},
+            },
+            "extroute_static": {"vrfs": [
+                {"name": "STUDENT", "ipv4": [{"destination": "0.0.0.0/0", "groups": ["STUDENT"]}]},
+                {"name": "STAFF", "ipv4": []},
+            ]},
+        }
+        index = SelectorIndex(settings_data)
+        for groups, hostname in [([], None), (["STUDENT"], "eosdist1"),
+                                 (["STAFF"], "eosaccess1"), (["ALL"], "eosdist2"),
+                                 (["STUDENT", "STAFF"], "eosaccess1")]:
+            self.assertEqual(index.filter(groups, hostname),
+                             filter_yamldata(settings_data, groups, hostname))
+        # Devices matching the same selectors share the filtered result
+        self.assertIs(index.filter(["STUDENT"], "eosaccess5"),
+                      index.filter(["STUDENT", "OTHER"], "eosaccess6"))
+
+    def test_settings_syntax_fragments(self):
+        vxlans = {'vxlan1': {'vni': 100100, 'vrf': 'vrf1', 'vlan_id': 100,
+                             'vlan_name': 'vlanname1', 'ipv4_gw': '10.0.0.1/24'}}
+        settings_dict = {'vxlans': vxlans, 'ntp_servers': [{'host': '10.0.0.1'}]}
+        origin = {'vxlans': 'global->vxlans.yml', 'ntp_servers': 'global->base_system.yml'}
+        ret = check_settings_syntax(settings_dict, origin)
+        self.assertEqual(ret['vxlans']['vxlan1']['vlan_id'], 100)
+        self.assertEqual(ret['radius_servers'], [])
+        # Validated values are reused for the same settings layer value
+        self.assertIs(check_settings_syntax({'vxlans': vxlans}, origin)['vxlans'],
+                      ret['vxlans'])
+        settings_dict['ntp_servers'] = [{'host': 'bad host name'}]
+        with self.assertRaises(SettingsSyntaxError) as context:
+            check_settings_syntax(settings_dict, origin)
+        self.assertIn("ntp_servers->0->host", str(context.exception))
+        self.assertIn("value origin: global->base_system.yml", str(context.exception))
+
+    @mock.patch('cnaas_nms.db.settings.get_settings')
+    @mock.patch('cnaas_nms.db.settings.settings_cache')
+    @mock.patch('cnaas_nms.db.settings.redis_session')
+    def test_downstream_vxlans_commit(self, redis_session, settings_cache, get_settings_mock):
+        settings_cache.get_commit.return_value = 'b' * 40
+        vxlans1 = {'vxlan1': {'vni': 100100}}
+        vxlans2 = {'vxlan2': {'vni': 100200}}
+        redis = redis_session.return_value.__enter__.return_value
+        redis.pipeline.return_value.execute.return_value = [None, [
+            json.dumps({'commit': 'b' * 40, 'digest': vxlans_digest(vxlans1),
+                        'vxlans': vxlans1}),
+            json.dumps({'commit': 'a' * 40, 'digest': vxlans_digest({}), 'vxlans': {}}),
+        ]]
+        get_settings_mock.return_value = ({'vxlans': vxlans2}, {})
+        vxlans = get_downstream_vxlans('eosdist1', ['eosaccess1', 'eosaccess2'])
+        self.assertEqual(vxlans, {**vxlans1, **vxlans2})
+        # VXLANs stored for another settings commit are looked up again
+        get_settings_mock.assert_called_once_with('eosaccess2', DeviceType.ACCESS)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import unittest
+from unittest import mock
+
+from cnaas_nms.db.settings_cache import SettingsCache
+
+
+class SettingsCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.redis_data = {}
+        self.client = mock.MagicMock()
+        self.client.get.side_effect = self.redis_data.get
+        self.client.setex.side_effect = lambda k, ttl, v: self.redis_data.__setitem__(k, v)
+        self.commit = 'a' * 40
+        self.cache = SettingsCache(self.client, lambda: self.commit, max_entries=2,
+                                   generation_interval=0)
+        self.calls = []
+
+        @self.cache
+        def build(name):
+            self.calls.append(name)
+            return {'name': name, 'vxlans': {}}
+        self.build = build
+
+    def test_local_and_redis_tiers(self):
+        self.assertEqual(self.build('eosdist1'), {'name': 'eosdist1', 'vxlans': {}})
+        self.assertIs(self.build('eosdist1'), self.build('eosdist1'))
+        self.assertEqual(self.calls, ['eosdist1'])
+        self.build('eosdist2')
+        self.build('eosaccess1')
+        self.assertEqual(self.cache.stats['evictions'], 1)
+        # Evicted entry is read back from redis
+        self.assertEqual(self.build('eosdist1')['name'], 'eosdist1')
+        self.assertEqual(self.calls, ['eosdist1', 'eosdist2', 'eosaccess1'])
+        self.assertEqual(self.cache.stats['redis_hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 3)
+
+    def test_commit_namespace(self):
+        self.build('eosdist1')
+        # Commit is only read from the repository when not set in redis
+        self.commit = 'b' * 40
+        self.build('eosdist1')
+        self.assertEqual(self.calls, ['eosdist1'])
+        # New commit stored in redis by a rebuild in another process
+        self.redis_data[self.cache.commit_key] = b'c' * 40
+        self.build('eosdist1')
+        self.assertEqual(self.calls, ['eosdist1', 'eosdist1'])
+        self.assertTrue(all(k.startswith('SettingsCache:') for k in self.redis_data))
+        self.assertEqual(len(self.redis_data), 3)
+
+    def test_encoding(self):
+        value = {'vxlans': {'vxlan{}'.format(i): {'vni': i} for i in range(100)}}
+        data = self.cache.encode(value)
+        self.assertEqual(self.cache.decode(data), value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import unittest
+from ipaddress import IPv4Address
+
+from cnaas_nms.db.device import Device, DeviceState, DeviceType
+from cnaas_nms.db.interface import Interface, InterfaceConfigType
+from cnaas_nms.db.linknet import Linknet
+from cnaas_nms.db.mgmtdomain import Mgmtdomain
+from cnaas_nms.db.topology import TopologySnapshot
+
+
+class TopologySnapshotTests(unittest.TestCase):
+    def setUp(self):
+        def device(dev_id, hostname, devtype):
+            return Device(id=dev_id, hostname=hostname, device_type=devtype,
+                          state=DeviceState.MANAGED, platform='eos')
+        self.dist1 = device(1, 'dist1', DeviceType.DIST)
+        self.dist2 = device(2, 'dist2', DeviceType.DIST)
+        self.access1 = device(3, 'access1', DeviceType.ACCESS)
+        self.access2 = device(4, 'access2', DeviceType.ACCESS)
+        self.core1 = device(5, 'core1', DeviceType.CORE)
+        linknets = [
+            Linknet(id=1, device_a_id=1, device_a_port='Ethernet1',
+                    device_b_id=3, device_b_port='Ethernet48'),
+            Linknet(id=2, device_a_id=2, device_a_port='Ethernet1',
+                    device_b_id=4, device_b_port='Ethernet48'),
+            Linknet(id=3, device_a_id=3, device_a_port='Ethernet47',
+                    device_b_id=4, device_b_port='Ethernet47'),
+            Linknet(id=4, device_a_id=5, device_a_port='Ethernet2',
+                    device_b_id=1, device_b_port='Ethernet3',
+                    device_a_ip=IPv4Address('10.198.0.0'), device_b_ip=IPv4Address('10.198.0.1'),
+                    ipv4_network='10.198.0.0/31'),
+        ]
+        interfaces = [
+            Interface(device_id=3, name='Ethernet47', configtype=InterfaceConfigType.MLAG_PEER),
+            Interface(device_id=3, name='Ethernet48', configtype=InterfaceConfigType.ACCESS_UPLINK),
+            Interface(device_id=4, name='Ethernet47', configtype=InterfaceConfigType.MLAG_PEER),
+        ]
+        mgmtdomains = [
+            Mgmtdomain(id=1, ipv4_gw='10.0.6.1/24', device_a_id=1, device_b_id=2, vlan=600),
+        ]
+        self.topology = TopologySnapshot(
+            [self.dist1, self.dist2, self.access1, self.access2, self.core1],
+            linknets, interfaces, mgmtdomains)
+
+    def test_neighbors(self):
+        self.assertEqual(
+            sorted([d.hostname for d in self.topology.get_neighbors(self.access1)]),
+            ['access2', 'dist1'])
+        self.assertEqual(
+            [ln.id for ln in self.topology.get_links_to(self.dist1, self.core1)], [4])
+        self.assertEqual(
+            self.topology.get_linknet_localif_mapping(self.dist1),
+            {'Ethernet1': 'access1', 'Ethernet3': 'core1'})
+
+    def test_mlag_peer(self):
+        self.assertEqual(self.topology.get_mlag_peer(self.access1), self.access2)
+        self.assertIsNone(self.topology.get_mlag_peer(self.dist1))
+
+    def test_mgmtdomains(self):
+        mgmtdom = self.topology.find_mgmtdomain_by_ip(IPv4Address('10.0.6.10'))
+        self.assertEqual(mgmtdom.id, 1)
+        self.assertIsNone(self.topology.find_mgmtdomain_by_ip(IPv4Address('10.0.7.10')))
+        self.assertEqual([m.id for m in self.topology.get_all_mgmtdomains('dist2')], [1])
+        self.assertEqual(self.topology.get_all_mgmtdomains('core1'), [])
+        self.assertRaises(ValueError, self.topology.get_all_mgmtdomains, 'unknown1')
+
+    def test_devices(self):
+        self.assertEqual(self.topology.get_device('core1'), self.core1)
+        self.assertIsNone(self.topology.get_device('unknown1'))
+        self.assertEqual(self.topology.get_devices_by_type(DeviceType.CORE), [self.core1])
+
+
+if __name__ == '__main__':
+    unittest.main()
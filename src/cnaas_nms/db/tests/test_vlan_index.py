@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from cnaas_nms.db.vlan_index import VlanIndex, DeviceVlans
+
+
+class VlanIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.device1 = {
+            'internal_vlans': {'vlan_id_low': 3000, 'vlan_id_high': 3999},
+            'vxlans': {
+                'vxlan1': {'vni': 100100, 'vlan_id': 100, 'vlan_name': 'vlanname1'},
+                'vxlan2': {'vni': 100200, 'vlan_id': 100, 'vlan_name': 'vlanname1'},
+                'vxlan3': {'vni': 103000, 'vlan_id': 3000, 'vlan_name': 'vlanname3'},
+            }
+        }
+        self.device2 = {
+            'vxlans': {
+                'vxlan4': {'vni': 100100, 'vlan_id': 200, 'vlan_name': 'vlanname4'},
+            }
+        }
+
+    def test_all_conflicts(self):
+        index = VlanIndex()
+        index.update_device('eosaccess1', self.device1, True)
+        index.update_device('eosdist1', self.device2, False)
+        self.assertEqual(index.get_conflicts({200}), [
+            "VXLAN VNI 100100 is used in multiple VXLANs: vxlan1, vxlan4",
+            "VLAN id 100 is used in multiple VXLANs: vxlan1, vxlan2",
+            "VLAN id 200 used in VXLAN vxlan4 is already used as management VLAN",
+            "VLAN id 100 used multiple times in device eosaccess1",
+            "VLAN name vlanname1 used multiple times in device eosaccess1",
+            "VLAN id 3000 is overlapping with internal VLAN range",
+        ])
+        self.assertEqual(len(index.get_conflicts({200}, unique_vlans=False)), 4)
+
+    def test_incremental_update(self):
+        index = VlanIndex()
+        index.update_device('eosaccess1', self.device1, False)
+        index.update_device('eosdist1', self.device2, False)
+        index.changed.clear()
+        self.assertFalse(index.update_device('eosdist1', self.device2, False))
+        self.device2['vxlans']['vxlan4']['vni'] = 100400
+        self.assertTrue(index.update_device('eosdist1', self.device2, False))
+        self.assertEqual(index.changed, {'eosdist1'})
+        self.assertNotIn(100100, [c for c in index.get_conflicts(set()) if 'VNI' in c])
+        index.remove_device('eosaccess1')
+        self.assertEqual(index.get_conflicts(set()), [])
+        self.assertEqual(index.removed, {'eosaccess1'})
+
+    def test_persist_device(self):
+        device = DeviceVlans.from_settings('eosaccess1', self.device1, True)
+        loaded = DeviceVlans.from_json(device.to_json())
+        self.assertEqual(loaded.vlans, (1 << 100) | (1 << 3000))
+        self.assertEqual(loaded.vxlans, device.vxlans)
+        self.assertEqual(loaded.conflicts, device.conflicts)
+
+
+if __name__ == '__main__':
+    unittest.main()
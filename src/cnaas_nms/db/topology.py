@@ -0,0 +1,179 @@
+from ipaddress import IPv4Address, IPv4Interface
+from typing import Dict, List, Optional
+
+import cnaas_nms.db.helper
+from cnaas_nms.db.device import Device, DeviceError, DeviceType
+from cnaas_nms.db.interface import Interface, InterfaceConfigType
+from cnaas_nms.db.linknet import Linknet
+from cnaas_nms.db.mgmtdomain import Mgmtdomain
+from cnaas_nms.db.session import sqla_session
+
+
+class SessionTopology(object):
+    """Answer topology lookups for populate_device_vars by querying the
+    database directly. Used when only a single device is being
+    processed and loading a full TopologySnapshot would be wasteful."""
+    def __init__(self, session):
+        self.session = session
+
+    def get_device(self, hostname: str) -> Optional[Device]:
+        return self.session.query(Device).filter(Device.hostname == hostname).one_or_none()
+
+    def get_devices_by_type(self, devtype: DeviceType) -> List[Device]:
+        return self.session.query(Device).filter(Device.device_type == devtype).all()
+
+    def get_neighbors(self, dev: Device) -> List[Device]:
+        return dev.get_neighbors(self.session)
+
+    def get_links_to(self, dev: Device, peer_device: Device) -> List[Linknet]:
+        return dev.get_links_to(self.session, peer_device)
+
+    def get_linknet_localif_mapping(self, dev: Device) -> Dict[str, str]:
+        return dev.get_linknet_localif_mapping(self.session)
+
+    def get_interfaces(self, dev: Device) -> List[Interface]:
+        return self.session.query(Interface).filter(Interface.device == dev).all()
+
+    def get_mlag_peer(self, dev: Device) -> Optional[Device]:
+        return dev.get_mlag_peer(self.session)
+
+    def find_mgmtdomain_by_ip(self, ipv4_address: IPv4Address) -> Optional[Mgmtdomain]:
+        return cnaas_nms.db.helper.find_mgmtdomain_by_ip(self.session, ipv4_address)
+
+    def get_all_mgmtdomains(self, hostname: str) -> List[Mgmtdomain]:
+        return cnaas_nms.db.helper.get_all_mgmtdomains(self.session, hostname)
+
+
+class TopologySnapshot(object):
+    """In-memory snapshot of devices, linknets, interfaces, mgmtdomains and
+    stack members, loaded with a fixed number of bulk queries.
+
+    Provides the same lookups as SessionTopology but answers them from
+    indexes, so generating config for many devices does not cost a number
+    of queries per device. Objects in the snapshot are detached from their
+    session, only column attributes and stack_members may be accessed.
+    """
+    def __init__(self, devices: List[Device], linknets: List[Linknet],
+                 interfaces: List[Interface], mgmtdomains: List[Mgmtdomain]):
+        self.devices_by_id: Dict[int, Device] = {}
+        self.devices_by_hostname: Dict[str, Device] = {}
+        self.devices_by_type: Dict[DeviceType, List[Device]] = {}
+        self.linknets_by_device: Dict[int, List[Linknet]] = {}
+        self.interfaces_by_device: Dict[int, List[Interface]] = {}
+        self.mgmtdomains_by_device: Dict[int, List[Mgmtdomain]] = {}
+        self.mgmtdomain_networks = []
+
+        for dev in devices:
+            self.devices_by_id[dev.id] = dev
+            self.devices_by_hostname[dev.hostname] = dev
+            self.devices_by_type.setdefault(dev.device_type, []).append(dev)
+        for linknet in linknets:
+            self.linknets_by_device.setdefault(linknet.device_a_id, []).append(linknet)
+            if linknet.device_b_id != linknet.device_a_id:
+                self.linknets_by_device.setdefault(linknet.device_b_id, []).append(linknet)
+        for intf in interfaces:
+            self.interfaces_by_device.setdefault(intf.device_id, []).append(intf)
+        for mgmtdom in mgmtdomains:
+            self.mgmtdomain_networks.append((IPv4Interface(mgmtdom.ipv4_gw).network, mgmtdom))
+            for device_id in {mgmtdom.device_a_id, mgmtdom.device_b_id}:
+                self.mgmtdomains_by_device.setdefault(device_id, []).append(mgmtdom)
+
+    @classmethod
+    def load(cls, hostnames: Optional[List[str]] = None) -> 'TopologySnapshot':
+        """Load a snapshot from the database.
+
+        Args:
+            hostnames: Only load interfaces for these devices, all other
+                       tables are always loaded completely since they are
+                       needed to resolve neighbors and peers.
+
+        Returns:
+            TopologySnapshot
+        """
+        with sqla_session() as session:
+            devices = session.query(Device).all()
+            linknets = session.query(Linknet).all()
+            intf_query = session.query(Interface)
+            if hostnames is not None:
+                intf_query = intf_query.join(Device, Interface.device_id == Device.id).\
+                    filter(Device.hostname.in_(hostnames))
+            interfaces = intf_query.all()
+            mgmtdomains = session.query(Mgmtdomain).all()
+            # Detach loaded objects so they are not expired on commit
+            session.expunge_all()
+        return cls(devices, linknets, interfaces, mgmtdomains)
+
+    def get_device(self, hostname: str) -> Optional[Device]:
+        return self.devices_by_hostname.get(hostname)
+
+    def get_devices_by_type(self, devtype: DeviceType) -> List[Device]:
+        return list(self.devices_by_type.get(devtype, []))
+
+    def get_neighbors(self, dev: Device) -> List[Device]:
+        ret = []
+        for linknet in self.linknets_by_device.get(dev.id, []):
+            if linknet.device_a_id == dev.id:
+                ret.append(self.devices_by_id[linknet.device_b_id])
+            else:
+                ret.append(self.devices_by_id[linknet.device_a_id])
+        return ret
+
+    def get_links_to(self, dev: Device, peer_device: Device) -> List[Linknet]:
+        return [linknet for linknet in self.linknets_by_device.get(dev.id, [])
+                if {linknet.device_a_id, linknet.device_b_id} == {dev.id, peer_device.id}]
+
+    def get_linknet_localif_mapping(self, dev: Device) -> Dict[str, str]:
+        ret = {}
+        for linknet in self.linknets_by_device.get(dev.id, []):
+            if linknet.device_a_id == dev.id:
+                ret[linknet.device_a_port] = self.devices_by_id[linknet.device_b_id].hostname
+            else:
+                ret[linknet.device_b_port] = self.devices_by_id[linknet.device_a_id].hostname
+        return ret
+
+    def get_interfaces(self, dev: Device) -> List[Interface]:
+        return list(self.interfaces_by_device.get(dev.id, []))
+
+    def get_mlag_peer(self, dev: Device) -> Optional[Device]:
+        mlag_ifnames = [intf.name for intf in self.interfaces_by_device.get(dev.id, [])
+                        if intf.configtype == InterfaceConfigType.MLAG_PEER]
+        peer_ids = set()
+        for linknet in self.linknets_by_device.get(dev.id, []):
+            if linknet.device_a_id == dev.id and linknet.device_a_port in mlag_ifnames:
+                peer_ids.add(linknet.device_b_id)
+            elif linknet.device_b_id == dev.id and linknet.device_b_port in mlag_ifnames:
+                peer_ids.add(linknet.device_a_id)
+        peers = [self.devices_by_id[x] for x in peer_ids]
+        if len(peers) > 1:
+            raise DeviceError("More than one MLAG peer found: {}".format(
+                [x.hostname for x in peers]
+            ))
+        elif len(peers) == 1:
+            peer_devtype = peers[0].device_type
+            if dev.device_type == DeviceType.UNKNOWN or peer_devtype == DeviceType.UNKNOWN:
+                # Ignore check during INIT, one device might be UNKNOWN
+                pass
+            elif dev.device_type != peer_devtype:
+                raise DeviceError("MLAG peers are not the same device type")
+            return peers[0]
+        else:
+            return None
+
+    def find_mgmtdomain_by_ip(self, ipv4_address: IPv4Address) -> Optional[Mgmtdomain]:
+        for network, mgmtdom in self.mgmtdomain_networks:
+            if ipv4_address in network:
+                return mgmtdom
+        return None
+
+    def get_all_mgmtdomains(self, hostname: str) -> List[Mgmtdomain]:
+        """Get all mgmtdomains for a specific distribution switch.
+
+        Raises:
+            ValueError: on invalid hostname etc
+        """
+        if not Device.valid_hostname(hostname):
+            raise ValueError(f"Argument {hostname} is not a valid hostname")
+        dev = self.devices_by_hostname.get(hostname)
+        if not dev:
+            raise ValueError(f"hostname {hostname} not found in device database")
+        return list(self.mgmtdomains_by_device.get(dev.id, []))
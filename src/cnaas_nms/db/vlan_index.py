@@ -0,0 +1,232 @@
+import json
+from hashlib import sha256
+from typing import Dict, List, Optional, Set, Tuple
+
+from cnaas_nms.db.session import redis_session
+from cnaas_nms.tools.log import get_logger
+
+
+VLAN_INDEX_KEY = 'vlan_index'
+VLAN_INDEX_VERSION = 1
+
+
+def get_internal_vlan_bits(settings: dict) -> int:
+    """Get the internal VLAN range of a device as a VLAN bitmap."""
+    internal_vlans = settings.get('internal_vlans')
+    if not isinstance(internal_vlans, dict):
+        return 0
+    low = internal_vlans.get('vlan_id_low')
+    high = internal_vlans.get('vlan_id_high')
+    if type(low) != int or type(high) != int or high < low:
+        return 0
+    return ((1 << (high + 1)) - 1) ^ ((1 << low) - 1)
+
+
+def settings_vlan_digest(settings: dict) -> str:
+    """Digest of the parts of device settings that affect VLAN allocation."""
+    data = json.dumps([settings.get('vxlans'), settings.get('internal_vlans')],
+                      sort_keys=True, default=str)
+    return sha256(data.encode()).hexdigest()
+
+
+class DeviceVlans(object):
+    """VLAN and VNI allocations of a single device."""
+    __slots__ = ['digest', 'access', 'vxlans', 'vlans', 'internal_vlans', 'conflicts']
+
+    def __init__(self, digest: str, access: bool, vxlans: List[Tuple[str, int, int]],
+                 vlans: int, internal_vlans: int, conflicts: List[str]):
+        self.digest = digest
+        self.access = access
+        self.vxlans = vxlans
+        self.vlans = vlans
+        self.internal_vlans = internal_vlans
+        self.conflicts = conflicts
+
+    @classmethod
+    def from_settings(cls, hostname: str, settings: dict, access: bool) -> 'DeviceVlans':
+        """Extract VLAN allocations from device settings, and find conflicts
+        within the device itself."""
+        logger = get_logger()
+        vxlans: List[Tuple[str, Optional[int], Optional[int]]] = []
+        vlans = 0
+        internal_vlans = get_internal_vlan_bits(settings)
+        vlan_names: Set[str] = set()
+        conflicts: List[str] = []
+        for vxlan_name, vxlan_data in (settings.get('vxlans') or {}).items():
+            if 'vni' not in vxlan_data or not isinstance(vxlan_data['vni'], int):
+                logger.error("VXLAN {} is missing vni".format(vxlan_name))
+                continue
+            if 'vlan_id' not in vxlan_data or not isinstance(vxlan_data['vlan_id'], int):
+                logger.error("VXLAN {} is missing vlan_id".format(vxlan_name))
+                vxlans.append((vxlan_name, vxlan_data['vni'], None))
+                continue
+            vlan_id = vxlan_data['vlan_id']
+            vxlans.append((vxlan_name, vxlan_data['vni'], vlan_id))
+            vlan_bit = 1 << vlan_id
+            if vlans & vlan_bit:
+                conflicts.append("VLAN id {} used multiple times in device {}".format(
+                    vlan_id, hostname))
+            vlans |= vlan_bit
+            if internal_vlans & vlan_bit:
+                conflicts.append("VLAN id {} is overlapping with internal VLAN range".format(
+                    vlan_id))
+            if 'vlan_name' not in vxlan_data or not isinstance(vxlan_data['vlan_name'], str):
+                logger.error("VXLAN {} is missing vlan_name".format(vxlan_name))
+                continue
+            # only trigger for access switches
+            if access and vxlan_data['vlan_name'] in vlan_names:
+                conflicts.append("VLAN name {} used multiple times in device {}".format(
+                    vxlan_data['vlan_name'], hostname))
+            vlan_names.add(vxlan_data['vlan_name'])
+        return cls(settings_vlan_digest(settings), access, vxlans, vlans,
+                   internal_vlans, conflicts)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'version': VLAN_INDEX_VERSION,
+            'digest': self.digest,
+            'access': self.access,
+            'vxlans': self.vxlans,
+            'vlans': hex(self.vlans),
+            'internal_vlans': hex(self.internal_vlans),
+            'conflicts': self.conflicts,
+        })
+
+    @classmethod
+    def from_json(cls, data: str) -> Optional['DeviceVlans']:
+        entry = json.loads(data)
+        if entry.get('version') != VLAN_INDEX_VERSION:
+            return None
+        return cls(entry['digest'], entry['access'], [tuple(x) for x in entry['vxlans']],
+                   int(entry['vlans'], 16), int(entry['internal_vlans'], 16),
+                   entry['conflicts'])
+
+
+class VlanIndex(object):
+    """Index of VLAN and VNI allocations for all managed devices.
+
+    Each device keeps a bitmap of used VLAN ids together with the conflicts
+    found within the device. Global maps from VNI and VLAN id to the VXLAN
+    names using them are reference counted, so a device can be replaced in
+    the index without rebuilding the maps for other devices.
+    """
+    def __init__(self):
+        self.devices: Dict[str, DeviceVlans] = {}
+        self.vnis: Dict[int, Dict[str, int]] = {}
+        self.vlans: Dict[int, Dict[str, int]] = {}
+        self.changed: Set[str] = set()
+        self.removed: Set[str] = set()
+
+    def _count(self, device: DeviceVlans, delta: int):
+        for vxlan_name, vni, vlan_id in device.vxlans:
+            for index, key in ((self.vnis, vni), (self.vlans, vlan_id)):
+                if key is None:
+                    continue
+                names = index.setdefault(key, {})
+                names[vxlan_name] = names.get(vxlan_name, 0) + delta
+                if names[vxlan_name] <= 0:
+                    del names[vxlan_name]
+                    if not names:
+                        del index[key]
+
+    def set_device(self, hostname: str, device: DeviceVlans):
+        old_device = self.devices.get(hostname)
+        if old_device is not None:
+            self._count(old_device, -1)
+        self.devices[hostname] = device
+        self._count(device, 1)
+
+    def update_device(self, hostname: str, settings: dict, access: bool) -> bool:
+        """Update allocations for a device from its settings.
+
+        Returns:
+            True if the allocations of the device were changed
+        """
+        old_device = self.devices.get(hostname)
+        if old_device is not None and old_device.access == access and \
+                old_device.digest == settings_vlan_digest(settings):
+            return False
+        self.set_device(hostname, DeviceVlans.from_settings(hostname, settings, access))
+        self.changed.add(hostname)
+        self.removed.discard(hostname)
+        return True
+
+    def remove_device(self, hostname: str):
+        device = self.devices.pop(hostname, None)
+        if device is not None:
+            self._count(device, -1)
+            self.changed.discard(hostname)
+            self.removed.add(hostname)
+
+    def get_conflicts(self, mgmt_vlans: Set[int], unique_vlans: bool = True) -> List[str]:
+        """Get all VLAN and VNI conflicts in the index.
+
+        Args:
+            mgmt_vlans: VLAN ids used by management domains
+            unique_vlans: If enabled VLANs has to be globally unique
+
+        Returns:
+            List of conflict descriptions, empty if there are no conflicts
+        """
+        conflicts: List[str] = []
+        for vni, names in sorted(self.vnis.items()):
+            if len(names) > 1:
+                conflicts.append("VXLAN VNI {} is used in multiple VXLANs: {}".format(
+                    vni, ', '.join(sorted(names))))
+        if unique_vlans:
+            for vlan_id, names in sorted(self.vlans.items()):
+                if vlan_id in mgmt_vlans:
+                    conflicts.append(
+                        "VLAN id {} used in VXLAN {} is already used as management VLAN".format(
+                            vlan_id, ', '.join(sorted(names))))
+                elif len(names) > 1:
+                    conflicts.append("VLAN id {} is used in multiple VXLANs: {}".format(
+                        vlan_id, ', '.join(sorted(names))))
+        for hostname, device in sorted(self.devices.items()):
+            conflicts += device.conflicts
+        return conflicts
+
+
+def load_vlan_index() -> Optional[VlanIndex]:
+    """Load the persisted VLAN index.
+
+    Returns:
+        VlanIndex, or None if no index has been persisted yet
+    """
+    logger = get_logger()
+    index = VlanIndex()
+    try:
+        with redis_session() as redis:
+            entries = redis.hgetall(VLAN_INDEX_KEY)
+    except Exception as e:
+        logger.warning("Could not load VLAN index: {}".format(e))
+        return None
+    if not entries:
+        return None
+    for hostname, data in entries.items():
+        device = DeviceVlans.from_json(data)
+        if device is None:
+            return None
+        index.set_device(hostname, device)
+    return index
+
+
+def save_vlan_index(index: VlanIndex):
+    """Persist the devices that changed in the index since it was loaded."""
+    logger = get_logger()
+    try:
+        with redis_session() as redis:
+            pipe = redis.pipeline()
+            if index.removed:
+                pipe.hdel(VLAN_INDEX_KEY, *index.removed)
+            if index.changed:
+                pipe.hset(VLAN_INDEX_KEY, mapping={
+                    hostname: index.devices[hostname].to_json() for hostname in index.changed
+                })
+            pipe.execute()
+    except Exception as e:
+        logger.warning("Could not save VLAN index: {}".format(e))
+        return
+    index.changed.clear()
+    index.removed.clear()
+
@@ -0,0 +1,214 @@
+import json
+import threading
+import time
+from typing import Dict, Optional
+
+from redis import StrictRedis
+
+from cnaas_nms.app_settings import app_settings
+from cnaas_nms.db.job import Job
+from cnaas_nms.db.session import sqla_session
+from cnaas_nms.tools.log import get_logger
+
+
+ABORT_CHANNEL = 'job_abort'
+ABORT_KEY_PREFIX = 'job_abort_'
+# Seconds an abort request is kept for jobs that have not started listening yet
+ABORT_KEY_TTL = 86400
+# Seconds to wait before subscribing again after losing connection to redis
+RECONNECT_INTERVAL = 5
+# Seconds between abort status checks when waiting without a token that
+# can be cancelled by the listener
+ABORT_POLL_INTERVAL = 5
+
+
+logger = get_logger()
+
+
+class CancellationToken(object):
+    """In-memory abort flag for a running job, set by the listener thread
+    when an abort is requested so tasks can check it without any I/O."""
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: Optional[str] = None):
+        self.reason = reason
+        self._event.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait until the job is aborted or timeout seconds has passed.
+
+        Returns:
+            True if the job was aborted
+        """
+        return self._event.wait(timeout)
+
+
+class CancellationService(object):
+    """Send and receive job abort requests using redis pub/sub.
+
+    Each process running jobs has one subscription to the abort channel,
+    and keeps a cancellation token for every job it's running. Abort
+    requests are also stored as keys in redis, so jobs that are registered
+    after the abort was published, or while the subscription was
+    disconnected, are still aborted.
+    """
+    def __init__(self, client: Optional[StrictRedis] = None):
+        if client is None:
+            client = StrictRedis(
+                host=app_settings.REDIS_HOSTNAME, port=app_settings.REDIS_PORT,
+                encoding="utf-8", decode_responses=True,
+                retry_on_timeout=True, socket_keepalive=True
+            )
+        self.client = client
+        # Job id as key and cancellation token as value for jobs running in this process
+        self.tokens: Dict[int, CancellationToken] = {}
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        # Set while subscribed to the abort channel
+        self.connected = False
+
+    @staticmethod
+    def get_key(job_id: int) -> str:
+        return ABORT_KEY_PREFIX + str(job_id)
+
+    def request_abort(self, job_id: int, reason: str = "") -> int:
+        """Abort a running job.
+
+        Args:
+            job_id: Job id
+            reason: Abort reason
+
+        Returns:
+            Number of processes that received the abort request
+        """
+        pipe = self.client.pipeline()
+        pipe.set(self.get_key(job_id), reason, ex=ABORT_KEY_TTL)
+        pipe.publish(ABORT_CHANNEL, json.dumps({'job_id': int(job_id), 'reason': reason}))
+        return pipe.execute()[1]
+
+    def register(self, job_id: int) -> CancellationToken:
+        """Create a cancellation token for a job that is starting to run in
+        this process, and start listening for abort requests if needed."""
+        job_id = int(job_id)
+        token = CancellationToken(job_id)
+        with self._lock:
+            self.tokens[job_id] = token
+            self.start_listener()
+        try:
+            self.check_pending([token])
+        except Exception as e:
+            logger.warning("Unable to check pending abort for job {}: {}".format(job_id, e))
+        return token
+
+    def unregister(self, job_id: int):
+        with self._lock:
+            self.tokens.pop(int(job_id), None)
+
+    def get_token(self, job_id: int) -> Optional[CancellationToken]:
+        try:
+            return self.tokens.get(int(job_id))
+        except (TypeError, ValueError):
+            return None
+
+    def check_pending(self, tokens=None):
+        """Cancel tokens for jobs that have abort requests stored in redis."""
+        if tokens is None:
+            with self._lock:
+                tokens = list(self.tokens.values())
+        if not tokens:
+            return
+        reasons = self.client.mget([self.get_key(t.job_id) for t in tokens])
+        for token, reason in zip(tokens, reasons):
+            if reason is not None and not token.cancelled:
+                logger.info("Found pending abort for job {}".format(token.job_id))
+                token.cancel(reason)
+
+    def handle_message(self, message: dict):
+        """Cancel the token of the job in an abort message, if the job is
+        running in this process."""
+        try:
+            data: dict = json.loads(message['data'])
+            job_id = int(data['job_id'])
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error("Received invalid job abort message: {}".format(e))
+            return
+        token = self.get_token(job_id)
+        if token and not token.cancelled:
+            logger.info("Abort requested for job {}".format(job_id))
+            token.cancel(data.get('reason'))
+
+    def start_listener(self):
+        if self._listener and self._listener.is_alive():
+            return
+        self._listener = threading.Thread(target=self.listen, name='job_abort_listener',
+                                          daemon=True)
+        self._listener.start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(ABORT_CHANNEL)
+                # Aborts requested while not subscribed
+                self.check_pending()
+                self.connected = True
+                for message in pubsub.listen():
+                    self.handle_message(message)
+            except Exception as e:
+                self.connected = False
+                logger.warning("Error listening for job abort requests: {}".format(e))
+                time.sleep(RECONNECT_INTERVAL)
+
+
+_cancellation_service: Optional[CancellationService] = None
+_cancellation_service_lock = threading.Lock()
+
+
+def get_cancellation_service() -> CancellationService:
+    global _cancellation_service
+    with _cancellation_service_lock:
+        if _cancellation_service is None:
+            _cancellation_service = CancellationService()
+        return _cancellation_service
+
+
+def is_job_aborted(job_id) -> bool:
+    """Check if specified job is being aborted. Uses the in-memory
+    cancellation token if the job is running in this process and abort
+    requests can be received, otherwise the job status is read from the
+    database."""
+    cancellation_service = get_cancellation_service()
+    token = cancellation_service.get_token(job_id)
+    if token is not None and (token.cancelled or cancellation_service.connected):
+        return token.cancelled
+    with sqla_session() as session:
+        return Job.check_job_abort_status(session, job_id)
+
+
+def wait_for_abort(job_id, timeout: float) -> bool:
+    """Wait timeout seconds, returning as soon as the job is aborted.
+
+    Returns:
+        True if the job was aborted
+    """
+    token = get_cancellation_service().get_token(job_id)
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if token is not None:
+            if token.wait(min(remaining, ABORT_POLL_INTERVAL)):
+                return True
+        else:
+            time.sleep(min(remaining, ABORT_POLL_INTERVAL))
+        # Abort requests are not received while the listener is disconnected
+        if is_job_aborted(job_id):
+            return True
@@ -0,0 +1,238 @@
+import json
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from apscheduler.executors.pool import ThreadPoolExecutor
+
+from cnaas_nms.db.session import redis_session
+from cnaas_nms.tools.log import get_logger
+
+
+# Each scheduler process publishes stats for its pools in a hash named
+# POOL_STATS_KEY:<process>, which expires unless the process keeps running
+POOL_STATS_KEY = 'scheduler_pool_stats'
+POOL_STATS_TTL = 300
+POOL_STATS_INTERVAL = 60
+DEFAULT_POOL = 'default'
+# Executor pool to run each job function in, functions not listed here
+# run in the default pool
+JOB_POOLS = {
+    'cnaas_nms.confpush.sync_devices:sync_devices': 'bulk_sync',
+    'cnaas_nms.confpush.sync_devices:apply_config': 'interactive',
+    'cnaas_nms.confpush.update:update_facts': 'interactive',
+    'cnaas_nms.confpush.update:update_interfacedb': 'interactive',
+    'cnaas_nms.confpush.erase:device_erase': 'interactive',
+    'cnaas_nms.confpush.cert:renew_cert': 'interactive',
+    'cnaas_nms.api.firmware:remove_file': 'interactive',
+    'cnaas_nms.confpush.firmware:device_upgrade': 'firmware',
+    'cnaas_nms.api.firmware:get_firmware': 'firmware',
+    'cnaas_nms.api.firmware:get_firmware_chksum': 'firmware',
+    'cnaas_nms.confpush.init_device:discover_device': 'ztp',
+    'cnaas_nms.confpush.init_device:init_access_device_step1': 'ztp',
+    'cnaas_nms.confpush.init_device:init_fabric_device_step1': 'ztp',
+    'cnaas_nms.confpush.init_device:init_device_step2': 'ztp',
+}
+
+
+def get_job_pool(func_name: str, pools: Dict[str, int]) -> str:
+    """Get the name of the executor pool to run a job function in.
+
+    Args:
+        func_name: Job function as "module:function"
+        pools: Configured pools with name as key and size as value
+    """
+    pool = JOB_POOLS.get(func_name, DEFAULT_POOL)
+    if pool not in pools:
+        return DEFAULT_POOL
+    return pool
+
+
+def get_publisher_name() -> str:
+    """Name of this process when publishing pool stats, same as the
+    default job queue consumer name."""
+    return '{}-{}'.format(socket.gethostname(), os.getpid())
+
+
+class PoolStats(object):
+    """Queue depth and wait time counters for an executor pool."""
+    def __init__(self, name: str, size: int, publish: bool = False,
+                 publisher: Optional[str] = None):
+        self.name = name
+        self.size = size
+        self.publish_enabled = publish
+        self.publisher = publisher or get_publisher_name()
+        self.queued = 0
+        self.running = 0
+        self.started = 0
+        self.finished = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.wait_time_last = 0.0
+        self._lock = threading.Lock()
+
+    def job_queued(self):
+        with self._lock:
+            self.queued += 1
+        self.publish()
+
+    def job_started(self, wait_time: float):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.started += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            self.wait_time_last = wait_time
+        self.publish()
+
+    def job_finished(self):
+        with self._lock:
+            self.running -= 1
+            self.finished += 1
+        self.publish()
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'size': self.size,
+                'queued': self.queued,
+                'running': self.running,
+                'started': self.started,
+                'finished': self.finished,
+                'wait_time_avg': round(self.wait_time_total / self.started, 3)
+                if self.started else 0.0,
+                'wait_time_max': round(self.wait_time_max, 3),
+                'wait_time_last': round(self.wait_time_last, 3),
+            }
+
+    def publish(self):
+        """Store stats in redis so they can be read by the API workers."""
+        logger = get_logger()
+        if not self.publish_enabled:
+            return
+        try:
+            data = {**self.as_dict(), 'updated': time.time()}
+            key = '{}:{}'.format(POOL_STATS_KEY, self.publisher)
+            with redis_session() as redis:
+                pipe = redis.pipeline()
+                pipe.hset(key, self.name, json.dumps(data))
+                pipe.expire(key, POOL_STATS_TTL)
+                pipe.execute()
+        except Exception as e:
+            logger.debug("Could not publish scheduler pool stats: {}".format(e))
+
+
+class _MonitoredPool(object):
+    """Wraps a concurrent.futures pool to record when jobs are queued,
+    started and finished."""
+    def __init__(self, pool, stats: PoolStats):
+        self._pool = pool
+        self._max_workers = pool._max_workers
+        self.stats = stats
+
+    def submit(self, fn, *args, **kwargs):
+        submitted = time.monotonic()
+        self.stats.job_queued()
+
+        def run():
+            self.stats.job_started(time.monotonic() - submitted)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.stats.job_finished()
+
+        try:
+            return self._pool.submit(run)
+        except Exception:
+            with self.stats._lock:
+                self.stats.queued -= 1
+            raise
+
+    def shutdown(self, wait=True):
+        return self._pool.shutdown(wait)
+
+
+class MonitoredThreadPoolExecutor(ThreadPoolExecutor):
+    """APScheduler thread pool executor that keeps PoolStats."""
+    def __init__(self, name: str, max_workers: int = 10, pool_kwargs: Optional[dict] = None,
+                 publish: bool = False, publisher: Optional[str] = None):
+        pool_kwargs = pool_kwargs or {}
+        pool_kwargs.setdefault('thread_name_prefix', 'scheduler-{}'.format(name))
+        super(MonitoredThreadPoolExecutor, self).__init__(max_workers, pool_kwargs)
+        self.stats = PoolStats(name, max_workers, publish, publisher)
+        self._pool = _MonitoredPool(self._pool, self.stats)
+
+
+def _publish_loop(executors: Dict[str, MonitoredThreadPoolExecutor]):
+    while True:
+        time.sleep(POOL_STATS_INTERVAL)
+        for executor in executors.values():
+            executor.stats.publish()
+
+
+def create_executors(pools: Dict[str, int], publish: bool = False,
+                     publisher: Optional[str] = None) -> Dict[str, MonitoredThreadPoolExecutor]:
+    """Create one executor per configured pool, a default pool is always
+    included since jobs in persistent jobstores might refer to it.
+
+    Args:
+        pools: Configured pools with name as key and size as value
+        publish: Publish stats in redis, stats are published again every
+                 POOL_STATS_INTERVAL seconds while the process is running
+        publisher: Name of this process in published stats
+    """
+    pools = {DEFAULT_POOL: 10, **pools}
+    publisher = publisher or get_publisher_name()
+    executors = {name: MonitoredThreadPoolExecutor(name, size, publish=publish,
+                                                   publisher=publisher)
+                 for name, size in pools.items()}
+    if publish:
+        for executor in executors.values():
+            executor.stats.publish()
+        threading.Thread(target=_publish_loop, args=(executors,),
+                         name='scheduler_pool_stats', daemon=True).start()
+    return executors
+
+
+def aggregate_pool_stats(published: Iterable[Dict[str, dict]]) -> Dict[str, dict]:
+    """Combine pool stats published by several scheduler processes.
+
+    Args:
+        published: Stats of each process, with pool name as key
+    """
+    ret: Dict[str, dict] = {}
+    updated: Dict[str, float] = {}
+    for pools in published:
+        for name, stats in pools.items():
+            if name not in ret:
+                ret[name] = {'size': 0, 'queued': 0, 'running': 0, 'started': 0,
+                             'finished': 0, 'wait_time_avg': 0.0, 'wait_time_max': 0.0,
+                             'wait_time_last': 0.0, 'processes': 0}
+                updated[name] = 0.0
+            total = ret[name]
+            wait_time_sum = total['wait_time_avg'] * total['started'] + \
+                stats['wait_time_avg'] * stats['started']
+            for counter in ['size', 'queued', 'running', 'started', 'finished']:
+                total[counter] += stats[counter]
+            total['wait_time_avg'] = round(wait_time_sum / total['started'], 3) \
+                if total['started'] else 0.0
+            total['wait_time_max'] = max(total['wait_time_max'], stats['wait_time_max'])
+            if stats.get('updated', 0.0) >= updated[name]:
+                updated[name] = stats.get('updated', 0.0)
+                total['wait_time_last'] = stats['wait_time_last']
+            total['processes'] += 1
+    return ret
+
+
+def get_published_pool_stats() -> Dict[str, dict]:
+    """Get stats for all executor pools, combined for all scheduler
+    processes that have published stats."""
+    published = []
+    with redis_session() as redis:
+        for key in redis.scan_iter(match='{}:*'.format(POOL_STATS_KEY)):
+            published.append({name: json.loads(data)
+                              for name, data in redis.hgetall(key).items()})
+    return aggregate_pool_stats(published)
@@ -0,0 +1,182 @@
+import json
+import os
+import socket
+import threading
+from typing import Dict, List, Optional
+
+from redis import StrictRedis
+from redis.exceptions import ResponseError
+
+from cnaas_nms.app_settings import app_settings
+from cnaas_nms.tools.log import get_logger
+
+
+JOB_STREAM = 'scheduler_jobs'
+JOB_GROUP = 'scheduler_workers'
+CONTROL_CHANNEL = 'scheduler_control'
+# Seconds a job can be held by a worker without heartbeat before it's
+# claimed by another worker
+VISIBILITY_TIMEOUT = 300
+# Number of times a job is delivered to workers before it's given up
+MAX_DELIVERIES = 3
+
+
+class QueuedJob(object):
+    """Job message read from the job queue."""
+    def __init__(self, message_id: str, data: dict, deliveries: int = 1):
+        self.message_id = message_id
+        self.data = data
+        self.deliveries = deliveries
+
+    @property
+    def job_id(self) -> str:
+        return str(self.data['id'])
+
+
+class JobQueue(object):
+    """Distributed job queue using a redis stream with a consumer group.
+
+    Jobs published to the stream are delivered to exactly one scheduler
+    worker. A job is acknowledged and removed from the stream when the
+    worker has finished running it. Workers send heartbeats for jobs they
+    hold, and jobs held by a worker that has not sent a heartbeat for
+    visibility_timeout seconds are claimed by another worker, so jobs of
+    a crashed worker are recovered.
+    """
+    def __init__(self, client: Optional[StrictRedis] = None, consumer: Optional[str] = None,
+                 stream: str = JOB_STREAM, group: str = JOB_GROUP,
+                 visibility_timeout: int = VISIBILITY_TIMEOUT):
+        if client is None:
+            client = StrictRedis(
+                host=app_settings.REDIS_HOSTNAME, port=app_settings.REDIS_PORT,
+                encoding="utf-8", decode_responses=True,
+                retry_on_timeout=True, socket_keepalive=True
+            )
+        self.client = client
+        self.consumer = consumer or '{}-{}'.format(socket.gethostname(), os.getpid())
+        self.stream = stream
+        self.group = group
+        self.visibility_timeout = visibility_timeout
+        # Job id as key and message id as value for jobs held by this consumer
+        self.in_flight: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def create_group(self):
+        """Create stream and consumer group unless they already exist."""
+        try:
+            self.client.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def publish(self, data: dict) -> str:
+        """Add a job to the queue.
+
+        Args:
+            data: JSON serializable job description, must contain id
+
+        Returns:
+            Message id of the job in the stream
+        """
+        return self.client.xadd(self.stream, {'data': json.dumps(data)})
+
+    def publish_control(self, data: dict) -> int:
+        """Send a control message to all scheduler workers.
+
+        Returns:
+            Number of workers that received the message
+        """
+        return self.client.publish(CONTROL_CHANNEL, json.dumps(data))
+
+    def _parse(self, messages: list, deliveries: Dict[str, int]) -> List[QueuedJob]:
+        logger = get_logger()
+        ret: List[QueuedJob] = []
+        for message_id, fields in messages:
+            if not message_id:
+                continue
+            try:
+                job = QueuedJob(message_id, json.loads(fields['data']),
+                                deliveries.get(message_id, 1))
+                job_id = job.job_id
+            except (KeyError, TypeError, json.JSONDecodeError) as e:
+                logger.error("Invalid message {} in job queue: {}".format(message_id, e))
+                self.ack(message_id)
+                continue
+            with self._lock:
+                self.in_flight[job_id] = message_id
+            ret.append(job)
+        return ret
+
+    def claim_stale(self, count: int = 1) -> List[QueuedJob]:
+        """Claim jobs held by workers that have stopped sending heartbeats."""
+        idle_ms = self.visibility_timeout * 1000
+        pending = self.client.xpending_range(self.stream, self.group, '-', '+', count * 10)
+        stale = [p for p in pending if p['time_since_delivered'] >= idle_ms][:count]
+        if not stale:
+            return []
+        # Delivery count is increased by one when claiming
+        deliveries = {p['message_id']: p['times_delivered'] + 1 for p in stale}
+        messages = self.client.xclaim(self.stream, self.group, self.consumer, idle_ms,
+                                      [p['message_id'] for p in stale])
+        # Messages deleted from the stream but still in the pending list
+        # are not returned by older redis versions
+        claimed = set([m[0] for m in messages])
+        for message_id in deliveries.keys():
+            if message_id not in claimed:
+                self.client.xack(self.stream, self.group, message_id)
+        return self._parse(messages, deliveries)
+
+    def read(self, count: int = 1, block: int = 5000) -> List[QueuedJob]:
+        """Get jobs from the queue. Jobs from crashed workers are returned
+        before new jobs.
+
+        Args:
+            count: Max number of jobs to return
+            block: Milliseconds to wait for new jobs
+        """
+        jobs = self.claim_stale(count)
+        if jobs:
+            return jobs
+        res = self.client.xreadgroup(self.group, self.consumer, {self.stream: '>'},
+                                     count=count, block=block)
+        if not res:
+            return []
+        return self._parse(res[0][1], {})
+
+    def heartbeat(self) -> int:
+        """Reset idle time of all jobs held by this consumer.
+
+        Returns:
+            Number of jobs held
+        """
+        with self._lock:
+            message_ids = list(self.in_flight.values())
+        if message_ids:
+            self.client.xclaim(self.stream, self.group, self.consumer, 0, message_ids,
+                               justid=True)
+        return len(message_ids)
+
+    def ack(self, message_id: str):
+        pipe = self.client.pipeline()
+        pipe.xack(self.stream, self.group, message_id)
+        pipe.xdel(self.stream, message_id)
+        pipe.execute()
+
+    def ack_job(self, job_id) -> bool:
+        """Acknowledge a finished job held by this consumer.
+
+        Returns:
+            True if the job was held by this consumer
+        """
+        with self._lock:
+            message_id = self.in_flight.pop(str(job_id), None)
+        if not message_id:
+            return False
+        self.ack(message_id)
+        return True
+
+    def release_job(self, job_id):
+        """Stop sending heartbeats for a job without acknowledging it, so
+        it's claimed by another worker after the visibility timeout."""
+        with self._lock:
+            self.in_flight.pop(str(job_id), None)
@@ -10,11 +10,12 @@ from types import FunctionType
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.jobstores.memory import MemoryJobStore
-from apscheduler.executors.pool import ThreadPoolExecutor
 
-from cnaas_nms.app_settings import app_settings
+from cnaas_nms.app_settings import app_settings, api_settings
 from cnaas_nms.db.session import sqla_session
 from cnaas_nms.db.job import Job
+from cnaas_nms.scheduler.executor_pools import create_executors, get_job_pool
+from cnaas_nms.scheduler.job_queue import JobQueue
 from cnaas_nms.tools.log import get_logger
 
 logger = get_logger()
@@ -29,10 +30,34 @@ class SingletonType(type):
         return cls._instances[cls]
 
 
+def pre_schedule_checks(scheduler, kwargs):
+    check_ok = True
+    message = ""
+    for job in scheduler.get_scheduler().get_jobs():
+        # Only allow scheduling of one discover_device job at the same time
+        if job.name == 'cnaas_nms.confpush.init_device:discover_device':
+            if job.kwargs['kwargs']['dhcp_ip'] == kwargs['kwargs']['dhcp_ip']:
+                message = ("There is already another scheduled job to discover {} {}, skipping ".
+                           format(kwargs['kwargs']['ztp_mac'], kwargs['kwargs']['dhcp_ip']))
+                check_ok = False
+
+    if not check_ok:
+        logger.debug(message)
+        with sqla_session() as session:
+            job_entry: Job = session.query(Job).filter(Job.id == kwargs['job_id']).one_or_none()
+            job_entry.finish_abort(message)
+
+    return check_ok
+
+
 class Scheduler(object, metaclass=SingletonType):
     def __init__(self):
-        threads = 10
+        pools = api_settings.SCHEDULER_POOLS
+        threads = ', '.join(['{}: {}'.format(name, size) for name, size in pools.items()])
+        self.pools = pools
         self.is_mule = False
+        self.is_worker = False
+        self.job_queue: Optional[JobQueue] = None
         # If scheduler is already started, use uwsgi ipc to send job to mule process
         self.lock_f = open('/tmp/scheduler.lock', 'w')
         try:
@@ -47,36 +72,54 @@ class Scheduler(object, metaclass=SingletonType):
         else:
             self.use_mule = False
         caller = self.get_caller(caller=inspect.currentframe())
-        if caller == 'api':
+        self.use_queue = api_settings.SCHEDULER_QUEUE == 'redis' and caller != 'worker'
+        if self.use_queue:
+            self.use_mule = False
+            self.job_queue = JobQueue()
+            self._scheduler = None
+            logger.info("Use redis stream to send jobs to scheduler workers")
+        elif caller == 'api':
             sqlalchemy_url = app_settings.POSTGRES_DSN
             self._scheduler = BackgroundScheduler(
-                executors={'default': ThreadPoolExecutor(threads)},
+                executors=create_executors(pools, publish=True),
                 jobstores={'default': SQLAlchemyJobStore(url=sqlalchemy_url)},
                 job_defaults={},
                 timezone=utc
             )
-            logger.info("Scheduler started with persistent jobstore, {} threads".format(threads))
+            logger.info("Scheduler started with persistent jobstore, threads per pool: {}".format(threads))
         elif caller == 'mule':
             sqlalchemy_url = app_settings.POSTGRES_DSN
             self._scheduler = BackgroundScheduler(
-                executors={'default': ThreadPoolExecutor(threads)},
+                executors=create_executors(pools, publish=True),
                 jobstores={'default': SQLAlchemyJobStore(url=sqlalchemy_url)},
                 job_defaults={},
                 timezone=utc
             )
-            logger.info("Scheduler started with persistent jobstore, {} threads".format(threads))
+            logger.info("Scheduler started with persistent jobstore, threads per pool: {}".format(threads))
             self.is_mule = True
+        elif caller == 'worker':
+            # Jobs are kept in the redis stream until finished, so an
+            # in-memory jobstore is enough for queue workers
+            self.use_mule = False
+            self._scheduler = BackgroundScheduler(
+                executors=create_executors(pools, publish=True),
+                jobstores={'default': MemoryJobStore()},
+                job_defaults={},
+                timezone=utc
+            )
+            logger.info("Scheduler started as queue worker, threads per pool: {}".format(threads))
+            self.is_worker = True
         elif self.use_mule:
             logger.info("Use uwsgi to send jobs to mule process".format(threads))
             self._scheduler = None
         else:
             self._scheduler = BackgroundScheduler(
-                executors={'default': ThreadPoolExecutor(threads)},
+                executors=create_executors(pools),
                 jobstores={'default': MemoryJobStore()},
                 job_defaults={},
                 timezone=utc
             )
-            logger.info("Scheduler started with in-memory jobstore, {} threads".format(threads))
+            logger.info("Scheduler started with in-memory jobstore, threads per pool: {}".format(threads))
 
     def __del__(self):
         if self.lock_f:
@@ -100,6 +143,10 @@ class Scheduler(object, metaclass=SingletonType):
             logger.info("Scheduler started from filename {} function {} (uwsgi mule mode)".format(
                 filename, function))
             return 'mule'
+        elif filename == 'cnaas_nms/scheduler_worker.py':
+            logger.info("Scheduler started from filename {} function {} (queue worker mode)".format(
+                filename, function))
+            return 'worker'
         else:
             logger.info("Scheduler started from filename {} function {} (Standalone mode)".format(
                 filename, function))
@@ -114,16 +161,32 @@ class Scheduler(object, metaclass=SingletonType):
             return self._scheduler.shutdown()
 
     def add_local_job(self, func, **kwargs):
-        """Add job to local scheduler."""
+        """Add job to local scheduler. Unless an executor is specified, the
+        job runs in the executor pool configured for the job function."""
+        if 'executor' not in kwargs:
+            if isinstance(func, str):
+                func_name = func
+            else:
+                func_name = '{}:{}'.format(func.__module__, func.__qualname__)
+            kwargs['executor'] = get_job_pool(func_name, self.pools)
         return self._scheduler.add_job(func, **kwargs)
 
+    def get_pool_stats(self) -> dict:
+        """Get queue depth and wait time statistics for each executor pool
+        in the local scheduler."""
+        return {name: executor.stats.as_dict()
+                for name, executor in self._scheduler._executors.items()}
+
     def remove_local_job(self, job_id):
         """Remove job from local scheduler."""
         return self._scheduler.remove_job(str(job_id))
 
     def shutdown_mule(self):
-        """Send a message to the mule worker to shut itself down."""
-        if self.use_mule:
+        """Send a message to the mule worker, or all queue workers, to shut
+        itself down."""
+        if self.use_queue:
+            self.job_queue.publish_control({"scheduler_action": "shutdown"})
+        elif self.use_mule:
             try:
                 import uwsgi
             except Exception as e:
@@ -135,9 +198,16 @@ class Scheduler(object, metaclass=SingletonType):
             uwsgi.mule_msg(json.dumps(args))
 
     def remove_scheduled_job(self, job_id, abort_message="removed"):
-        """Remove scheduled job from mule worker or local scheduler depending
-        on setup."""
-        if self.use_mule:
+        """Remove scheduled job from mule worker, queue workers or local
+        scheduler depending on setup."""
+        if self.use_queue:
+            # Jobs not yet read from the queue are skipped by the workers
+            # since they are no longer in scheduled state
+            self.job_queue.publish_control({
+                "scheduler_action": "remove",
+                "id": str(job_id)
+            })
+        elif self.use_mule:
             try:
                 import uwsgi
             except Exception as e:
@@ -158,8 +228,8 @@ class Scheduler(object, metaclass=SingletonType):
     def add_onetime_job(self, func: Union[str, FunctionType],
                         when: Optional[int] = None,
                         scheduled_by: Optional[str] = None, **kwargs) -> int:
-        """Schedule a job to run at a later time on the mule worker or
-        local scheduler depending on setup.
+        """Schedule a job to run at a later time on the mule worker, queue
+        workers or local scheduler depending on setup.
 
         Some extra checks against kwargs are performed here. If kwarg
         with name 'dry_run' is included, (dry_run) is appended to function
@@ -220,7 +290,15 @@ class Scheduler(object, metaclass=SingletonType):
 
         kwargs['job_id'] = job_id
         kwargs['scheduled_by'] = scheduled_by
-        if self.use_mule:
+        if self.use_queue:
+            args = dict(kwargs)
+            args['func'] = func_qualname
+            args['trigger'] = trigger
+            args['run_date'] = run_date.isoformat() if run_date else None
+            args['id'] = str(job_id)
+            self.job_queue.publish(args)
+            return job_id
+        elif self.use_mule:
             try:
                 import uwsgi
             except Exception as e:
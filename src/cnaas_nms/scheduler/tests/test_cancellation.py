@@ -0,0 +1,56 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from cnaas_nms.scheduler.cancellation import CancellationService, wait_for_abort
+
+
+class CancellationTests(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.client.mget.return_value = [None]
+        self.service = CancellationService(self.client)
+        self.service.start_listener = mock.MagicMock()
+
+    def test_abort_message(self):
+        token = self.service.register(5)
+        self.assertFalse(token.cancelled)
+        self.service.handle_message({'data': json.dumps({'job_id': 6, 'reason': 'other'})})
+        self.assertFalse(token.cancelled)
+        self.service.handle_message({'data': 'invalid'})
+        self.service.handle_message({'data': json.dumps({'job_id': 5, 'reason': 'test'})})
+        self.assertTrue(token.cancelled)
+        self.assertEqual(token.reason, 'test')
+        self.service.unregister(5)
+        self.assertIsNone(self.service.get_token(5))
+
+    def test_pending_abort(self):
+        self.client.mget.return_value = ['test']
+        token = self.service.register('5')
+        self.client.mget.assert_called_with(['job_abort_5'])
+        self.assertTrue(token.cancelled)
+        self.assertIs(self.service.get_token(5), token)
+
+    def test_request_abort(self):
+        self.client.pipeline.return_value.execute.return_value = [True, 1]
+        self.assertEqual(self.service.request_abort(5, 'test'), 1)
+        pipe = self.client.pipeline.return_value
+        pipe.set.assert_called_once_with('job_abort_5', 'test', ex=86400)
+        pipe.publish.assert_called_once_with(
+            'job_abort', json.dumps({'job_id': 5, 'reason': 'test'}))
+
+    def test_wait_for_abort(self):
+        token = self.service.register(5)
+        self.service.connected = True
+        with mock.patch('cnaas_nms.scheduler.cancellation._cancellation_service', self.service):
+            self.assertFalse(wait_for_abort(5, 0.01))
+            threading.Timer(0.05, token.cancel).start()
+            start = time.monotonic()
+            self.assertTrue(wait_for_abort(5, 60))
+            self.assertLess(time.monotonic() - start, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import threading
+import time
+
+from cnaas_nms.scheduler.executor_pools import MonitoredThreadPoolExecutor, get_job_pool, \
+    aggregate_pool_stats
+
+
+class ExecutorPoolTests(unittest.TestCase):
+    def test_get_job_pool(self):
+        pools = {'default': 10, 'bulk_sync': 2}
+        self.assertEqual(
+            get_job_pool('cnaas_nms.confpush.sync_devices:sync_devices', pools), 'bulk_sync')
+        # Pool not configured
+        self.assertEqual(
+            get_job_pool('cnaas_nms.confpush.firmware:device_upgrade', pools), 'default')
+        self.assertEqual(get_job_pool('testfunc_success', pools), 'default')
+
+    def test_get_job_pool_init(self):
+        pools = {'default': 10, 'ztp': 2}
+        # Function names as scheduled by init_device and the device init API
+        for func_name in ['cnaas_nms.confpush.init_device:init_access_device_step1',
+                          'cnaas_nms.confpush.init_device:init_fabric_device_step1',
+                          'cnaas_nms.confpush.init_device:init_device_step2',
+                          'cnaas_nms.confpush.init_device:discover_device']:
+            self.assertEqual(get_job_pool(func_name, pools), 'ztp')
+
+    def test_pool_stats(self):
+        executor = MonitoredThreadPoolExecutor('test', 1)
+        started = threading.Event()
+        event = threading.Event()
+
+        def block():
+            started.set()
+            event.wait(5)
+
+        first = executor._pool.submit(block)
+        second = executor._pool.submit(lambda: True)
+        started.wait(5)
+        stats = executor.stats.as_dict()
+        self.assertEqual(stats['running'], 1)
+        self.assertEqual(stats['queued'], 1)
+        time.sleep(0.01)
+        event.set()
+        first.result()
+        self.assertTrue(second.result())
+        stats = executor.stats.as_dict()
+        self.assertEqual(stats['queued'], 0)
+        self.assertEqual(stats['started'], 2)
+        self.assertGreater(stats['wait_time_max'], 0)
+        executor.shutdown()
+
+    def test_aggregate_pool_stats(self):
+        worker1 = {'bulk_sync': {'size': 2, 'queued': 1, 'running': 2, 'started': 4,
+                                 'finished': 2, 'wait_time_avg': 1.0, 'wait_time_max': 3.0,
+                                 'wait_time_last': 2.0, 'updated': 100.0}}
+        worker2 = {'bulk_sync': {'size': 2, 'queued': 0, 'running': 1, 'started': 1,
+                                 'finished': 0, 'wait_time_avg': 6.0, 'wait_time_max': 6.0,
+                                 'wait_time_last': 6.0, 'updated': 200.0}}
+        stats = aggregate_pool_stats([worker1, worker2])['bulk_sync']
+        self.assertEqual((stats['size'], stats['queued'], stats['running'], stats['started']),
+                         (4, 1, 3, 5))
+        self.assertEqual(stats['wait_time_avg'], 2.0)
+        self.assertEqual(stats['wait_time_max'], 6.0)
+        self.assertEqual(stats['wait_time_last'], 6.0)
+        self.assertEqual(stats['processes'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
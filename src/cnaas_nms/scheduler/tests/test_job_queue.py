@@ -0,0 +1,66 @@
+import json
+import unittest
+from unittest import mock
+
+from cnaas_nms.db.job import JobStatus
+from cnaas_nms.db.joblock import JoblockError
+from cnaas_nms.scheduler.job_queue import JobQueue, QueuedJob
+
+
+class JobQueueTests(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.job_queue = JobQueue(self.client, consumer='worker1', visibility_timeout=60)
+
+    def test_read_new_jobs(self):
+        self.client.xpending_range.return_value = []
+        self.client.xreadgroup.return_value = [['scheduler_jobs', [
+            ('1-0', {'data': json.dumps({'id': '5', 'func': 'testfunc_success'})}),
+            ('1-1', {'data': 'invalid'}),
+        ]]]
+        jobs = self.job_queue.read(count=2)
+        self.assertEqual([(j.job_id, j.deliveries) for j in jobs], [('5', 1)])
+        self.assertEqual(self.job_queue.in_flight, {'5': '1-0'})
+        self.assertTrue(self.job_queue.ack_job(5))
+        self.assertFalse(self.job_queue.ack_job(5))
+        self.assertEqual(self.job_queue.in_flight, {})
+
+    def test_claim_stale_jobs(self):
+        self.client.xpending_range.return_value = [
+            {'message_id': '1-0', 'consumer': 'worker2', 'time_since_delivered': 120000,
+             'times_delivered': 1},
+            {'message_id': '1-1', 'consumer': 'worker2', 'time_since_delivered': 1000,
+             'times_delivered': 1},
+            {'message_id': '1-2', 'consumer': 'worker2', 'time_since_delivered': 120000,
+             'times_delivered': 2},
+        ]
+        # 1-2 was deleted from the stream
+        self.client.xclaim.return_value = [
+            ('1-0', {'data': json.dumps({'id': '5', 'func': 'testfunc_success'})}),
+            (None, None),
+        ]
+        jobs = self.job_queue.read(count=2)
+        self.client.xclaim.assert_called_once_with(
+            'scheduler_jobs', 'scheduler_workers', 'worker1', 60000, ['1-0', '1-2'])
+        self.client.xreadgroup.assert_not_called()
+        self.client.xack.assert_called_once_with('scheduler_jobs', 'scheduler_workers', '1-2')
+        self.assertEqual([(j.job_id, j.deliveries) for j in jobs], [('5', 2)])
+        self.assertEqual(self.job_queue.heartbeat(), 1)
+
+    @mock.patch('cnaas_nms.scheduler_worker.DeviceLock.release_locks', return_value=2)
+    @mock.patch('cnaas_nms.scheduler_worker.Joblock.release_lock', side_effect=JoblockError)
+    @mock.patch('cnaas_nms.scheduler_worker.sqla_session')
+    def test_check_running_job_releases_locks(self, sqla_session, release_lock, release_locks):
+        from cnaas_nms.scheduler_worker import check_queued_job
+        session = sqla_session.return_value.__enter__.return_value
+        job = session.query.return_value.filter.return_value.one_or_none.return_value
+        job.id = 5
+        job.status = JobStatus.RUNNING
+        self.assertFalse(check_queued_job(QueuedJob('1-0', {'id': '5'}, 2)))
+        job.finish_abort.assert_called_once()
+        release_lock.assert_called_once_with(session, job_id=5)
+        release_locks.assert_called_once_with(session, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,27 @@
+import json
 import traceback
 import threading
 
 from typing import Optional
 
+from sqlalchemy import cast, func, update
+from sqlalchemy.dialects.postgresql.json import JSONB
+
 from cnaas_nms.db.job import Job
+from cnaas_nms.scheduler.cancellation import get_cancellation_service
 from cnaas_nms.scheduler.jobresult import JobResult
 from cnaas_nms.tools.log import get_logger
 from cnaas_nms.db.session import redis_session
 from cnaas_nms.db.session import sqla_session
 from cnaas_nms.scheduler.thread_data import thread_data, set_thread_data
+from cnaas_nms.tools.event import add_event
 
 
 logger = get_logger()
+# Seconds between moving finished devices from redis to the database
+PROGRESS_INTERVAL = 2
+# Max number of finished devices read from redis per round trip
+PROGRESS_BATCH_SIZE = 1000
 
 
 def find_nextjob(result: JobResult) -> Optional[int]:
@@ -26,24 +36,55 @@ def insert_job_id(result: JobResult, job_id: int) -> JobResult:
     return result
 
 
-def update_device_progress(job_id: int):
+def update_device_progress(job_id: int) -> int:
+    """Move devices finished by a job from redis to the finished_devices
+    list of the job in the database, and send a job update event with the
+    newly finished devices.
+
+    Returns:
+        Number of newly finished devices
+    """
+    key = 'finished_devices_' + str(job_id)
     new_finished_devices = []
     with redis_session() as db:
-        while db.llen('finished_devices_' + str(job_id)) != 0:
-            last_finished = db.lpop('finished_devices_' + str(job_id))
-            new_finished_devices.append(last_finished)
+        while True:
+            pipe = db.pipeline()
+            pipe.lrange(key, 0, PROGRESS_BATCH_SIZE - 1)
+            pipe.ltrim(key, PROGRESS_BATCH_SIZE, -1)
+            batch, _ = pipe.execute()
+            new_finished_devices += batch
+            if len(batch) < PROGRESS_BATCH_SIZE:
+                break
 
-    if new_finished_devices:
-        with sqla_session() as session:
-            job = session.query(Job).filter(Job.id == job_id).one_or_none()
-            if not job:
-                raise ValueError("Could not find Job with ID {}".format(job_id))
-            finished_devices = job.finished_devices + new_finished_devices
-            job.finished_devices = finished_devices
+    if not new_finished_devices:
+        return 0
+
+    with sqla_session() as session:
+        finished_devices_count = session.execute(
+            update(Job.__table__).
+            where(Job.id == job_id).
+            values(finished_devices=func.coalesce(Job.finished_devices, cast([], JSONB)).
+                   op('||')(cast(new_finished_devices, JSONB))).
+            returning(func.jsonb_array_length(Job.finished_devices))
+        ).scalar()
+        if finished_devices_count is None:
+            raise ValueError("Could not find Job with ID {}".format(job_id))
+
+    try:
+        json_data = json.dumps({
+            "job_id": job_id,
+            "status": "RUNNING",
+            "new_finished_devices": new_finished_devices,
+            "finished_devices_count": finished_devices_count,
+        })
+        add_event(json_data=json_data, event_type="update", update_type="job")
+    except Exception as e:
+        logger.debug("Unable to send job progress event: {}".format(e))
+    return len(new_finished_devices)
 
 
 def update_device_progress_thread(stop_event: threading.Event, job_id: int):
-    while not stop_event.wait(2):
+    while not stop_event.wait(PROGRESS_INTERVAL):
         update_device_progress(job_id)
     update_device_progress(job_id)  # update one last time before exiting thread
 
@@ -73,6 +114,8 @@ def job_wrapper(func):
                 device_thread = threading.Thread(target=update_device_progress_thread,
                                                  args=(stop_event, job_id))
                 device_thread.start()
+        cancellation_service = get_cancellation_service()
+        cancellation_service.register(job_id)
         try:
             set_thread_data(job_id)
             # kwargs is contained in an item called kwargs because of the apscheduler.add_job call
@@ -83,6 +126,7 @@ def job_wrapper(func):
         except Exception as e:
             tb = traceback.format_exc()
             logger.debug("Exception traceback in job_wrapper: {}".format(tb))
+            cancellation_service.unregister(job_id)
             with sqla_session() as session:
                 job = session.query(Job).filter(Job.id == job_id).one_or_none()
                 if not job:
@@ -95,6 +139,7 @@ def job_wrapper(func):
                 session.commit()
             raise e
         else:
+            cancellation_service.unregister(job_id)
             if func.__name__ in progress_funcitons:
                 stop_event.set()
                 device_thread.join()
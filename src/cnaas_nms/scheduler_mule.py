@@ -5,7 +5,7 @@ import coverage
 import atexit
 import signal
 
-from cnaas_nms.scheduler.scheduler import Scheduler
+from cnaas_nms.scheduler.scheduler import Scheduler, pre_schedule_checks
 from cnaas_nms.plugins.pluginmanager import PluginManagerHandler
 from cnaas_nms.db.session import sqla_session
 from cnaas_nms.db.joblock import Joblock
@@ -38,26 +38,6 @@ if is_coverage_enabled():
     signal.signal(signal.SIGINT, save_coverage)
 
 
-def pre_schedule_checks(scheduler, kwargs):
-    check_ok = True
-    message = ""
-    for job in scheduler.get_scheduler().get_jobs():
-        # Only allow scheduling of one discover_device job at the same time
-        if job.name == 'cnaas_nms.confpush.init_device:discover_device':
-            if job.kwargs['kwargs']['dhcp_ip'] == kwargs['kwargs']['dhcp_ip']:
-                message = ("There is already another scheduled job to discover {} {}, skipping ".
-                           format(kwargs['kwargs']['ztp_mac'], kwargs['kwargs']['dhcp_ip']))
-                check_ok = False
-
-    if not check_ok:
-        logger.debug(message)
-        with sqla_session() as session:
-            job_entry: Job = session.query(Job).filter(Job.id == kwargs['job_id']).one_or_none()
-            job_entry.finish_abort(message)
-
-    return check_ok
-
-
 def main_loop():
     try:
         import uwsgi
@@ -0,0 +1,194 @@
+import datetime
+import json
+import signal
+import threading
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED
+from apscheduler.jobstores.base import JobLookupError
+
+from cnaas_nms.scheduler.scheduler import Scheduler, pre_schedule_checks
+from cnaas_nms.scheduler.job_queue import CONTROL_CHANNEL, MAX_DELIVERIES, JobQueue, QueuedJob
+from cnaas_nms.plugins.pluginmanager import PluginManagerHandler
+from cnaas_nms.db.session import sqla_session
+from cnaas_nms.db.job import Job, JobStatus
+from cnaas_nms.db.joblock import Joblock, JoblockError, DeviceLock
+from cnaas_nms.tools.log import get_logger
+
+
+logger = get_logger()
+
+
+def release_job_locks(session, job_id: int):
+    """Release locks held by a job that was running on a scheduler worker
+    that stopped, since queue workers don't clear locks at startup."""
+    try:
+        Joblock.release_lock(session, job_id=job_id)
+        logger.info("Released job lock held by job {}".format(job_id))
+    except JoblockError:
+        pass
+    count = DeviceLock.release_locks(session, job_id)
+    if count:
+        logger.info("Released {} device lock(s) held by job {}".format(count, job_id))
+
+
+def check_queued_job(queued_job: QueuedJob) -> bool:
+    """Check if a job read from the queue should be scheduled. Jobs removed
+    while waiting in the queue are skipped, and jobs that were running on
+    a worker that stopped are aborted instead of being started again."""
+    with sqla_session() as session:
+        job: Job = session.query(Job).filter(Job.id == int(queued_job.job_id)).one_or_none()
+        if not job:
+            logger.error("Job {} from queue not found in database".format(queued_job.job_id))
+            return False
+        if job.status == JobStatus.RUNNING:
+            logger.warning("Job {} was running on a scheduler worker that stopped".format(
+                job.id))
+            job.finish_abort("Scheduler worker running the job stopped unexpectedly")
+            release_job_locks(session, job.id)
+            return False
+        if job.status != JobStatus.SCHEDULED:
+            logger.debug("Skipping job {} from queue with status {}".format(
+                job.id, job.status.name))
+            return False
+        if queued_job.deliveries > MAX_DELIVERIES:
+            job.finish_abort("Job could not be started by any scheduler worker")
+            return False
+    return True
+
+
+def schedule_queued_job(scheduler: Scheduler, job_queue: JobQueue, queued_job: QueuedJob):
+    data = queued_job.data
+    try:
+        if not check_queued_job(queued_job):
+            job_queue.ack_job(queued_job.job_id)
+            return
+    except Exception as e:
+        logger.exception("Unable to check job {} from queue: {}".format(queued_job.job_id, e))
+        job_queue.release_job(queued_job.job_id)
+        return
+
+    kwargs = {}
+    for k, v in data.items():
+        if k not in ['func', 'trigger', 'id', 'run_date']:
+            kwargs[k] = v
+    # Perform pre-schedule job checks
+    try:
+        if not pre_schedule_checks(scheduler, kwargs):
+            job_queue.ack_job(queued_job.job_id)
+            return
+    except Exception as e:
+        logger.exception("Unable to perform pre-schedule job checks: {}".format(e))
+
+    run_date = None
+    if data.get('run_date'):
+        run_date = datetime.datetime.fromisoformat(data['run_date'])
+    try:
+        scheduler.add_local_job(data['func'], trigger=data['trigger'], kwargs=kwargs,
+                                id=data['id'], run_date=run_date, name=data['func'])
+    except Exception as e:
+        logger.exception("Unable to schedule job {} from queue: {}".format(
+            queued_job.job_id, e))
+        job_queue.release_job(queued_job.job_id)
+
+
+def control_loop(scheduler: Scheduler, job_queue: JobQueue, stop_event: threading.Event):
+    """Handle remove and shutdown messages sent to all workers."""
+    pubsub = job_queue.client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(CONTROL_CHANNEL)
+    while not stop_event.is_set():
+        try:
+            message = pubsub.get_message(timeout=1.0)
+            if not message:
+                continue
+            data: dict = json.loads(message['data'])
+        except json.JSONDecodeError as e:
+            logger.exception("Worker received non-JSON control message: {}".format(e))
+            continue
+        except Exception as e:
+            logger.exception("Error reading scheduler control messages: {}".format(e))
+            stop_event.wait(5)
+            continue
+        if data.get('scheduler_action') == "remove":
+            try:
+                scheduler.remove_local_job(data['id'])
+            except JobLookupError:
+                continue
+            job_queue.ack_job(data['id'])
+        elif data.get('scheduler_action') == "shutdown":
+            stop_event.set()
+    pubsub.close()
+
+
+def heartbeat_loop(job_queue: JobQueue, stop_event: threading.Event):
+    while not stop_event.wait(job_queue.visibility_timeout / 3):
+        try:
+            job_queue.heartbeat()
+        except Exception as e:
+            logger.exception("Unable to send heartbeat for queued jobs: {}".format(e))
+
+
+def main_loop():
+    print("Running scheduler queue worker")
+    scheduler = Scheduler()
+    scheduler.start()
+
+    pmh = PluginManagerHandler()
+    pmh.load_plugins()
+
+    # Job locks are not cleared at startup since other workers might be
+    # holding them
+    job_queue = JobQueue()
+    job_queue.create_group()
+    stop_event = threading.Event()
+    # Heartbeats are sent until running jobs have finished at shutdown
+    heartbeat_stop_event = threading.Event()
+
+    def job_done(event):
+        job_queue.ack_job(event.job_id)
+
+    scheduler.get_scheduler().add_listener(
+        job_done, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+    def stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    threads = [
+        threading.Thread(target=control_loop, args=(scheduler, job_queue, stop_event)),
+        threading.Thread(target=heartbeat_loop, args=(job_queue, heartbeat_stop_event)),
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Only read as many jobs as there are threads, so other workers can
+    # take remaining jobs
+    capacity = sum(scheduler.pools.values())
+    logger.info("Scheduler worker {} reading jobs from queue, capacity {}".format(
+        job_queue.consumer, capacity))
+    while not stop_event.is_set():
+        free = capacity - len(job_queue.in_flight)
+        if free <= 0:
+            stop_event.wait(1)
+            continue
+        try:
+            queued_jobs = job_queue.read(count=free, block=5000)
+        except Exception as e:
+            logger.exception("Unable to read jobs from queue: {}".format(e))
+            stop_event.wait(5)
+            continue
+        for queued_job in queued_jobs:
+            schedule_queued_job(scheduler, job_queue, queued_job)
+
+    # Wait for running jobs to finish, jobs that have not been started yet
+    # are claimed by other workers after the visibility timeout
+    logger.info("Scheduler worker {} shutting down".format(job_queue.consumer))
+    scheduler.shutdown()
+    heartbeat_stop_event.set()
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == '__main__':
+    main_loop()